@@ -5,7 +5,7 @@ from .models import (
     Campaign, CampaignVariant, CampaignRun, CampaignRecipient, 
     CampaignMessage, SendQueue, Contest, ContestEntry, TenantUser,
     CustomerGroup, GroupMember, BlastCampaign, BlastRecipient,
-    ContestConversationStep, UserConversationProgress
+    ContestConversationStep, UserConversationProgress, WebhookInboxEvent
 )
 
 # =============================================================================
@@ -333,4 +333,15 @@ class BlastRecipientAdmin(admin.ModelAdmin):
             'customer',
             'blast_campaign',
             'tenant'
-        )
\ No newline at end of file
+        )
+
+# =============================================================================
+# WEBHOOK INBOX ADMIN
+# =============================================================================
+
+@admin.register(WebhookInboxEvent)
+class WebhookInboxEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'event_type', 'msg_id', 'status', 'attempts', 'received_at', 'processed_at']
+    search_fields = ['msg_id', 'instance_id']
+    list_filter = ['status', 'event_type', 'received_at']
+    readonly_fields = ['event_id', 'received_at', 'locked_at', 'processed_at']
@@ -0,0 +1,169 @@
+"""
+Admission control / load shedding for the WABot webhook.
+
+During a campaign launch the webhook gets thousands of hits a minute; admitting all
+of them saturates the workers, replies slow down and WABot's retries add even more
+load. The controller looks at two signals before the view does any work:
+
+- in-flight: webhook payloads currently being processed in this process
+  (inline requests + inbox workers), tracked with `track()`
+- inbox depth: pending `WebhookInboxEvent` rows, refreshed at most once per
+  WABOT_ADMISSION_DEPTH_REFRESH_SECONDS by a single COUNT
+
+When either is over its threshold the webhook is "overloaded":
+- inbound message events are deferred: only the raw payload (with its msg_id as the
+  dedupe key) is stored as a `deferred` inbox row, processed after pending work.
+  Retries of a msg_id that is already deferred are dropped (coalesced).
+- non-message events (status updates, receipts, presence, chats/contacts sync)
+  are dropped; nothing downstream consumes them.
+
+Every decision is counted in `stats` (see `admission_stats()`), shown on the
+webhook inbox status page.
+
+Thresholds (env, 0 disables a check):
+- WABOT_ADMISSION_MAX_INFLIGHT (default 64)
+- WABOT_ADMISSION_MAX_INBOX_DEPTH (default 5000)
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+MAX_INFLIGHT = int(os.getenv("WABOT_ADMISSION_MAX_INFLIGHT", "64") or 0)
+MAX_INBOX_DEPTH = int(os.getenv("WABOT_ADMISSION_MAX_INBOX_DEPTH", "5000") or 0)
+DEPTH_REFRESH_SECONDS = float(os.getenv("WABOT_ADMISSION_DEPTH_REFRESH_SECONDS", "1.0") or 1.0)
+DEFER_TTL_SECONDS = 24 * 3600
+
+ADMIT, DEFER, DROP = "admit", "defer", "drop"
+
+# Inbound messages; `messages.update`/`messages.delete`/receipts are status events.
+INBOUND_EVENTS = frozenset({"message", "incoming_message", "messages", "message_received", "messages.upsert"})
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(*keys):
+    with _stats_lock:
+        for key in keys:
+            stats[key] += 1
+
+
+def is_inbound_message(event_type):
+    return (str(event_type).lower() if event_type else "") in INBOUND_EVENTS
+
+
+class AdmissionController:
+    """In-flight + inbox-depth gate; one per process (see `get_controller`)."""
+
+    def __init__(self, max_inflight=MAX_INFLIGHT, max_inbox_depth=MAX_INBOX_DEPTH,
+                 depth_refresh_seconds=DEPTH_REFRESH_SECONDS):
+        self.max_inflight = max_inflight
+        self.max_inbox_depth = max_inbox_depth
+        self.depth_refresh_seconds = depth_refresh_seconds
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._depth_at = 0.0
+        self._refreshing = False
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def inbox_depth(self):
+        """Pending inbox rows; one thread refreshes, the others read the last value."""
+        now = time.monotonic()
+        if now - self._depth_at < self.depth_refresh_seconds:
+            return self._depth
+        with self._lock:
+            if self._refreshing:
+                return self._depth
+            self._refreshing = True
+        try:
+            from .models import WebhookInboxEvent
+            self._depth = WebhookInboxEvent.objects.filter(status="pending").count()
+        except Exception as e:
+            logger.warning("Admission depth check failed: %s", e)
+        finally:
+            self._depth_at = time.monotonic()
+            self._refreshing = False
+        return self._depth
+
+    def overload_reason(self):
+        """None when healthy, else "inflight" or "inbox_depth"."""
+        if self.max_inflight and self.in_flight >= self.max_inflight:
+            return "inflight"
+        if self.max_inbox_depth and self.inbox_depth() >= self.max_inbox_depth:
+            return "inbox_depth"
+        return None
+
+    def decide(self, top):
+        """
+        ADMIT, DEFER or DROP for one decoded webhook body, plus the reason.
+        Never raises; errors admit the request.
+        """
+        try:
+            reason = self.overload_reason()
+            if reason is None:
+                _count("admitted")
+                return ADMIT, None
+
+            from .webhook_events import peek_webhook
+            event_type, _, msg_id = peek_webhook(top)
+            if not is_inbound_message(event_type):
+                _count("dropped", f"dropped:{event_type or 'unknown'}", f"overload:{reason}")
+                return DROP, reason
+
+            if msg_id:
+                from .idempotency import claim
+                if not claim(f"wabot:deferred:{msg_id}", ttl=DEFER_TTL_SECONDS):
+                    _count("coalesced", f"overload:{reason}")
+                    return DROP, reason
+            _count("deferred", f"overload:{reason}")
+            return DEFER, reason
+        except Exception as e:
+            logger.warning("Admission check failed, admitting: %s", e)
+            _count("admitted", "errors")
+            return ADMIT, None
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
+
+
+def track():
+    """Count one payload as in flight for the duration (context manager)."""
+    return get_controller().track()
+
+
+def admission_stats():
+    controller = get_controller()
+    with _stats_lock:
+        counters = dict(stats)
+    return {
+        "in_flight": controller.in_flight,
+        "inbox_depth": controller._depth,
+        "max_inflight": controller.max_inflight,
+        "max_inbox_depth": controller.max_inbox_depth,
+        "counters": counters,
+    }
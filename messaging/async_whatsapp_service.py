@@ -0,0 +1,260 @@
+"""
+Asyncio WABot sender with bounded concurrency.
+
+The blast loop used to send one message at a time with a 0.5s sleep in between
+(about 2 msg/s per campaign). `AsyncWhatsAppAPIService` keeps up to
+`concurrency` sends in flight on one `httpx.AsyncClient` (keep-alive pool sized
+to match), gives every send its own deadline, and yields `SendResult`s as they
+complete. With a `limiter` (see rate_limiter) sends also wait for tokens, so the
+provider's allowed rate is filled but not exceeded. Sends also go through the
+instance's circuit breaker (see circuit_breaker): while it is open no new sends
+start, and jobs it never let through come back marked `circuit_open`.
+
+Django code is synchronous, so callers use the sync bridge:
+
+    service = AsyncWhatsAppAPIService(concurrency=16)
+    for result in service.send_iter(jobs):   # jobs: list of SendJob
+        ...  # ORM work happens here, on the caller's thread
+
+`send_iter` runs the event loop on a helper thread and hands results back through
+a queue, so the ORM is never touched from inside the loop.
+
+Settings (env):
+- WABOT_ASYNC_CONCURRENCY: sends in flight (default 16)
+- WABOT_ASYNC_DEADLINE_SECONDS: per-send deadline incl. waiting for the connection (default 30)
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import chain, islice
+from typing import Any, Dict, Optional
+
+import httpx
+
+from .circuit_breaker import MAX_WAIT_SECONDS as BREAKER_MAX_WAIT_SECONDS
+from .circuit_breaker import CLOSED, count_rejected, is_provider_failure
+from .wabot_http import CONNECT_TIMEOUT, READ_TIMEOUT
+from .whatsapp_service import WhatsAppAPIService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = int(os.getenv("WABOT_ASYNC_CONCURRENCY", "16") or 16)
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("WABOT_ASYNC_DEADLINE_SECONDS", "30") or 30)
+
+_DONE = object()
+
+
+@dataclass
+class SendJob:
+    """One outbound message. `key` is echoed back on the result (e.g. a recipient id)."""
+    key: Any
+    number: str
+    message: str = ""
+    media_url: Optional[str] = None
+    filename: Optional[str] = None
+
+
+@dataclass
+class SendResult:
+    key: Any
+    success: bool
+    data: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    latency: float = 0.0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def as_dict(self):
+        """Same shape as the sync WhatsAppAPIService send methods return."""
+        if self.success:
+            return {'success': True, 'data': self.data}
+        return {'success': False, 'error': self.error}
+
+
+def circuit_open_result(job):
+    """Result for a job that was never sent because the breaker stayed open."""
+    count_rejected()
+    return SendResult(job.key, False, error='WABot circuit open', extra={'circuit_open': True})
+
+
+class AsyncWhatsAppAPIService:
+    """Async WABot /send client (same credentials/env as WhatsAppAPIService)."""
+
+    def __init__(self, concurrency=None, deadline=None, sync_service=None, limiter=None, max_wait=None):
+        self.concurrency = max(1, int(concurrency or DEFAULT_CONCURRENCY))
+        self.deadline = float(deadline or DEFAULT_DEADLINE_SECONDS)
+        # Optional rate_limiter.RateLimiter shared with other senders on the same connection
+        self.limiter = limiter
+        # Payload format, credentials and the send kill-switch come from the sync service.
+        self.sync_service = sync_service or WhatsAppAPIService()
+        # Same breaker as the sync service, so sync and async senders pause together
+        self.breaker = self.sync_service.breaker
+        self.max_wait = BREAKER_MAX_WAIT_SECONDS if max_wait is None else float(max_wait)
+        self._client = None
+        self._slots = None
+
+    @property
+    def base_url(self):
+        return self.sync_service.base_url
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+        self._slots = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self._client = None
+
+    def _payload(self, job):
+        if job.media_url:
+            payload = self.sync_service.build_send_payload(
+                job.number, "media", message=job.message, media_url=job.media_url
+            )
+            if job.filename:
+                payload["filename"] = job.filename
+            return payload
+        return self.sync_service.build_send_payload(job.number, "text", message=job.message)
+
+    async def _post(self, job):
+        response = await self._client.post(
+            f"{self.base_url}/send",
+            content=json.dumps(self._payload(job)),
+            headers={'Content-Type': 'application/json'},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def send(self, job):
+        """
+        Send one job (waits for a concurrency slot). Never raises. The outcome is fed
+        to the circuit breaker; `stream` asks the breaker before starting a send.
+        """
+        if self.sync_service._send_disabled():
+            return SendResult(job.key, False, error='WABOT_DISABLE_SEND is true (outbound sending disabled)')
+        async with self._slots:
+            start = time.perf_counter()
+            status_code = None
+            try:
+                data = await asyncio.wait_for(self._post(job), timeout=self.deadline)
+                self.breaker.record(True)
+                return SendResult(job.key, True, data=data, latency=time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                error = f"deadline exceeded ({self.deadline:g}s)"
+            except httpx.HTTPStatusError as e:
+                status_code = e.response.status_code
+                error = str(e)
+            except (httpx.HTTPError, ValueError) as e:
+                error = str(e) or e.__class__.__name__
+            self.breaker.record(not is_provider_failure(status_code))
+            return SendResult(job.key, False, error=error, latency=time.perf_counter() - start,
+                              extra={'status_code': status_code} if status_code else {})
+
+    async def _tokens(self, n):
+        """Tokens from the rate limiter (its store is synchronous, so off the loop)."""
+        if self.limiter is None:
+            return n
+        return await asyncio.to_thread(self.limiter.acquire, n)
+
+    async def _start(self, ready, n, pending):
+        """Start up to `n` ready jobs; returns how many the breaker let through."""
+        if self.sync_service._send_disabled():
+            # `send` fails these at once: no breaker slot (never recorded) or tokens
+            started = n
+        else:
+            # Ask the breaker first: tokens taken for sends it then refuses would be lost
+            allowed = self.breaker.allow(n)
+            if not allowed:
+                return 0
+            started = await self._tokens(allowed)
+            if started < allowed:
+                self.breaker.release(allowed - started)
+        for _ in range(started):
+            pending.add(asyncio.ensure_future(self.send(ready.popleft())))
+        return started
+
+    async def stream(self, jobs):
+        """
+        Async generator of results in completion order. At most `concurrency` sends
+        are in flight; jobs are started as slots free up and the rate limiter (if
+        any) grants tokens, which are taken in batches of up to the free slots.
+
+        While the instance's circuit breaker is open nothing new starts. If it stays
+        open for `max_wait` seconds, every job not yet started comes back as a
+        `circuit_open_result` so the caller can requeue it.
+        """
+        pending = set()
+        ready = deque()
+        jobs = iter(jobs)
+        exhausted = False
+        paused_since = None
+        while True:
+            free = self.concurrency - len(pending)
+            if free > 0 and not ready and not exhausted:
+                ready.extend(islice(jobs, free))
+                exhausted = len(ready) < free
+            blocked = free > 0 and bool(ready) and not await self._start(ready, min(free, len(ready)), pending)
+            # The pause lasts until the breaker closes again (half-open probes included)
+            if self.breaker.state == CLOSED:
+                paused_since = None
+            elif paused_since is None:
+                paused_since = time.monotonic()
+            if blocked and paused_since is not None and time.monotonic() - paused_since >= self.max_wait:
+                for job in chain(ready, jobs):
+                    yield circuit_open_result(job)
+                ready.clear()
+                exhausted = True
+                blocked = False
+            wake = max(self.breaker.retry_after(), 0.01) if blocked else None
+            if not pending:
+                if ready:
+                    await asyncio.sleep(wake or 0)
+                    continue
+                return
+            done, pending = await asyncio.wait(pending, timeout=wake, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+    async def _pump(self, jobs, out):
+        async with self:
+            async for result in self.stream(jobs):
+                out.put(result)
+
+    def send_iter(self, jobs):
+        """
+        Sync bridge: send `jobs` concurrently and yield each SendResult on the
+        calling thread as soon as it completes.
+        """
+        out = queue.Queue()
+        failure = []
+
+        def run():
+            try:
+                asyncio.run(self._pump(list(jobs), out))
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                out.put(_DONE)
+
+        thread = threading.Thread(target=run, name="wabot-async-sender", daemon=True)
+        thread.start()
+        while True:
+            item = out.get()
+            if item is _DONE:
+                break
+            yield item
+        thread.join()
+        if failure:
+            raise failure[0]
+
+    def send_all(self, jobs):
+        """Sync bridge returning every result (completion order)."""
+        return list(self.send_iter(jobs))
@@ -13,6 +13,7 @@ from django.db import transaction
 from .models import Contest, ContestEntry, Customer, Tenant, Conversation, WhatsAppConnection
 from .contest_flow_models import ContestFlowState
 from .whatsapp_service import WhatsAppAPIService
+from .outbox import enqueue_message
 
 logger = logging.getLogger(__name__)
 
@@ -345,14 +346,10 @@ class AutoContestService:
             message_text: Message content
         """
         try:
-            result = self.wa_service.send_text_message(customer.phone_number, message_text)
-            
-            if result['success']:
-                # Create message record
-                self._create_message_record(tenant, customer, message_text, 'outbound', 'sent')
-                logger.info(f"Sent contest message to {customer.name}")
-            else:
-                logger.error(f"Failed to send message to {customer.name}: {result.get('error', 'Unknown error')}")
+            # Queued in the outbox; the dispatcher sends it after commit
+            self._create_message_record(tenant, customer, message_text, 'outbound', 'queued',
+                                        send={'number': customer.phone_number, 'message': message_text})
+            logger.info(f"Queued contest message to {customer.name}")
                 
         except Exception as e:
             logger.error(f"Error sending message to customer: {str(e)}")
@@ -368,19 +365,14 @@ class AutoContestService:
             caption: Media caption
         """
         try:
-            result = self.wa_service.send_media_message(customer.phone_number, caption, media_url)
-            
-            if result['success']:
-                # Create message record
-                self._create_message_record(tenant, customer, f"{caption} [Media]", 'outbound', 'sent')
-                logger.info(f"Sent media message to {customer.name}")
-            else:
-                logger.error(f"Failed to send media to {customer.name}: {result.get('error', 'Unknown error')}")
+            self._create_message_record(tenant, customer, f"{caption} [Media]", 'outbound', 'queued',
+                                        send={'number': customer.phone_number, 'message': caption, 'media_url': media_url})
+            logger.info(f"Queued media message to {customer.name}")
                 
         except Exception as e:
             logger.error(f"Error sending media message: {str(e)}")
     
-    def _create_message_record(self, tenant, customer, message_text, direction, status):
+    def _create_message_record(self, tenant, customer, message_text, direction, status, send=None):
         """
         Create message record in database
         
@@ -390,6 +382,7 @@ class AutoContestService:
             message_text: Message content
             direction: 'inbound' or 'outbound'
             status: Message status
+            send: Outbox send request; the record is queued for the dispatcher
         """
         try:
             # Get or create conversation
@@ -405,6 +398,9 @@ class AutoContestService:
                 )
             
             # Create message record
+            if send is not None:
+                enqueue_message(tenant, conversation=conversation, text_body=message_text, **send)
+                return
             from .models import CoreMessage
             CoreMessage.objects.create(
                 tenant=tenant,
@@ -0,0 +1,120 @@
+"""
+Media preparation for blast campaigns, done once per campaign instead of per message.
+
+A media blast used to hand WABot the raw `message_image_url` for every recipient,
+so WABot fetched the original (often multi-MB) upload from Cloudinary once per
+message, each fetch a cold miss for the transformation it needed. Before the
+first send, `prepare_blast_media(campaign)`:
+
+1. optimizes: Cloudinary upload URLs get a delivery transformation
+   (WABOT_BLAST_MEDIA_TRANSFORM, default: JPEG, quality auto, max 1600px), so
+   every send points at one small WhatsApp-friendly derivative
+2. validates and warms: fetches that URL once through the pooled WABot HTTP
+   session (image content, under WhatsApp's 5 MB image limit), which also makes
+   the CDN build and cache the derivative before WABot asks for it
+3. caches the result on the campaign (`BlastCampaign.prepared_media`), keyed by
+   the source URL, so reruns/resumes and parallel workers reuse it
+
+Every recipient is then sent the prepared URL by reference. WABot's API takes
+media by URL only (no upload endpoint), so the handle is the warmed URL.
+
+A file that is not an image, too large or missing raises `BlastMediaError` and the
+blast fails before any message goes out. Transient fetch problems (timeouts, 5xx)
+fall back to the original URL without caching anything.
+"""
+import logging
+import os
+from urllib.parse import urlsplit
+
+import requests
+from django.utils import timezone as dj_timezone
+
+from . import wabot_http
+from .media_cache import looks_like_image
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TRANSFORM = os.getenv("WABOT_BLAST_MEDIA_TRANSFORM", "c_limit,w_1600,h_1600,q_auto:good,f_jpg")
+# WhatsApp rejects images above 5 MB
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+FETCH_TIMEOUT = 30
+
+
+class BlastMediaError(Exception):
+    """The campaign's media cannot be sent (not an image, too large, gone)."""
+
+
+def optimized_url(url):
+    """Cloudinary upload URL with the delivery transformation applied; other URLs unchanged."""
+    marker = "/image/upload/"
+    parts = urlsplit(url)
+    if not MEDIA_TRANSFORM or "res.cloudinary.com" not in parts.netloc or marker not in parts.path:
+        return url
+    head, tail = url.split(marker, 1)
+    if tail.startswith(MEDIA_TRANSFORM + "/"):
+        return url
+    return f"{head}{marker}{MEDIA_TRANSFORM}/{tail}"
+
+
+def media_filename(source, url):
+    """Original file name; converted to .jpg when the Cloudinary transformation re-encodes it."""
+    name = os.path.basename(urlsplit(source).path) or "image"
+    if url != source and "f_jpg" in MEDIA_TRANSFORM:
+        name = f"{os.path.splitext(name)[0] or 'image'}.jpg"
+    return name
+
+
+def _fetch_and_check(url):
+    """Fetch `url` once; returns (content_type, size). Raises BlastMediaError / RequestException."""
+    response = wabot_http.get(url, timeout=(wabot_http.CONNECT_TIMEOUT, FETCH_TIMEOUT))
+    if 400 <= response.status_code < 500:
+        raise BlastMediaError(f"media URL returned {response.status_code}: {url}")
+    response.raise_for_status()
+    content = response.content or b""
+    content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+    if not content_type.startswith("image/") and not looks_like_image(content):
+        raise BlastMediaError(f"media is not an image ({content_type or 'unknown type'}): {url}")
+    if len(content) > MAX_IMAGE_BYTES:
+        raise BlastMediaError(f"media is {len(content)} bytes, over WhatsApp's {MAX_IMAGE_BYTES} byte limit: {url}")
+    return content_type or "image/jpeg", len(content)
+
+
+def prepare_blast_media(campaign):
+    """
+    The prepared media handle for `campaign` ({"url", "filename", ...}), or None for
+    text-only blasts. Reuses the cached handle while the source URL is unchanged.
+    """
+    source = campaign.message_image_url
+    if not source:
+        return None
+    cached = campaign.prepared_media or {}
+    if cached.get("source") == source and cached.get("url"):
+        return cached
+
+    url = optimized_url(source)
+    try:
+        try:
+            content_type, size = _fetch_and_check(url)
+        except BlastMediaError:
+            if url == source:
+                raise
+            # Transformation refused (e.g. not a raster image Cloudinary can convert); try the original
+            logger.warning("Optimized blast media failed validation, using original: %s", source)
+            url = source
+            content_type, size = _fetch_and_check(url)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Blast media not prepared (%s); sending original URL: %s", e, source)
+        return {"source": source, "url": source, "filename": media_filename(source, source)}
+
+    handle = {
+        "source": source,
+        "url": url,
+        "filename": media_filename(source, url),
+        "content_type": content_type,
+        "bytes": size,
+        "prepared_at": dj_timezone.now().isoformat(),
+    }
+    campaign.prepared_media = handle
+    campaign.save(update_fields=["prepared_media"])
+    logger.info("Blast media prepared: campaign=%s bytes=%s url=%s", campaign.blast_id, size, url)
+    return handle
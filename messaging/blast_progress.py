@@ -0,0 +1,184 @@
+"""
+Live progress for blast campaigns, cheap enough to poll.
+
+The progress endpoint used to run one COUNT(*) over BlastRecipient per status on
+every poll, and the detail page polls it for as long as a campaign sends. Progress
+now comes from counters the send engine keeps on the campaign row (sent_count,
+failed_count and queued_count, F() updates per result flush, see blast_tasks), so
+a read is one primary-key lookup and `pending` is derived
+(total - sent - failed - queued). If the counters do not add up (a campaign
+still being prepared, counters from before they were kept, a lost race) a single
+GROUP BY status query is used instead.
+
+Snapshots are shared per process for WABOT_BLAST_PROGRESS_TTL seconds, so any
+number of open dashboards cost at most one read per campaign per TTL. Dashboards
+long-poll (`wait_for_progress`): a request returns as soon as the progress differs
+from the version the client already has, or after WABOT_BLAST_PROGRESS_WAIT
+seconds, and the client asks again. At most WABOT_BLAST_PROGRESS_MAX_WAITERS
+requests per process wait at a time; the rest are answered at once and told to
+poll later, so dashboards can never tie up the request threads the webhook needs.
+
+Answers carry only what changed (`progress_payload`): each process remembers the
+last MAX_VERSIONS payloads it sent by version, and a client whose version is
+among them gets `changes` (the fields that differ, empty after a quiet wait)
+instead of the whole payload. An unknown version (first request, another process,
+forgotten) gets the full payload.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import Count
+
+from .models import BlastCampaign, BlastRecipient
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TTL = float(os.getenv("WABOT_BLAST_PROGRESS_TTL", "1.0") or 1.0)
+# Longest a long-poll request is held, and how many may be held per process
+WAIT_SECONDS = float(os.getenv("WABOT_BLAST_PROGRESS_WAIT", "5") or 5)
+MAX_WAITERS = int(os.getenv("WABOT_BLAST_PROGRESS_MAX_WAITERS", "8") or 8)
+WAIT_INTERVAL = 0.5
+# Seconds a client told to back off waits before asking again
+RETRY_AFTER_SECONDS = 5
+RECIPIENT_STATUSES = ['pending', 'queued', 'sent', 'delivered', 'failed', 'skipped']
+FINAL_STATUSES = {'completed', 'failed', 'cancelled'}
+MAX_SNAPSHOTS = 1000
+# Payloads remembered per process to answer with changes only
+MAX_VERSIONS = 1000
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+_versions = OrderedDict()  # version -> progress, most recently sent last
+_waiters = threading.BoundedSemaphore(max(1, MAX_WAITERS))
+stats = {"reads": 0, "shared": 0, "fallbacks": 0, "waits": 0, "busy": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        stats[key] += 1
+
+
+def recipient_status_counts(campaign):
+    """Exact per-status recipient counts: one GROUP BY query."""
+    counts = dict.fromkeys(RECIPIENT_STATUSES, 0)
+    counts.update(
+        BlastRecipient.objects.filter(blast_campaign=campaign)
+        .values_list('status').annotate(n=Count('pk')).values_list('status', 'n')
+    )
+    return counts
+
+
+def _counts_from_row(campaign):
+    """Per-status counts from the campaign's counters, or None if they do not add up."""
+    if campaign.status == 'preparing':
+        return None
+    pending = campaign.total_recipients - campaign.sent_count - campaign.failed_count - campaign.queued_count
+    if min(pending, campaign.queued_count, campaign.sent_count, campaign.failed_count) < 0:
+        return None
+    counts = dict.fromkeys(RECIPIENT_STATUSES, 0)
+    counts.update(pending=pending, queued=campaign.queued_count, sent=campaign.sent_count,
+                  failed=campaign.failed_count)
+    return counts
+
+
+def progress_snapshot(campaign):
+    """The progress payload for `campaign` (the progress endpoint's JSON minus 'success')."""
+    status_counts = _counts_from_row(campaign)
+    if status_counts is None:
+        _count("fallbacks")
+        status_counts = recipient_status_counts(campaign)
+    return {
+        'campaign_status': campaign.status,
+        'total_recipients': campaign.total_recipients,
+        'sent_count': campaign.sent_count,
+        'delivered_count': campaign.delivered_count,
+        'failed_count': campaign.failed_count,
+        'success_rate': campaign.success_rate,
+        'status_counts': status_counts,
+        'started_at': campaign.started_at.isoformat() if campaign.started_at else None,
+        'completed_at': campaign.completed_at.isoformat() if campaign.completed_at else None,
+    }
+
+
+def campaign_progress(blast_id):
+    """
+    (tenant_id, progress) for a campaign, or None if it does not exist. Shared by
+    every caller in this process for PROGRESS_TTL seconds.
+    """
+    key = str(blast_id)
+    now = time.monotonic()
+    with _snapshots_lock:
+        hit = _snapshots.get(key)
+    if hit is not None and now - hit[0] < PROGRESS_TTL:
+        _count("shared")
+        return hit[1]
+    campaign = BlastCampaign.objects.filter(blast_id=blast_id).first()
+    _count("reads")
+    if campaign is None:
+        return None
+    snapshot = (campaign.tenant_id, progress_snapshot(campaign))
+    with _snapshots_lock:
+        if len(_snapshots) >= MAX_SNAPSHOTS:
+            _snapshots.clear()
+        _snapshots[key] = (now, snapshot)
+    return snapshot
+
+
+def progress_version(progress):
+    """A short fingerprint of a progress payload; clients send it back to wait for a change."""
+    return hashlib.md5(json.dumps(progress, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def progress_payload(progress, since=None):
+    """
+    The response body for `progress`: its `version` plus either `changes` (fields
+    that differ from version `since`) or, when this process does not know `since`,
+    every field.
+    """
+    version = progress_version(progress)
+    with _snapshots_lock:
+        previous = _versions.get(since) if since else None
+        _versions[version] = progress
+        _versions.move_to_end(version)
+        while len(_versions) > MAX_VERSIONS:
+            _versions.popitem(last=False)
+    if previous is None:
+        return {**progress, 'version': version}
+    changes = {key: value for key, value in progress.items() if previous.get(key) != value}
+    return {'version': version, 'changes': changes}
+
+
+def wait_for_progress(blast_id, version=None, timeout=WAIT_SECONDS):
+    """
+    (tenant_id, progress, retry_after) once the campaign's progress differs from
+    `version`, it is finished, or `timeout` passes; None if the campaign does not
+    exist. `retry_after` is 0 unless the process already holds MAX_WAITERS
+    waiting requests, in which case the current progress is returned at once.
+    """
+    snapshot = campaign_progress(blast_id)
+    if snapshot is None:
+        return None
+    if not version:
+        return (*snapshot, 0)
+    if not _waiters.acquire(blocking=False):
+        _count("busy")
+        return (*snapshot, RETRY_AFTER_SECONDS)
+    _count("waits")
+    try:
+        deadline = time.monotonic() + timeout
+        while (progress_version(snapshot[1]) == version
+               and snapshot[1]['campaign_status'] not in FINAL_STATUSES
+               and time.monotonic() < deadline):
+            time.sleep(WAIT_INTERVAL)
+            snapshot = campaign_progress(blast_id)
+            if snapshot is None:
+                return None
+        return (*snapshot, 0)
+    finally:
+        _waiters.release()
@@ -1,151 +1,720 @@
 """
 Background tasks for WhatsApp Blasting
-Can be integrated with Celery or run synchronously for now
+
+A blast is sent by workers, not by the request that starts it. `blast_send_campaign`
+marks the campaign 'sending'; blast workers then repeatedly claim a chunk of its
+pending recipients (conditional UPDATE pending -> queued, tagged with a claim
+token, so any number of threads and processes can share one campaign without
+sending a recipient twice) and send the chunk concurrently through the
+connection's shared rate limiter. Throughput scales with the number of workers
+up to that limit. The worker that sends the last chunk completes the campaign.
+
+Claims are leases (FOR UPDATE SKIP LOCKED where the database has it). A worker
+renews its lease as it records results; a lease left to expire by a dead worker
+is reclaimed: recipients never handed to WABot return to pending, those whose
+send had started are failed as "delivery unknown" instead of being sent twice.
+A worker that hits an error hands its unsent rows back the same way and leaves the
+campaign sending; only a campaign-wide problem (its image) fails the campaign.
+`resume_campaign` restarts a stuck, failed or cancelled campaign from there.
+
+Large targets are materialized the same way: a campaign whose recipient list is too
+big to build inside the create request is 'preparing' until the workers have
+inserted its recipients, batch by batch, and then becomes 'draft'.
+
+Workers run either:
+- in-process (daemon threads started when a campaign is sent), sized by
+  WABOT_BLAST_INPROCESS_WORKERS (default 1, set 0 to disable), or
+- as dedicated processes via `python manage.py run_blast_workers`.
+
+`send_blast_campaign_task(campaign_id)` drains one campaign in the calling thread.
 """
-import time
+import os
 import logging
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from itertools import chain
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F, Q
 from django.utils import timezone as dj_timezone
-from .models import BlastCampaign, BlastRecipient, Conversation, CoreMessage
+from .models import BlastCampaign, BlastRecipient, ContestEntry, Conversation, CoreMessage, Customer, GroupMember
 from .whatsapp_service import WhatsAppAPIService
+from .async_whatsapp_service import AsyncWhatsAppAPIService, SendJob, SendResult, circuit_open_result
+from .circuit_breaker import CLOSED, MAX_WAIT_SECONDS as BREAKER_MAX_WAIT_SECONDS
+from .blast_media import BlastMediaError, prepare_blast_media
+from .customer_resolver import record_outbound
+from .rate_limiter import limiter_for_blast
+from .templating import compile_template, customer_context, needs_custom_data
 
 logger = logging.getLogger(__name__)
 
-def send_blast_campaign_task(campaign_id):
+# "async" (default): AsyncWhatsAppAPIService with bounded concurrency.
+# "sync": legacy one-at-a-time sends.
+# Either way the rate comes from the shared token buckets in rate_limiter.
+BLAST_SENDER = os.getenv("WABOT_BLAST_SENDER", "async").lower()
+# Recipients claimed (and sent concurrently) per worker iteration
+CHUNK_SIZE = int(os.getenv("WABOT_BLAST_CHUNK_SIZE", "200") or 200)
+# Send outcomes are written in batches: every N results or T milliseconds
+FLUSH_EVERY = int(os.getenv("WABOT_BLAST_FLUSH_EVERY", "50") or 50)
+FLUSH_INTERVAL_MS = int(os.getenv("WABOT_BLAST_FLUSH_MS", "500") or 500)
+# A chunk is sent in windows; each window's messages are marked 'sending' first, so
+# a reclaimed lease tells never-sent recipients from ones with an unknown outcome
+SEND_WINDOW = int(os.getenv("WABOT_BLAST_SEND_WINDOW", "100") or 100)
+# Claims not renewed for this long belong to a dead worker and are reclaimed
+LEASE_SECONDS = int(os.getenv("WABOT_BLAST_LEASE_SECONDS", "300") or 300)
+UNKNOWN_OUTCOME = "worker stopped mid-send; delivery unknown"
+# Recipients inserted per statement batch when a campaign is created; targets larger
+# than MATERIALIZE_INLINE_MAX are materialized by the blast workers instead
+MATERIALIZE_BATCH = int(os.getenv("WABOT_BLAST_MATERIALIZE_BATCH", "5000") or 5000)
+MATERIALIZE_INLINE_MAX = int(os.getenv("WABOT_BLAST_MATERIALIZE_INLINE_MAX", "5000") or 5000)
+
+# Wakes idle in-process workers as soon as a campaign starts sending
+_wakeup = threading.Event()
+_inprocess_lock = threading.Lock()
+_inprocess_pool = None
+
+
+def _send_jobs(campaign, recipients, media=None):
+    # Every recipient references the same prepared media (see blast_media)
+    media_url = media["url"] if media else None
+    filename = media.get("filename") if media else None
+    return [
+        SendJob(
+            key=r.recipient_id,
+            number=r.customer.phone_number,
+            message=r.message.text_body,
+            media_url=media_url,
+            filename=filename,
+        )
+        for r in recipients
+    ]
+
+
+def _send_results(wa_service, campaign, recipients, media=None):
+    """Yield a SendResult per recipient, in completion order."""
+    jobs = _send_jobs(campaign, recipients, media)
+    # Shared token buckets: connection (+ tenant, + this blast's throttle_per_min)
+    limiter = limiter_for_blast(campaign)
+    if BLAST_SENDER != "sync":
+        yield from AsyncWhatsAppAPIService(sync_service=wa_service, limiter=limiter).send_iter(jobs)
+        return
+    breaker = wa_service.breaker
+    paused_since = None
+    jobs = iter(jobs)
+    for job in jobs:
+        # Pause while the connection's breaker is open; if it has not closed again
+        # within the limit, hand the rest back
+        if breaker.state == CLOSED:
+            paused_since = None
+        elif paused_since is None:
+            paused_since = time.monotonic()
+        if paused_since is not None:
+            left = BREAKER_MAX_WAIT_SECONDS - (time.monotonic() - paused_since)
+            if not breaker.wait(left):
+                for rest in chain([job], jobs):
+                    yield circuit_open_result(rest)
+                return
+        limiter.acquire(1)
+        try:
+            if job.media_url:
+                result = wa_service.send_media_message(number=job.number, message=job.message,
+                                                       media_url=job.media_url, filename=job.filename)
+            else:
+                result = wa_service.send_text_message(number=job.number, message=job.message)
+            yield SendResult(job.key, bool(result.get('success')), data=result.get('data'),
+                             error=result.get('error', 'Unknown error'),
+                             extra={'circuit_open': True} if result.get('circuit_open') else {})
+        except Exception as e:
+            yield SendResult(job.key, False, error=str(e))
+
+
+def _conversations_for(campaign, recipients):
     """
-    Background task to send blast campaign messages
-    Can be called synchronously or via Celery
+    Customer id -> Conversation on the campaign's connection for a chunk: one SELECT,
+    plus one INSERT for customers who have none yet.
     """
-    try:
-        campaign = BlastCampaign.objects.get(blast_id=campaign_id)
-        
-        # Initialize WhatsApp service
-        wa_service = WhatsAppAPIService()
-        
-        # Get recipients
-        recipients = BlastRecipient.objects.filter(
-            blast_campaign=campaign, 
-            status='pending'
-        ).select_related('customer')
-        
-        sent_count = 0
-        failed_count = 0
-        
-        # Send messages to each recipient
+    customer_ids = {r.customer_id for r in recipients}
+    convos = {}
+    for convo in Conversation.objects.filter(
+        tenant=campaign.tenant,
+        whatsapp_connection_id=campaign.whatsapp_connection_id,
+        customer_id__in=customer_ids,
+    ).order_by('created_at'):
+        convos.setdefault(convo.customer_id, convo)
+    missing = [
+        Conversation(tenant=campaign.tenant, customer_id=customer_id,
+                     whatsapp_connection_id=campaign.whatsapp_connection_id, channel='whatsapp')
+        for customer_id in customer_ids - convos.keys()
+    ]
+    Conversation.objects.bulk_create(missing)
+    convos.update({convo.customer_id: convo for convo in missing})
+    return convos
+
+
+def _message_texts(campaign, recipients):
+    """
+    The campaign's message rendered for each recipient (see templating). Custom
+    columns come from the recipients' GroupMember rows in the targeted groups: one
+    query per chunk, and only if the message uses them.
+    """
+    template = compile_template(campaign.message_text)
+    if not template.fields:
+        return [campaign.message_text] * len(recipients)
+    custom = {}
+    if needs_custom_data(template):
+        for customer_id, data in GroupMember.objects.filter(
+            group__blast_campaigns=campaign, customer_id__in={r.customer_id for r in recipients},
+        ).exclude(custom_data={}).values_list('customer_id', 'custom_data'):
+            if isinstance(data, dict):
+                custom.setdefault(customer_id, {}).update(data)
+    return template.render_many([customer_context(r.customer, custom.get(r.customer_id)) for r in recipients])
+
+
+def _queue_messages(campaign, recipients):
+    """
+    Create (or reuse, on a rerun) each recipient's CoreMessage in status 'queued',
+    with the message rendered for that recipient, and mark the recipients queued,
+    in one transaction and a handful of statements. Keyed "blast:<recipient_id>".
+    These rows carry no outbox payload: the blast sends them itself (the text sent
+    is the row's text_body). Returns customer id -> Conversation.
+    """
+    texts = _message_texts(campaign, recipients)
+    with transaction.atomic():
+        convos = _conversations_for(campaign, recipients)
+        keyed = {f"blast:{r.recipient_id}": (r, text) for r, text in zip(recipients, texts)}
+        CoreMessage.objects.bulk_create(
+            [
+                CoreMessage(
+                    tenant=campaign.tenant,
+                    conversation=convos[r.customer_id],
+                    direction='outbound',
+                    status='queued',
+                    text_body=text,
+                    to_number=''.join(filter(str.isdigit, r.customer.phone_number or '')),
+                    idempotency_key=key,
+                )
+                for key, (r, text) in keyed.items()
+            ],
+            # A rerun keeps the message created the first time
+            ignore_conflicts=True,
+        )
+        for msg in CoreMessage.objects.filter(idempotency_key__in=keyed):
+            keyed[msg.idempotency_key][0].message = msg
         for recipient in recipients:
-            try:
-                # Update status to queued
-                recipient.status = 'queued'
-                recipient.save()
-                
-                # Send message via WABot
-                if campaign.message_image_url:
-                    # Send media message
-                    result = wa_service.send_media_message(
-                        number=recipient.customer.phone_number,
-                        message=campaign.message_text,
-                        media_url=campaign.message_image_url
-                    )
-                else:
-                    # Send text message
-                    result = wa_service.send_text_message(
-                        number=recipient.customer.phone_number,
-                        message=campaign.message_text
-                    )
-                
-                if result.get('success'):
-                    # Update recipient status to sent
+            recipient.status = 'queued'
+        BlastRecipient.objects.bulk_update(recipients, ['status', 'message'])
+    return convos
+
+
+# =============================================================================
+# RECIPIENT MATERIALIZATION
+# =============================================================================
+
+def target_customer_ids(campaign):
+    """
+    Distinct ids of the customers the campaign targets (group members plus contest
+    participants), as one query: the union and dedupe happen in the database.
+    """
+    return Customer.objects.filter(tenant_id=campaign.tenant_id).filter(
+        Q(pk__in=GroupMember.objects.filter(group__in=campaign.target_groups.all()).values('customer_id'))
+        | Q(pk__in=ContestEntry.objects.filter(contest__in=campaign.target_contests.all()).values('customer_id'))
+    ).values_list('pk', flat=True)
+
+
+def materialize_recipients_batch(campaign, batch_size=MATERIALIZE_BATCH):
+    """
+    Insert the next `batch_size` targeted customers that are not recipients yet.
+    Returns how many were inserted (0 when the campaign is fully materialized).
+    Safe to repeat or run concurrently: existing recipients are skipped.
+    """
+    customer_ids = list(
+        target_customer_ids(campaign)
+        .exclude(pk__in=BlastRecipient.objects.filter(blast_campaign=campaign).values('customer_id'))
+        .order_by('pk')[:batch_size]
+    )
+    if not customer_ids:
+        return 0
+    BlastRecipient.objects.bulk_create(
+        [
+            BlastRecipient(tenant_id=campaign.tenant_id, blast_campaign=campaign, customer_id=customer_id, status='pending')
+            for customer_id in customer_ids
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    return len(customer_ids)
+
+
+def materialize_recipients(campaign, batch_size=MATERIALIZE_BATCH, max_batches=None):
+    """
+    Materialize the campaign's recipients in batches (each its own short
+    transaction), keeping `total_recipients` current as progress. When done a
+    'preparing' campaign becomes 'draft'. Returns True once fully materialized.
+    """
+    campaign_row = BlastCampaign.objects.filter(blast_id=campaign.blast_id)
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        inserted = materialize_recipients_batch(campaign, batch_size=batch_size)
+        total = BlastRecipient.objects.filter(blast_campaign=campaign).count()
+        if not inserted:
+            campaign_row.update(total_recipients=total)
+            if campaign_row.filter(status='preparing').update(status='draft'):
+                logger.info("Blast campaign %s prepared: %s recipients", campaign.blast_id, total)
+            campaign.total_recipients = total
+            return True
+        campaign_row.update(total_recipients=total)
+        batches += 1
+    return False
+
+
+def materialize_next_campaign(batch_size=MATERIALIZE_BATCH):
+    """Insert one batch for the oldest 'preparing' campaign. Returns True if there was one."""
+    campaign = BlastCampaign.objects.filter(status='preparing').order_by('created_at').first()
+    if campaign is None:
+        return False
+    materialize_recipients(campaign, batch_size=batch_size, max_batches=1)
+    return True
+
+
+# =============================================================================
+# CLAIM + SEND
+# =============================================================================
+
+def _lease_expiry():
+    return dj_timezone.now() + timedelta(seconds=LEASE_SECONDS)
+
+
+def claim_recipients(campaign, limit=CHUNK_SIZE):
+    """
+    Lease up to `limit` pending recipients of `campaign` (pending -> queued, tagged
+    with a claim token, expiring after WABOT_BLAST_LEASE_SECONDS) and return them.
+    Rows another worker is claiming are skipped (FOR UPDATE SKIP LOCKED).
+    """
+    token = uuid.uuid4().hex
+    pending = BlastRecipient.objects.filter(blast_campaign=campaign, status='pending')
+    # Without SKIP LOCKED (SQLite) workers can race for the same oldest rows: the
+    # loser retries on the next ones
+    for _ in range(3):
+        with transaction.atomic():
+            ids = list(
+                pending.select_for_update(skip_locked=True)
+                .order_by('created_at', 'recipient_id')
+                .values_list('recipient_id', flat=True)[:limit]
+            )
+            if not ids:
+                return []
+            claimed = BlastRecipient.objects.filter(recipient_id__in=ids, status='pending').update(
+                status='queued', claim_token=token, lease_expires_at=_lease_expiry(),
+            )
+            if claimed:
+                _count_queued(campaign.blast_id, claimed)
+        if claimed:
+            return list(BlastRecipient.objects.filter(claim_token=token, status='queued').select_related('customer'))
+    return []
+
+
+def _hold_window(recipients):
+    """
+    Renew the lease on a window about to be sent and mark its messages 'sending'.
+    Returns the recipients this worker still holds (an expired lease may have been
+    reclaimed meanwhile; those are someone else's now).
+    """
+    token = recipients[0].claim_token
+    ids = [r.recipient_id for r in recipients]
+    with transaction.atomic():
+        held = BlastRecipient.objects.filter(claim_token=token, status='queued', recipient_id__in=ids)
+        held.update(lease_expires_at=_lease_expiry())
+        held_ids = set(held.values_list('recipient_id', flat=True))
+        window = [r for r in recipients if r.recipient_id in held_ids]
+        CoreMessage.objects.filter(message_id__in=[r.message_id for r in window]).update(status='sending')
+    for recipient in window:
+        recipient.message.status = 'sending'
+    return window
+
+
+def _count_queued(campaign_id, delta):
+    """Keep `BlastCampaign.queued_count` (live progress, see blast_progress) in step with claims."""
+    BlastCampaign.objects.filter(blast_id=campaign_id).update(queued_count=F('queued_count') + delta)
+
+
+def _release_claim(recipients):
+    """
+    Hand the unsent rest of a chunk back (queued -> pending) for the next claim.
+    Rows whose message is 'sending' (outcome unknown) keep their lease.
+    """
+    released = BlastRecipient.objects.filter(
+        claim_token=recipients[0].claim_token, status='queued',
+    ).exclude(message__status='sending').update(status='pending', lease_expires_at=None)
+    if released:
+        _count_queued(recipients[0].blast_campaign_id, -released)
+
+
+def recover_expired_leases(campaign=None):
+    """
+    Reclaim chunks whose worker stopped renewing its lease (crashed or restarted).
+    Recipients whose message never went to WABot go back to pending. Those whose
+    send had started (message 'sending', outcome unknown) are failed rather than
+    risk sending twice. Returns (released, failed).
+    """
+    expired = BlastRecipient.objects.filter(status='queued', lease_expires_at__lt=dj_timezone.now())
+    if campaign is not None:
+        expired = expired.filter(blast_campaign=campaign)
+    with transaction.atomic():
+        unknown = list(expired.filter(message__status='sending').values_list(
+            'recipient_id', 'message_id', 'blast_campaign_id'
+        ))
+        if unknown:
+            BlastRecipient.objects.filter(recipient_id__in=[u[0] for u in unknown], status='queued').update(
+                status='failed', error_message=UNKNOWN_OUTCOME, lease_expires_at=None,
+            )
+            CoreMessage.objects.filter(message_id__in=[u[1] for u in unknown]).update(
+                status='failed', last_error=UNKNOWN_OUTCOME,
+            )
+            for campaign_id, n in Counter(u[2] for u in unknown).items():
+                BlastCampaign.objects.filter(blast_id=campaign_id).update(
+                    failed_count=F('failed_count') + n, queued_count=F('queued_count') - n,
+                )
+        per_campaign = Counter(expired.values_list('blast_campaign_id', flat=True))
+        released = expired.update(status='pending', lease_expires_at=None)
+        for campaign_id, n in per_campaign.items():
+            _count_queued(campaign_id, -n)
+    if released or unknown:
+        logger.warning("Blast leases expired: %s recipients released, %s failed (delivery unknown)",
+                       released, len(unknown))
+    return released, len(unknown)
+
+
+def _fail_campaign(campaign, reason):
+    BlastCampaign.objects.filter(blast_id=campaign.blast_id, status='sending').update(status='failed')
+    logger.error("Blast campaign %s failed: %s", campaign.blast_id, reason)
+
+
+def finish_campaign_if_done(campaign):
+    """
+    Complete the campaign once no recipient is pending or queued, with counts taken
+    from the recipients. Only one worker wins the final UPDATE.
+    """
+    recipients = BlastRecipient.objects.filter(blast_campaign=campaign)
+    if recipients.filter(status__in=['pending', 'queued']).exists():
+        return False
+    counts = dict(recipients.values_list('status').annotate(n=Count('pk')).values_list('status', 'n'))
+    sent_count = counts.get('sent', 0) + counts.get('delivered', 0)
+    failed_count = counts.get('failed', 0)
+    finished = BlastCampaign.objects.filter(blast_id=campaign.blast_id, status='sending').update(
+        # Partial success still counts as completed
+        status='failed' if failed_count and not sent_count else 'completed',
+        sent_count=sent_count,
+        failed_count=failed_count,
+        delivered_count=sent_count,
+        queued_count=0,
+        completed_at=dj_timezone.now(),
+    )
+    if finished:
+        logger.info("Blast campaign %s completed: %s sent, %s failed", campaign.blast_id, sent_count, failed_count)
+    return bool(finished)
+
+
+def _flush_results(campaign, recipients):
+    """
+    Write buffered outcomes: a bulk UPDATE per table and one F() counter update,
+    and renew the lease on the rest of the chunk. Only rows this worker still
+    holds are written: if its lease expired meanwhile, `recover_expired_leases`
+    has already settled (and counted) them. Returns the sent/failed/requeued
+    counts actually written.
+    """
+    token = recipients[0].claim_token
+    flush_token = uuid.uuid4().hex
+    with transaction.atomic():
+        # Re-tag the rows still held before reading them back: starting with the
+        # UPDATE takes the write lock first (SQLite cannot upgrade a read lock)
+        BlastRecipient.objects.filter(
+            claim_token=token, status='queued', recipient_id__in=[r.recipient_id for r in recipients],
+        ).update(claim_token=flush_token)
+        held_ids = set(BlastRecipient.objects.filter(claim_token=flush_token).values_list('recipient_id', flat=True))
+        held = [r for r in recipients if r.recipient_id in held_ids]
+        if len(held) < len(recipients):
+            logger.warning("Blast %s: %s results dropped, lease lost", campaign.blast_id, len(recipients) - len(held))
+        counts = Counter(r.status for r in held)
+        applied = {'sent': counts['sent'], 'failed': counts['failed'], 'requeued': counts['pending']}
+        if held:
+            BlastRecipient.objects.bulk_update(held, ['status', 'sent_at', 'error_message'])
+            CoreMessage.objects.bulk_update([r.message for r in held], ['status', 'sent_at', 'last_error'])
+            sent = [r for r in held if r.status == 'sent']
+            if sent:
+                Conversation.objects.filter(
+                    conversation_id__in={r.message.conversation_id for r in sent}
+                ).update(last_message_at=dj_timezone.now())
+            # Campaign statistics; F() since other workers update them too
+            BlastCampaign.objects.filter(blast_id=campaign.blast_id).update(
+                sent_count=F('sent_count') + applied['sent'],
+                delivered_count=F('delivered_count') + applied['sent'],
+                failed_count=F('failed_count') + applied['failed'],
+                queued_count=F('queued_count') - len(held),
+            )
+        BlastRecipient.objects.filter(claim_token=token, status='queued').update(
+            lease_expires_at=_lease_expiry(),
+        )
+    return applied
+
+
+def send_chunk(campaign, recipients, media=None, wa_service=None):
+    """
+    Send claimed recipients window by window and record the outcomes, buffered and
+    written every WABOT_BLAST_FLUSH_EVERY results or WABOT_BLAST_FLUSH_MS
+    milliseconds. Returns sent/failed/requeued counts.
+    """
+    wa_service = wa_service or WhatsAppAPIService()
+    by_id = {r.recipient_id: r for r in recipients}
+    totals = {'sent': 0, 'failed': 0, 'requeued': 0}
+    
+    # Record every message as queued before the first send (outbox style): a crash
+    # mid-blast leaves queued records, never a sent message without one.
+    try:
+        _queue_messages(campaign, recipients)
+    except Exception:
+        _release_claim(recipients)
+        raise
+    
+    buffered = []
+    requeued = False
+    last_flush = time.monotonic()
+    
+    campaign_row = BlastCampaign.objects.filter(blast_id=campaign.blast_id)
+    try:
+        for start in range(0, len(recipients), SEND_WINDOW):
+            if start and not campaign_row.filter(status='sending').exists():
+                # Cancelled (or failed) meanwhile: stop before the next window
+                break
+            window = _hold_window(recipients[start:start + SEND_WINDOW])
+            # Results arrive as sends complete (up to WABOT_ASYNC_CONCURRENCY in flight)
+            for result in _send_results(wa_service, campaign, window, media):
+                recipient = by_id[result.key]
+                msg = recipient.message
+                now = dj_timezone.now()
+                if result.extra.get('circuit_open'):
+                    # Never sent: WABot is failing. Back to pending for a later claim
+                    # (its queued message record is reused then).
+                    recipient.status = 'pending'
+                    recipient.error_message = result.error
+                    msg.status = 'queued'
+                    requeued = True
+                elif result.success:
                     recipient.status = 'sent'
-                    recipient.sent_at = dj_timezone.now()
-                    recipient.save()
-                    sent_count += 1
-                    
-                    # Create conversation and message record
-                    conn = campaign.whatsapp_connection
-                    convo, _ = Conversation.objects.get_or_create(
-                        tenant=campaign.tenant,
-                        customer=recipient.customer,
-                        whatsapp_connection=conn,
-                        defaults={'channel': 'whatsapp'}
-                    )
-                    
-                    # Update last message time
-                    convo.last_message_at = dj_timezone.now()
-                    convo.save()
-                    
-                    # Create message record
-                    msg = CoreMessage.objects.create(
-                        tenant=campaign.tenant,
-                        conversation=convo,
-                        direction='outbound',
-                        status='sent',
-                        text_body=campaign.message_text,
-                        sent_at=dj_timezone.now()
-                    )
-                    
-                    # Link message to recipient
-                    recipient.message = msg
-                    recipient.save()
-                    
-                    logger.info(f"Successfully sent blast message to {recipient.customer.phone_number}")
+                    recipient.sent_at = now
+                    msg.status = 'sent'
+                    msg.sent_at = now
+                    # Keep the inbound resolver's echo detection current (no query on reply)
+                    record_outbound(campaign.tenant_id, recipient.customer.phone_number, msg.text_body, sent_at=now)
+                    logger.debug("Successfully sent blast message to %s", recipient.customer.phone_number)
                 else:
-                    # Mark as failed
                     recipient.status = 'failed'
-                    recipient.error_message = result.get('error', 'Unknown error')
-                    recipient.save()
-                    failed_count += 1
-                    logger.error(f"Failed to send blast message to {recipient.customer.phone_number}: {result.get('error')}")
-                
-                # Update campaign statistics in real-time
-                campaign.sent_count = sent_count
-                campaign.failed_count = failed_count
-                campaign.delivered_count = sent_count
-                campaign.save()
-                
-                # Rate limiting: small delay between messages
-                time.sleep(0.5)  # 0.5 second delay
-                
-            except Exception as e:
-                # Mark as failed
-                recipient.status = 'failed'
-                recipient.error_message = str(e)
-                recipient.save()
-                failed_count += 1
-                logger.error(f"Error sending blast message to {recipient.customer.phone_number}: {str(e)}")
-        
-        # Update final campaign statistics
-        campaign.sent_count = sent_count
-        campaign.failed_count = failed_count
-        campaign.delivered_count = sent_count
-        
-        # Update campaign status
-        if failed_count == 0:
-            campaign.status = 'completed'
-        elif sent_count == 0:
-            campaign.status = 'failed'
-        else:
-            campaign.status = 'completed'  # Partial success
-        
-        campaign.completed_at = dj_timezone.now()
-        campaign.save()
-        
-        logger.info(f"Blast campaign {campaign_id} completed: {sent_count} sent, {failed_count} failed")
-        
-        return {
-            'success': True,
-            'sent_count': sent_count,
-            'failed_count': failed_count
-        }
-        
+                    recipient.error_message = result.error or 'Unknown error'
+                    msg.status = 'failed'
+                    msg.last_error = recipient.error_message[:1000]
+                    logger.error("Failed to send blast message to %s: %s", recipient.customer.phone_number, result.error)
+                buffered.append(recipient)
+            
+                if len(buffered) >= FLUSH_EVERY or time.monotonic() - last_flush >= FLUSH_INTERVAL_MS / 1000.0:
+                    applied = _flush_results(campaign, buffered)
+                    for key in totals:
+                        totals[key] += applied[key]
+                    buffered, last_flush = [], time.monotonic()
+            if requeued:
+                # The breaker gave up on WABot; don't wait it out again for the next window
+                break
+    finally:
+        # Windows not sent (breaker open, campaign stopped, an error) go back to
+        # pending. After an error, rows caught mid-send stay leased until
+        # `recover_expired_leases` settles them; the campaign itself carries on.
+        if buffered:
+            applied = _flush_results(campaign, buffered)
+            for key in totals:
+                totals[key] += applied[key]
+        _release_claim(recipients)
+    return totals
+
+
+def run_campaign_chunk(campaign, chunk_size=CHUNK_SIZE, wa_service=None):
+    """
+    Claim and send one chunk of `campaign`. Returns the chunk's counts, or None when
+    nothing was left to claim (the campaign is completed if it is done).
+    """
+    recipients = claim_recipients(campaign, limit=chunk_size)
+    if not recipients:
+        finish_campaign_if_done(campaign)
+        return None
+    try:
+        # Validate/optimize/warm the image once for the whole campaign (cached on it)
+        media = prepare_blast_media(campaign)
+    except BlastMediaError as e:
+        # Nothing went out: hand the chunk back and stop the campaign
+        _release_claim(recipients)
+        _fail_campaign(campaign, e)
+        raise
+    counts = send_chunk(campaign, recipients, media=media, wa_service=wa_service)
+    if counts['requeued']:
+        logger.warning("Blast campaign %s paused: %s recipients requeued (WABot circuit open)",
+                       campaign.blast_id, counts['requeued'])
+    finish_campaign_if_done(campaign)
+    return counts
+
+
+def run_next_chunk(chunk_size=CHUNK_SIZE):
+    """Send one chunk of the oldest sending campaign with pending recipients. Returns its counts or None."""
+    campaigns = BlastCampaign.objects.filter(status='sending').select_related(
+        'tenant', 'whatsapp_connection'
+    ).order_by('started_at')
+    for campaign in campaigns:
+        counts = run_campaign_chunk(campaign, chunk_size=chunk_size)
+        if counts is not None:
+            return counts
+    return None
+
+
+def resume_campaign(campaign):
+    """
+    Continue a campaign where it stopped: reclaim expired leases, put it back to
+    'sending' and wake the workers. Already sent or failed recipients are not sent
+    again. Returns the number of recipients left to send.
+    """
+    recover_expired_leases(campaign)
+    BlastCampaign.objects.filter(blast_id=campaign.blast_id).update(status='sending', completed_at=None)
+    campaign.status = 'sending'
+    remaining = BlastRecipient.objects.filter(blast_campaign=campaign, status__in=['pending', 'queued']).count()
+    if remaining:
+        wake_blast_workers()
+    else:
+        finish_campaign_if_done(campaign)
+    return remaining
+
+
+def send_blast_campaign_task(campaign_id, chunk_size=CHUNK_SIZE):
+    """
+    Send a sending campaign's pending recipients in this thread, chunk by chunk.
+    Blast workers may be sending other chunks of it at the same time.
+    """
+    sent_count = failed_count = requeued_count = 0
+    try:
+        while True:
+            campaign = BlastCampaign.objects.select_related('tenant', 'whatsapp_connection').get(blast_id=campaign_id)
+            if campaign.status != 'sending':
+                break
+            counts = run_campaign_chunk(campaign, chunk_size=chunk_size)
+            if counts is None:
+                break
+            sent_count += counts['sent']
+            failed_count += counts['failed']
+            requeued_count += counts['requeued']
+            if counts['requeued']:
+                # Stay in 'sending'; workers resume once WABot recovers
+                break
     except Exception as e:
-        logger.error(f"Error in send_blast_campaign_task: {str(e)}")
-        try:
-            campaign = BlastCampaign.objects.get(blast_id=campaign_id)
-            campaign.status = 'failed'
-            campaign.save()
-        except:
-            pass
+        # The chunk's claim was handed back (send_chunk); workers pick the campaign up again
+        logger.error("Error in send_blast_campaign_task: %s", e, exc_info=True)
         return {
             'success': False,
             'error': str(e)
         }
+    
+    result = {
+        'success': True,
+        'sent_count': sent_count,
+        'failed_count': failed_count
+    }
+    if requeued_count:
+        result['requeued_count'] = requeued_count
+    return result
+
+
+# =============================================================================
+# WORKERS
+# =============================================================================
+
+def blast_worker_stats():
+    recipients = BlastRecipient.objects.filter(blast_campaign__status='sending')
+    counts = dict(recipients.values_list('status').annotate(n=Count('pk')).values_list('status', 'n'))
+    return {
+        "campaigns_preparing": BlastCampaign.objects.filter(status='preparing').count(),
+        "campaigns_sending": BlastCampaign.objects.filter(status='sending').count(),
+        "pending": counts.get('pending', 0),
+        "queued": counts.get('queued', 0),
+        "sent": counts.get('sent', 0) + counts.get('delivered', 0),
+        "failed": counts.get('failed', 0),
+    }
+
+
+class BlastWorkerPool:
+    """
+    Threads sending blast chunks. Used by both the in-process workers and the
+    `run_blast_workers` management command.
+    """
+
+    def __init__(self, size=1, chunk_size=CHUNK_SIZE, poll_interval=2.0, name="blast"):
+        self.size = max(1, int(size))
+        self.chunk_size = max(1, int(chunk_size))
+        self.poll_interval = float(poll_interval)
+        self.name = name
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("Blast worker pool started: %s threads (%s)", self.size, self.worker_id)
+        return self
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        _wakeup.set()
+        for t in self._threads:
+            t.join(timeout=timeout)
+
+    def is_alive(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def _run(self):
+        last_lease_check = 0.0
+        try:
+            while not self._stop.is_set():
+                busy = False
+                try:
+                    close_old_connections()
+                    if time.monotonic() - last_lease_check > LEASE_SECONDS / 4:
+                        recover_expired_leases()
+                        last_lease_check = time.monotonic()
+                    # Campaigns being prepared first: one insert batch per iteration
+                    busy = materialize_next_campaign() or run_next_chunk(chunk_size=self.chunk_size) is not None
+                except Exception as e:
+                    logger.error("Blast worker loop error: %s", e, exc_info=True)
+                    time.sleep(self.poll_interval)
+                if not busy:
+                    _wakeup.wait(self.poll_interval)
+                    _wakeup.clear()
+        finally:
+            connection.close()
+
+
+def ensure_inprocess_workers():
+    """Lazily start the in-process blast worker pool (once per process)."""
+    global _inprocess_pool
+    size = int(os.getenv("WABOT_BLAST_INPROCESS_WORKERS", "1") or 0)
+    if size <= 0:
+        return None
+    if _inprocess_pool is not None and _inprocess_pool.is_alive():
+        return _inprocess_pool
+    with _inprocess_lock:
+        if _inprocess_pool is None or not _inprocess_pool.is_alive():
+            _inprocess_pool = BlastWorkerPool(size=size, name="blast-inprocess").start()
+    return _inprocess_pool
+
 
+def wake_blast_workers():
+    """Start preparing/sending campaigns now (in-process workers if enabled; dedicated workers poll)."""
+    ensure_inprocess_workers()
+    _wakeup.set()
@@ -8,6 +8,7 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
 from django.utils import timezone as dj_timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib import messages
 import openpyxl
 import csv
@@ -22,7 +23,12 @@ from .models import (
     Contest, ContestEntry, Conversation, CoreMessage
 )
 from .whatsapp_service import WhatsAppAPIService
-from .blast_tasks import send_blast_campaign_task
+from .blast_progress import campaign_progress, progress_payload, wait_for_progress
+from .templating import CUSTOMER_FIELDS, TemplateError, validate_template
+from .blast_tasks import (
+    MATERIALIZE_INLINE_MAX, materialize_recipients, resume_campaign, target_customer_ids,
+    wake_blast_workers,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -208,11 +214,17 @@ def blast_import_group(request):
                 else:
                     existing_count += 1
                 
-                # Add to group
+                # Add to group; other columns are kept for message placeholders (see templating)
                 GroupMember.objects.get_or_create(
                     tenant=tenant,
                     group=group,
-                    customer=customer
+                    customer=customer,
+                    defaults={
+                        'custom_data': {
+                            key: value if isinstance(value, (str, int, float, bool)) else str(value)
+                            for key, value in data.items() if key not in CUSTOMER_FIELDS
+                        },
+                    }
                 )
             
             messages.success(
@@ -352,6 +364,13 @@ def blast_create_campaign(request):
                 messages.error(request, 'No WhatsApp connection found. Please set up WhatsApp first.')
                 return redirect('blast_create_campaign')
             
+            # Placeholders must be customer fields or custom columns of the target groups
+            try:
+                validate_template(message_text, group_ids=selected_groups)
+            except TemplateError as e:
+                messages.error(request, str(e))
+                return redirect('blast_create_campaign')
+            
             with transaction.atomic():
                 # Create blast campaign
                 campaign = BlastCampaign.objects.create(
@@ -371,35 +390,23 @@ def blast_create_campaign(request):
                 if selected_contests:
                     campaign.target_contests.set(selected_contests)
                 
-                # Calculate total recipients
-                recipients = set()
-                
-                # Add group members
-                for group_id in selected_groups:
-                    group = CustomerGroup.objects.get(group_id=group_id)
-                    for member in group.members.all():
-                        recipients.add(member.customer)
-                
-                # Add contest participants
-                for contest_id in selected_contests:
-                    contest = Contest.objects.get(contest_id=contest_id)
-                    for entry in contest.entries.all():
-                        recipients.add(entry.customer)
-                
-                # Create blast recipients
-                for customer in recipients:
-                    BlastRecipient.objects.create(
-                        tenant=tenant,
-                        blast_campaign=campaign,
-                        customer=customer,
-                        status='pending'
-                    )
-                
-                campaign.total_recipients = len(recipients)
-                campaign.save()
-                
-                messages.success(request, f'Campaign "{name}" created with {len(recipients)} recipients!')
+                # Recipients = distinct group members + contest participants, computed in
+                # SQL and inserted in batches outside this transaction
+                target_count = target_customer_ids(campaign).count()
+                if target_count > MATERIALIZE_INLINE_MAX:
+                    # Too many to insert within the request: blast workers prepare it
+                    campaign.status = 'preparing'
+                    campaign.save(update_fields=['status'])
+            
+            if campaign.status == 'preparing':
+                wake_blast_workers()
+                messages.success(request, f'Campaign "{name}" created. Preparing {target_count} recipients in the background...')
                 return redirect('blast_campaign_detail', blast_id=campaign.blast_id)
+            
+            materialize_recipients(campaign)
+            
+            messages.success(request, f'Campaign "{name}" created with {campaign.total_recipients} recipients!')
+            return redirect('blast_campaign_detail', blast_id=campaign.blast_id)
         
         except Exception as e:
             messages.error(request, f'Error creating campaign: {str(e)}')
@@ -442,70 +449,58 @@ def blast_send_campaign(request, blast_id):
     try:
         campaign = get_object_or_404(BlastCampaign, blast_id=blast_id, tenant=tenant)
         
-        if campaign.status not in ['draft', 'failed']:
+        if campaign.status not in ['draft', 'scheduled', 'failed']:
             return JsonResponse({'success': False, 'error': 'Campaign cannot be sent in current status'}, status=400)
         
-        # Update campaign status
-        campaign.status = 'sending'
-        campaign.started_at = dj_timezone.now()
-        campaign.save()
-        
-        # Check if we should send async (for large campaigns)
-        use_async = request.POST.get('async', 'false') == 'true' or campaign.total_recipients > 50
-        
-        if use_async:
-            # For large campaigns, we would use Celery here
-            # For now, we'll use threading to not block the request
-            import threading
-            thread = threading.Thread(
-                target=send_blast_campaign_task,
-                args=(campaign.blast_id,)
-            )
-            thread.daemon = True
-            thread.start()
-            
-            messages.success(request, f'Campaign "{campaign.name}" is being sent in the background. You can check the progress on the campaign detail page.')
-            return JsonResponse({
-                'success': True,
-                'message': 'Campaign is being sent in the background',
-                'async': True,
-                'total_recipients': campaign.total_recipients
-            })
-        else:
-            # Send synchronously for small campaigns
-            result = send_blast_campaign_task(campaign.blast_id)
-            
-            # Prepare response message
-            if result['success']:
-                sent_count = result['sent_count']
-                failed_count = result['failed_count']
-                
-                if sent_count > 0 and failed_count > 0:
-                    msg = f'Campaign sent with partial success: {sent_count} sent, {failed_count} failed'
-                elif sent_count > 0:
-                    msg = f'Campaign sent successfully to {sent_count} recipients!'
-                else:
-                    msg = f'Campaign failed: {failed_count} messages could not be sent'
-                
-                messages.success(request, msg)
-                
+        # A future send time schedules the campaign; the campaign scheduler starts it then
+        scheduled_at = request.POST.get('scheduled_at')
+        if scheduled_at:
+            scheduled_at = parse_datetime(scheduled_at)
+            if scheduled_at is None:
+                return JsonResponse({'success': False, 'error': 'Invalid schedule time'}, status=400)
+            if dj_timezone.is_naive(scheduled_at):
+                scheduled_at = dj_timezone.make_aware(scheduled_at)
+            if scheduled_at > dj_timezone.now():
+                campaign.status = 'scheduled'
+                campaign.scheduled_at = scheduled_at
+                campaign.save(update_fields=['status', 'scheduled_at'])
                 return JsonResponse({
                     'success': True,
-                    'message': msg,
-                    'sent_count': sent_count,
-                    'failed_count': failed_count,
-                    'total_recipients': campaign.total_recipients
+                    'scheduled': True,
+                    'scheduled_at': scheduled_at.isoformat(),
+                    'message': f'Campaign scheduled for {dj_timezone.localtime(scheduled_at):%b %d, %Y %I:%M %p}',
                 })
-            else:
-                messages.error(request, f'Campaign failed: {result.get("error")}')
-                return JsonResponse({'success': False, 'error': result.get('error')}, status=500)
+        
+        # Start it with a conditional UPDATE: a full save() would write stale counters
+        # over the F() updates of workers still holding leases (a resent 'failed'
+        # campaign), and the scheduler may be starting it at the same moment
+        started_at = dj_timezone.now()
+        started = BlastCampaign.objects.filter(
+            blast_id=campaign.blast_id, status__in=['draft', 'scheduled', 'failed'],
+        ).update(status='sending', started_at=started_at)
+        if not started:
+            return JsonResponse({'success': False, 'error': 'Campaign cannot be sent in current status'}, status=400)
+        campaign.status = 'sending'
+        campaign.started_at = started_at
+        
+        # Blast workers (in-process and/or `run_blast_workers`) claim and send it in
+        # chunks; the request never sends, whatever the campaign size
+        wake_blast_workers()
+        
+        messages.success(request, f'Campaign "{campaign.name}" is being sent in the background. You can check the progress on the campaign detail page.')
+        return JsonResponse({
+            'success': True,
+            'message': 'Campaign is being sent in the background',
+            'async': True,
+            'total_recipients': campaign.total_recipients
+        })
     
     except Exception as e:
         logger.error(f"Error in blast_send_campaign: {str(e)}")
         # Update campaign status to failed
         try:
             campaign.status = 'failed'
-            campaign.save()
+            campaign.save(update_fields=['status'])
         except:
             pass
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
@@ -521,11 +516,12 @@ def blast_cancel_campaign(request, blast_id):
     try:
         campaign = get_object_or_404(BlastCampaign, blast_id=blast_id, tenant=tenant)
         
-        if campaign.status not in ['draft', 'scheduled', 'sending']:
+        if campaign.status not in ['preparing', 'draft', 'scheduled', 'sending']:
             return JsonResponse({'success': False, 'error': 'Campaign cannot be cancelled'}, status=400)
         
         campaign.status = 'cancelled'
-        campaign.save()
+        # Only the status: workers keep the counters current with F() updates
+        campaign.save(update_fields=['status'])
         
         messages.success(request, f'Campaign "{campaign.name}" has been cancelled!')
         return JsonResponse({'success': True})
@@ -534,8 +530,9 @@ def blast_cancel_campaign(request, blast_id):
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 @login_required
-def blast_campaign_progress(request, blast_id):
-    """Get real-time progress of a blast campaign"""
+@require_http_methods(["POST"])
+def blast_resume_campaign(request, blast_id):
+    """Continue a stuck, failed or cancelled campaign without resending anyone"""
     tenant = get_tenant_from_request(request)
     if not tenant:
         return JsonResponse({'success': False, 'error': 'Not authenticated'}, status=401)
@@ -543,24 +540,59 @@ def blast_campaign_progress(request, blast_id):
     try:
         campaign = get_object_or_404(BlastCampaign, blast_id=blast_id, tenant=tenant)
         
-        # Count recipients by status
-        status_counts = {}
-        recipients = BlastRecipient.objects.filter(blast_campaign=campaign)
+        if campaign.status not in ['sending', 'failed', 'cancelled']:
+            return JsonResponse({'success': False, 'error': 'Campaign cannot be resumed in current status'}, status=400)
         
-        for status in ['pending', 'queued', 'sent', 'delivered', 'failed', 'skipped']:
-            status_counts[status] = recipients.filter(status=status).count()
+        remaining = resume_campaign(campaign)
+        if remaining:
+            msg = f'Campaign "{campaign.name}" resumed: {remaining} recipients left to send.'
+        else:
+            msg = f'Campaign "{campaign.name}" has no recipients left to send.'
+        messages.success(request, msg)
+        return JsonResponse({'success': True, 'message': msg, 'remaining': remaining})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+@login_required
+def blast_campaign_progress(request, blast_id):
+    """Get real-time progress of a blast campaign"""
+    tenant = get_tenant_from_request(request)
+    if not tenant:
+        return JsonResponse({'success': False, 'error': 'Not authenticated'}, status=401)
+    
+    try:
+        # Engine-maintained counters, shared across pollers (see blast_progress)
+        snapshot = campaign_progress(blast_id)
+        if snapshot is None or snapshot[0] != tenant.pk:
+            return JsonResponse({'success': False, 'error': 'Campaign not found'}, status=404)
+        
+        return JsonResponse({'success': True, **snapshot[1]})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+@login_required
+def blast_campaign_progress_wait(request, blast_id):
+    """Long-poll a blast campaign's progress: returns what changed since ?version= once it changes (or after a few seconds)"""
+    tenant = get_tenant_from_request(request)
+    if not tenant:
+        return JsonResponse({'success': False, 'error': 'Not authenticated'}, status=401)
+    
+    try:
+        snapshot = campaign_progress(blast_id)
+        if snapshot is None or snapshot[0] != tenant.pk:
+            return JsonResponse({'success': False, 'error': 'Campaign not found'}, status=404)
         
+        result = wait_for_progress(blast_id, version=request.GET.get('version'))
+        if result is None:
+            return JsonResponse({'success': False, 'error': 'Campaign not found'}, status=404)
+        _, progress, retry_after = result
+        # Only the fields that changed when the client's version is known here
         return JsonResponse({
             'success': True,
-            'campaign_status': campaign.status,
-            'total_recipients': campaign.total_recipients,
-            'sent_count': campaign.sent_count,
-            'delivered_count': campaign.delivered_count,
-            'failed_count': campaign.failed_count,
-            'success_rate': campaign.success_rate,
-            'status_counts': status_counts,
-            'started_at': campaign.started_at.isoformat() if campaign.started_at else None,
-            'completed_at': campaign.completed_at.isoformat() if campaign.completed_at else None,
+            **progress_payload(progress, since=request.GET.get('version')),
+            'retry_after': retry_after,
         })
     
     except Exception as e:
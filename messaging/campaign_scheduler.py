@@ -0,0 +1,401 @@
+"""
+Scheduler for timed campaign sends.
+
+`BlastCampaign.scheduled_at`, `SendQueue.scheduled_at` and a CRM campaign's send
+window (`Campaign.send_start_at` / `send_end_at` / `time_zone`) used to be stored
+and never acted on: blasts only started from the Send button, and
+`process_send_queue` marked queued messages sent without sending them. The
+scheduler (`python manage.py run_campaign_scheduler`) keeps an in-memory timer
+heap of everything due within WABOT_SCHEDULER_HORIZON seconds and fires each timer
+on time:
+
+- a scheduled blast becomes 'sending' (scheduled -> sending is a conditional
+  UPDATE, so a cancelled or rescheduled blast is left alone) and the blast
+  workers are woken
+- a due SendQueue message is rendered for its customer (see templating) and handed
+  to the outbox (keyed "sendqueue:<queue_id>", so a message re-dispatched after a
+  crash is not sent twice)
+
+Each tick reloads the heap with one query: a UNION of the two tables' due rows,
+each side an index range scan on (status, scheduled_at). Timers already in the
+heap are kept, unless the row is now due earlier (e.g. a blast rescheduled to an
+earlier time): then the entry is replaced. One moved later is checked when its
+old timer fires and picked up again when due.
+
+Send windows: a message is only sent between the campaign's `send_start_at` and
+`send_end_at`. When the window spans several days, the local times of day of the
+two ends (in the campaign's `time_zone`) also bound every day in between, e.g.
+09:00 Mon - 18:00 Fri sends 09:00-18:00 daily. Messages due outside the window
+are rescheduled to its next opening, and the messages of one campaign are spread
+out at its `throttle_per_min`, so a campaign queued for one instant goes out
+evenly over the window instead of in one burst. Both are written back to
+`SendQueue.scheduled_at`, so the next tick's query skips rows not yet due and a
+restarted scheduler keeps the same plan. Messages the window closes on are failed.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import (
+    CharField, DateTimeField, Exists, F, IntegerField, OuterRef, Q, TextField, UUIDField, Value,
+)
+from django.utils import timezone as dj_timezone
+
+from .models import BlastCampaign, Campaign, CampaignMessage, Conversation, SendQueue
+from .templating import compile_template, customer_context
+
+logger = logging.getLogger(__name__)
+
+TICK_SECONDS = float(os.getenv("WABOT_SCHEDULER_TICK", "1.0") or 1.0)
+HORIZON_SECONDS = int(os.getenv("WABOT_SCHEDULER_HORIZON", "300") or 300)
+# Rows loaded per tick; the rest follow on later ticks
+LOAD_LIMIT = int(os.getenv("WABOT_SCHEDULER_LOAD_LIMIT", "5000") or 5000)
+# A 'processing' row claimed longer ago than this belongs to a stopped scheduler
+STALE_SECONDS = int(os.getenv("WABOT_SCHEDULER_STALE_SECONDS", "300") or 300)
+RETRY_BASE_SECONDS = 60
+WINDOW_CLOSED = "send window closed before the message was sent"
+
+stats = {"ticks": 0, "loaded": 0, "blasts_started": 0, "sent": 0, "retried": 0, "failed": 0,
+         "deferred": 0, "window_closed": 0}
+
+
+# =============================================================================
+# SEND WINDOWS
+# =============================================================================
+
+def _zone(name):
+    try:
+        return ZoneInfo(name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning("Unknown campaign time zone %r, using UTC", name)
+        return ZoneInfo("UTC")
+
+
+def window_open_at(when, start_at=None, end_at=None, time_zone="UTC"):
+    """
+    The earliest time at or after `when` inside a send window, or None once the
+    window has closed. See the module docstring for the daily hours.
+    """
+    if start_at and when < start_at:
+        when = start_at
+    if end_at and when >= end_at:
+        return None
+    if not (start_at and end_at):
+        return when
+    tz = _zone(time_zone)
+    opens, closes = start_at.astimezone(tz).time(), end_at.astimezone(tz).time()
+    if opens >= closes:
+        # Overnight or round-the-clock window: one contiguous stretch
+        return when
+    local = when.astimezone(tz)
+    if local.time() < opens:
+        day = local.date()
+    elif local.time() >= closes:
+        day = local.date() + timedelta(days=1)
+    else:
+        return when
+    when = datetime.combine(day, opens, tzinfo=tz)
+    return when if when < end_at else None
+
+
+# =============================================================================
+# LOADING
+# =============================================================================
+
+def due_rows(until, limit=LOAD_LIMIT):
+    """
+    Scheduled blasts and queued SendQueue messages due by `until`, oldest first, in
+    one query. Rows are (kind, id, scheduled_at, campaign_id, send_start_at,
+    send_end_at, time_zone, throttle_per_min); the window columns are NULL for blasts.
+    """
+    # Every column is an annotation so both sides select them in the same order
+    columns = ['kind', 'obj_id', 'due_at', 'campaign_ref', 'window_start', 'window_end', 'window_zone', 'throttle']
+    blasts = BlastCampaign.objects.filter(status='scheduled', scheduled_at__lte=until).annotate(
+        kind=Value('blast', output_field=CharField()),
+        obj_id=F('blast_id'),
+        due_at=F('scheduled_at'),
+        campaign_ref=Value(None, output_field=UUIDField()),
+        window_start=Value(None, output_field=DateTimeField()),
+        window_end=Value(None, output_field=DateTimeField()),
+        window_zone=Value(None, output_field=TextField()),
+        throttle=Value(None, output_field=IntegerField()),
+    ).values_list(*columns).order_by()
+    queued = SendQueue.objects.filter(status='queued', scheduled_at__lte=until).annotate(
+        kind=Value('queue', output_field=CharField()),
+        obj_id=F('queue_id'),
+        due_at=F('scheduled_at'),
+        campaign_ref=F('campaign_message__campaign_id'),
+        window_start=F('campaign_message__campaign__send_start_at'),
+        window_end=F('campaign_message__campaign__send_end_at'),
+        window_zone=F('campaign_message__campaign__time_zone'),
+        throttle=F('campaign_message__campaign__throttle_per_min'),
+    ).values_list(*columns).order_by()
+    return list(blasts.union(queued, all=True).order_by('due_at')[:limit])
+
+
+# =============================================================================
+# FIRING
+# =============================================================================
+
+def start_blast(blast_id, now=None):
+    """Start a scheduled blast that is due. Returns False if it was cancelled, moved or already started."""
+    from .blast_tasks import wake_blast_workers
+
+    now = now or dj_timezone.now()
+    started = BlastCampaign.objects.filter(blast_id=blast_id, status='scheduled', scheduled_at__lte=now).update(
+        status='sending', started_at=now,
+    )
+    if started:
+        stats["blasts_started"] += 1
+        logger.info("Scheduler: blast %s started", blast_id)
+        wake_blast_workers()
+    return bool(started)
+
+
+def _conversation_for(recipient):
+    if recipient.conversation_id:
+        return recipient.conversation
+    convo = Conversation.objects.filter(
+        tenant_id=recipient.tenant_id, customer_id=recipient.customer_id,
+        whatsapp_connection_id=recipient.whatsapp_connection_id,
+    ).order_by('created_at').first()
+    if convo is None:
+        convo = Conversation.objects.create(
+            tenant_id=recipient.tenant_id, customer_id=recipient.customer_id,
+            whatsapp_connection_id=recipient.whatsapp_connection_id, channel='whatsapp',
+        )
+    recipient.conversation = convo
+    recipient.save(update_fields=['conversation'])
+    return convo
+
+
+def recover_processing(now=None):
+    """
+    Requeue messages a stopped scheduler left in 'processing' (the outbox key makes
+    resending safe). Claims younger than WABOT_SCHEDULER_STALE_SECONDS may belong to
+    a scheduler that is still running and are left alone.
+    """
+    stale_before = (now or dj_timezone.now()) - timedelta(seconds=STALE_SECONDS)
+    return SendQueue.objects.filter(status='processing').filter(
+        Q(locked_at__isnull=True) | Q(locked_at__lt=stale_before)
+    ).update(status='queued', locked_at=None)
+
+
+def dispatch_queue_items(queue_ids, now=None):
+    """
+    Claim due SendQueue messages (queued -> processing, one conditional UPDATE each)
+    and hand them to the outbox. Failures are retried with backoff up to the row's
+    `max_retries`. Returns {'sent': n, 'retried': n, 'failed': n}.
+    """
+    from .outbox import enqueue_message
+
+    now = now or dj_timezone.now()
+    # Due only: a row rescheduled later since its timer was set waits for its new time
+    claimed = [
+        queue_id for queue_id in queue_ids
+        if SendQueue.objects.filter(queue_id=queue_id, status='queued', scheduled_at__lte=now).update(
+            status='processing', locked_at=now,
+        )
+    ]
+    counts = {"sent": 0, "retried": 0, "failed": 0}
+    if not claimed:
+        return counts
+    tasks = list(
+        SendQueue.objects.filter(queue_id__in=claimed).select_related(
+            'tenant', 'campaign_message__template', 'campaign_message__recipient__customer',
+            'campaign_message__recipient__conversation',
+        )
+    )
+    for task in tasks:
+        cm = task.campaign_message
+        recipient = cm.recipient
+        task.locked_at = None
+        try:
+            with transaction.atomic():
+                text = compile_template(cm.template.body).render(customer_context(recipient.customer))
+                enqueue_message(
+                    task.tenant, recipient.customer.phone_number, text,
+                    conversation=_conversation_for(recipient), idempotency_key=f"sendqueue:{task.queue_id}",
+                )
+        except Exception as e:
+            logger.error("Scheduler: could not queue message %s: %s", task.queue_id, e, exc_info=True)
+            task.retry_count += 1
+            task.error_message = str(e)[:1000]
+            if task.retry_count < task.max_retries:
+                task.status = 'queued'
+                task.scheduled_at = now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (task.retry_count - 1))
+                counts["retried"] += 1
+                continue
+            task.status = 'failed'
+            task.processed_at = now
+            cm.status = 'failed'
+            cm.error_code = 'send_error'
+            counts["failed"] += 1
+            continue
+        task.status = 'sent'
+        task.processed_at = now
+        task.error_message = None
+        cm.status = 'sent'
+        cm.sent_at = now
+        counts["sent"] += 1
+
+    SendQueue.objects.bulk_update(
+        tasks, ['status', 'scheduled_at', 'retry_count', 'error_message', 'processed_at', 'locked_at']
+    )
+    CampaignMessage.objects.bulk_update([t.campaign_message for t in tasks], ['status', 'sent_at', 'error_code'])
+    _update_campaigns({t.campaign_message.campaign_id for t in tasks})
+    for key, n in counts.items():
+        stats[key] += n
+    return counts
+
+
+def _update_campaigns(campaign_ids):
+    """Scheduled campaigns that sent a message are running; running ones with nothing left are completed."""
+    Campaign.objects.filter(campaign_id__in=campaign_ids, status='scheduled').update(status='running')
+    Campaign.objects.filter(campaign_id__in=campaign_ids, status='running').exclude(
+        Exists(SendQueue.objects.filter(campaign_message__campaign=OuterRef('pk'), status__in=['queued', 'processing']))
+    ).update(status='completed')
+
+
+def _close_window(queue_ids, now):
+    """Fail messages whose campaign's send window closed before they were sent."""
+    SendQueue.objects.filter(queue_id__in=queue_ids, status='queued').update(
+        status='failed', error_message=WINDOW_CLOSED, processed_at=now,
+    )
+    CampaignMessage.objects.filter(queue_entries__queue_id__in=queue_ids, status='queued').update(
+        status='failed', error_code='window_closed',
+    )
+    stats["window_closed"] += len(queue_ids)
+
+
+# =============================================================================
+# SCHEDULER
+# =============================================================================
+
+class CampaignScheduler:
+    """
+    Timer heap of due blasts and SendQueue messages. `tick()` reloads and fires once;
+    `start()` runs ticks in a daemon thread (used by `run_campaign_scheduler`).
+    """
+
+    def __init__(self, tick=TICK_SECONDS, horizon=HORIZON_SECONDS, limit=LOAD_LIMIT, name="campaign-scheduler"):
+        self.tick_seconds = max(0.05, float(tick))
+        self.horizon = timedelta(seconds=max(0, int(horizon)))
+        self.limit = max(1, int(limit))
+        self.name = name
+        self._heap = []
+        self._timers = {}      # (kind, id) -> due time of its live heap entry
+        self._next_slot = {}   # campaign id -> earliest time its next message may go out
+        self._seq = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _push(self, kind, obj_id, due):
+        # A replaced entry stays in the heap; `fire_due` skips it (due time no longer matches)
+        self._timers[(kind, obj_id)] = due
+        heapq.heappush(self._heap, (due, next(self._seq), kind, obj_id))
+
+    def _plan(self, row, now, moved, closed):
+        """Due time of a queued message: paced per campaign and inside its send window."""
+        _, queue_id, scheduled_at, campaign_id, start_at, end_at, time_zone, throttle = row
+        due = window_open_at(max(scheduled_at, self._next_slot.get(campaign_id, now)), start_at, end_at, time_zone)
+        if due is None:
+            closed.append(queue_id)
+            return None
+        if throttle and throttle > 0:
+            self._next_slot[campaign_id] = due + timedelta(seconds=60.0 / throttle)
+        if due > scheduled_at:
+            moved.append(SendQueue(queue_id=queue_id, scheduled_at=due))
+        return due
+
+    def refresh(self, now=None):
+        """Add newly due rows to the heap (one query). Returns the number added."""
+        now = now or dj_timezone.now()
+        self._next_slot = {k: v for k, v in self._next_slot.items() if v > now}
+        moved, closed, added = [], [], 0
+        for row in due_rows(now + self.horizon, limit=self.limit):
+            kind, obj_id = row[0], row[1]
+            timer = self._timers.get((kind, obj_id))
+            if timer is not None and row[2] >= timer:
+                continue
+            due = row[2] if kind == 'blast' else self._plan(row, now, moved, closed)
+            if due is not None:
+                self._push(kind, obj_id, due)
+                added += 1
+        if moved:
+            SendQueue.objects.bulk_update(moved, ['scheduled_at'], batch_size=500)
+            stats["deferred"] += len(moved)
+        if closed:
+            _close_window(closed, now)
+        stats["loaded"] += added
+        return added
+
+    def fire_due(self, now=None):
+        """Fire every timer due by `now`. Returns {'blasts': n, 'sent': n, 'retried': n, 'failed': n}."""
+        now = now or dj_timezone.now()
+        blasts, queue_ids = [], []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, kind, obj_id = heapq.heappop(self._heap)
+            if self._timers.get((kind, obj_id)) != due:
+                continue
+            del self._timers[(kind, obj_id)]
+            (blasts if kind == 'blast' else queue_ids).append(obj_id)
+        counts = {"blasts": sum(start_blast(blast_id, now) for blast_id in blasts)}
+        counts.update(dispatch_queue_items(queue_ids, now))
+        return counts
+
+    def tick(self):
+        stats["ticks"] += 1
+        self.refresh()
+        return self.fire_due()
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info("Campaign scheduler started (tick %.2fs, horizon %ss)", self.tick_seconds,
+                    int(self.horizon.total_seconds()))
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def is_alive(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run(self):
+        try:
+            close_old_connections()
+            recover_processing()
+            while not self._stop.is_set():
+                try:
+                    close_old_connections()
+                    self.tick()
+                except Exception as e:
+                    logger.error("Campaign scheduler loop error: %s", e, exc_info=True)
+                wait = self.tick_seconds
+                next_due = self.next_due()
+                if next_due is not None:
+                    wait = min(wait, max(0.0, (next_due - dj_timezone.now()).total_seconds()))
+                self._stop.wait(wait)
+        finally:
+            connection.close()
+
+
+def scheduler_stats():
+    now = dj_timezone.now()
+    return {
+        **stats,
+        "blasts_scheduled": BlastCampaign.objects.filter(status='scheduled').count(),
+        "queue_due": SendQueue.objects.filter(status='queued', scheduled_at__lte=now).count(),
+        "queue_later": SendQueue.objects.filter(status='queued', scheduled_at__gt=now).count(),
+    }
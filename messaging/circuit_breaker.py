@@ -0,0 +1,213 @@
+"""
+Circuit breaker around WABot sends, one per WABot instance (= WhatsApp connection).
+
+When WABot starts answering 5xx/429 or timing out, every send still went out and
+the blast loop marked each remaining recipient failed at full speed. The breaker
+watches send outcomes and trips when either
+
+- WABOT_BREAKER_FAILURES consecutive sends failed (default 5), or
+- over the last WABOT_BREAKER_WINDOW sends (default 20, at least
+  WABOT_BREAKER_MIN_CALLS = 10) the failure rate reached WABOT_BREAKER_ERROR_RATE
+  (default 0.5).
+
+Open: no sends start for the backoff period, for every sender in the process that
+shares the instance. The backoff doubles with each consecutive trip from
+WABOT_BREAKER_BACKOFF_SECONDS (default 2) up to WABOT_BREAKER_MAX_BACKOFF_SECONDS
+(default 120), with jitter (a uniform draw from the upper half), so senders
+don't all come back at the same moment.
+
+Half-open: after the backoff, WABOT_BREAKER_PROBES sends (default 1) are let
+through. A successful probe closes the breaker; a failed one re-opens it with
+the next backoff step.
+
+Only provider trouble counts as a failure (5xx, 429, timeouts, connection
+errors); a 4xx for a bad number means WABot is healthy.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = int(os.getenv("WABOT_BREAKER_FAILURES", "5") or 0)
+ERROR_RATE = float(os.getenv("WABOT_BREAKER_ERROR_RATE", "0.5") or 0)
+WINDOW = int(os.getenv("WABOT_BREAKER_WINDOW", "20") or 20)
+MIN_CALLS = int(os.getenv("WABOT_BREAKER_MIN_CALLS", "10") or 10)
+BASE_BACKOFF_SECONDS = float(os.getenv("WABOT_BREAKER_BACKOFF_SECONDS", "2") or 2)
+MAX_BACKOFF_SECONDS = float(os.getenv("WABOT_BREAKER_MAX_BACKOFF_SECONDS", "120") or 120)
+HALF_OPEN_PROBES = int(os.getenv("WABOT_BREAKER_PROBES", "1") or 1)
+# How long a blast waits for an open breaker before requeueing what is left
+MAX_WAIT_SECONDS = float(os.getenv("WABOT_BREAKER_MAX_WAIT_SECONDS", "60") or 0)
+# Poll interval while another sender's half-open probe is in flight
+PROBE_POLL_SECONDS = 0.1
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(*keys):
+    with _stats_lock:
+        for key in keys:
+            stats[key] += 1
+
+
+def count_rejected(n=1):
+    """Sends turned away by an open breaker."""
+    with _stats_lock:
+        stats["rejected"] += n
+
+
+def is_provider_failure(status_code=None):
+    """True for responses that mean WABot itself is in trouble (None = no response)."""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class CircuitBreaker:
+    """Closed / open / half-open state for one WABot instance. Thread-safe."""
+
+    def __init__(self, key, failure_threshold=FAILURE_THRESHOLD, error_rate=ERROR_RATE, window=WINDOW,
+                 min_calls=MIN_CALLS, base_backoff=BASE_BACKOFF_SECONDS, max_backoff=MAX_BACKOFF_SECONDS,
+                 half_open_probes=HALF_OPEN_PROBES):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self._outcomes = deque(maxlen=max(1, window))
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _backoff(self):
+        ceiling = min(self.max_backoff, self.base_backoff * 2 ** (self.trips - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _open(self, reason):
+        self.trips += 1
+        delay = self._backoff()
+        self.state = OPEN
+        self.open_until = time.monotonic() + delay
+        _count("opened", f"opened:{reason}")
+        logger.warning("WABot circuit open: key=%s reason=%s trip=%s backoff=%.1fs",
+                       self.key, reason, self.trips, delay)
+
+    def _close(self):
+        self.state = CLOSED
+        self.trips = 0
+        self.consecutive_failures = 0
+        self._outcomes.clear()
+        _count("closed")
+        logger.info("WABot circuit closed: key=%s", self.key)
+
+    def allow(self, n=1):
+        """How many of `n` sends may start now (0 while open)."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self.open_until:
+                    return 0
+                self.state = HALF_OPEN
+                self._probes = 0
+                _count("half_open")
+            if self.state == HALF_OPEN:
+                granted = min(n, self.half_open_probes - self._probes)
+                self._probes += granted
+                return granted
+            return n
+
+    def release(self, n=1):
+        """Give back `n` sends granted by `allow()` that never started (half-open probe slots)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - n)
+
+    def available(self):
+        """Whether `allow()` would let a send through right now (takes nothing)."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() >= self.open_until
+            if self.state == HALF_OPEN:
+                return self._probes < self.half_open_probes
+            return True
+
+    def retry_after(self):
+        """Seconds until a send might be allowed again (0 when closed)."""
+        if self.state == OPEN:
+            return max(0.0, self.open_until - time.monotonic())
+        if self.state == HALF_OPEN:
+            return PROBE_POLL_SECONDS
+        return 0.0
+
+    def record(self, ok):
+        """Feed one send outcome (`ok` False only for provider failures)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if ok:
+                    self._close()
+                else:
+                    self._open("probe")
+                return
+            if self.state == OPEN:
+                # Late results of sends started before the trip
+                return
+            self._outcomes.append(ok)
+            if ok:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.failure_threshold and self.consecutive_failures >= self.failure_threshold:
+                self._open("consecutive")
+            elif self.error_rate and len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for outcome in self._outcomes if not outcome)
+                if failures / len(self._outcomes) >= self.error_rate:
+                    self._open("error_rate")
+
+    def wait(self, timeout):
+        """Block until a send would be allowed (True) or `timeout` seconds pass (False)."""
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            if self.available():
+                return True
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            time.sleep(min(max(self.retry_after(), 0.01), left))
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": round(self.retry_after(), 2),
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(key):
+    """The process-wide breaker for a WABot instance id."""
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(key))
+    return breaker
+
+
+def breaker_stats():
+    with _stats_lock:
+        counters = dict(stats)
+    return {
+        "breakers": {key: breaker.snapshot() for key, breaker in list(_breakers.items())},
+        "counters": counters,
+    }
@@ -0,0 +1,95 @@
+"""
+Instance-id -> (tenant, WhatsApp connection) routing for inbound traffic.
+
+Every WABot webhook carries the `instance_id` of the connection that received the
+message. The routing table maps it to the owning Tenant and WhatsAppConnection so
+the hot path does not need `Tenant.objects.first()` / `WhatsAppConnection...first()`
+per message, and stays correct once more than one tenant is hosted.
+
+The table is loaded once per process (one query), kept for WABOT_ROUTING_TTL seconds
+(default 300) and dropped whenever a WhatsAppConnection or Tenant is saved/deleted
+(see signals.py). Other processes pick up changes when their TTL expires.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ROUTING_TTL_SECONDS = int(os.getenv("WABOT_ROUTING_TTL", "300"))
+
+_lock = threading.Lock()
+_table = None  # {"by_instance": {...}, "by_tenant": {...}, "default": (tenant, conn) | None}
+_loaded_at = 0.0
+
+
+def _norm_instance_id(instance_id):
+    return str(instance_id or "").strip().upper()
+
+
+def _load_table():
+    from .models import WhatsAppConnection
+
+    by_instance = {}
+    by_tenant = {}
+    ordered = []
+    for conn in WhatsAppConnection.objects.select_related("tenant").order_by("tenant__creation_date", "phone_number"):
+        route = (conn.tenant, conn)
+        ordered.append(route)
+        key = _norm_instance_id(conn.instance_id)
+        if key and key not in by_instance:
+            by_instance[key] = route
+        by_tenant.setdefault(conn.tenant_id, route)
+
+    # Legacy single-connection deployments: unknown/missing instance ids go to the only
+    # connection. With several, guessing would hand one tenant's messages to another.
+    default = ordered[0] if len(ordered) == 1 else None
+
+    return {"by_instance": by_instance, "by_tenant": by_tenant, "default": default}
+
+
+def _get_table():
+    global _table, _loaded_at
+    table = _table
+    if table is not None and (time.monotonic() - _loaded_at) < ROUTING_TTL_SECONDS:
+        return table
+    with _lock:
+        if _table is None or (time.monotonic() - _loaded_at) >= ROUTING_TTL_SECONDS:
+            _table = _load_table()
+            _loaded_at = time.monotonic()
+            logger.info("Loaded WhatsApp routing table: %s instance(s)", len(_table["by_instance"]))
+        return _table
+
+
+def resolve_instance(instance_id):
+    """
+    Return (tenant, whatsapp_connection) for a webhook instance_id, or (None, None)
+    when the instance is unknown and more than one connection is configured (or none).
+    """
+    table = _get_table()
+    route = table["by_instance"].get(_norm_instance_id(instance_id))
+    if route is None:
+        route = table["default"]
+        if route is None:
+            logger.warning("Unknown WABot instance_id %s; no connection to route it to", instance_id)
+            return None, None
+        if instance_id:
+            logger.warning("Unknown WABot instance_id %s; routing to the only connection", instance_id)
+    return route
+
+
+def get_tenant_connection(tenant):
+    """Return the (first) WhatsApp connection of a tenant from the routing table."""
+    if tenant is None:
+        return None
+    route = _get_table()["by_tenant"].get(tenant.pk)
+    return route[1] if route else None
+
+
+def invalidate_routing_cache():
+    """Drop the process-local routing table; the next lookup reloads it."""
+    global _table, _loaded_at
+    with _lock:
+        _table = None
+        _loaded_at = 0.0
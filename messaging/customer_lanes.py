@@ -0,0 +1,149 @@
+"""
+Per-customer ordered execution for the contest flow.
+
+Two messages from the same participant (e.g. a receipt photo and "I agree" a second
+apart) must not run `StepByStepContestService.process_message_for_contests`
+concurrently: both would load the same ContestFlowState and advance it twice or
+overwrite each other's `metadata`.
+
+- `KeyedExecutor` hashes (tenant_id, customer_id) onto a fixed set of lanes. Each
+  lane is one thread draining a FIFO queue, so work for one customer runs strictly
+  in submission order while different customers run in parallel.
+- `customer_lock` serializes the same customer across processes/instances:
+  a session-level Postgres advisory lock, or `select_for_update` on the Customer
+  row on other databases.
+
+Lanes are sized by WABOT_CONTEST_LANES (default 8; 0 runs work on the caller's
+thread, still under `customer_lock`).
+"""
+import hashlib
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+LANE_COUNT = int(os.getenv("WABOT_CONTEST_LANES", "8") or 0)
+
+
+def _lock_id(key):
+    """Signed 64-bit id for pg_advisory_lock, stable across processes."""
+    digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+@contextmanager
+def customer_lock(tenant_id, customer_id):
+    """
+    Hold an exclusive, cross-process lock for one customer.
+
+    Postgres: session-level advisory lock, so no transaction is held open while the
+    flow calls WABot/OCR. Other databases: the Customer row is locked for the duration.
+    """
+    key = ("contest", str(tenant_id), str(customer_id))
+    if connection.vendor == "postgresql":
+        lock_id = _lock_id(key)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", [lock_id])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+    else:
+        from .models import Customer
+        with transaction.atomic():
+            Customer.objects.select_for_update().filter(customer_id=customer_id).exists()
+            yield
+
+
+class KeyedExecutor:
+    """Fixed pool of single-threaded lanes; one key always maps to the same lane."""
+
+    def __init__(self, lanes=LANE_COUNT, name="contest-lane"):
+        self.lanes = max(1, int(lanes))
+        self.name = name
+        self._queues = [queue.Queue() for _ in range(self.lanes)]
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _lane_for(self, key):
+        return _lock_id(key) % self.lanes
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queue `fn(*args, **kwargs)` behind earlier work for the same key. Returns a Future."""
+        self._ensure_started()
+        future = Future()
+        self._queues[self._lane_for(key)].put((future, fn, args, kwargs))
+        return future
+
+    def _run(self, q):
+        while True:
+            future, fn, args, kwargs = q.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            close_old_connections()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                close_old_connections()
+
+    def pending(self):
+        return sum(q.qsize() for q in self._queues)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = KeyedExecutor()
+    return _executor
+
+
+def _locked_call(tenant_id, customer_id, fn, args, kwargs):
+    with customer_lock(tenant_id, customer_id):
+        return fn(*args, **kwargs)
+
+
+def submit_for_customer(tenant_id, customer_id, fn, *args, **kwargs):
+    """
+    Run `fn` in the customer's lane under `customer_lock`. Returns a Future;
+    with lanes disabled the call runs immediately and the Future is already done.
+    """
+    if LANE_COUNT <= 0:
+        future = Future()
+        try:
+            future.set_result(_locked_call(tenant_id, customer_id, fn, args, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    key = (str(tenant_id), str(customer_id))
+    return get_executor().submit(key, _locked_call, tenant_id, customer_id, fn, args, kwargs)
+
+
+def run_for_customer(tenant_id, customer_id, fn, *args, **kwargs):
+    """Blocking variant of `submit_for_customer`."""
+    return submit_for_customer(tenant_id, customer_id, fn, *args, **kwargs).result()
@@ -0,0 +1,343 @@
+"""
+Cached phone -> customer/conversation resolver for inbound traffic.
+
+Receipt campaigns produce bursts of messages from the same few thousand phones.
+Instead of running Customer.get_or_create, a Conversation lookup and a "last outbound
+message" query for every inbound message, we cache per (tenant, normalized phone):
+
+    customer_id, conversation_id, connection_id, name/city/state,
+    last_outbound_hash, last_outbound_at
+
+in a bounded process-local LRU that is mirrored into the Django cache (so other
+workers/instances share warm entries when a shared cache backend is configured).
+
+Echo detection uses a separate marker per (tenant, phone) holding the hash and time
+of our last outbound text. Every outbound send writes it (`record_outbound`, called
+by `outbox.enqueue_message` and outbox dispatch, and by the blast task, which sends
+directly) and every resolve reads it, so a send from any process is seen by the
+webhook in any other. Markers live only in the shared cache; with a process-local
+cache backend the last outbound message is read from the database instead.
+Customer saves evict the entry (see signals.py) so cached display fields stay fresh.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils import timezone as dj_timezone
+
+logger = logging.getLogger(__name__)
+
+LRU_SIZE = int(os.getenv("WABOT_RESOLVER_LRU_SIZE", "10000"))
+CACHE_TIMEOUT = int(os.getenv("WABOT_RESOLVER_CACHE_TIMEOUT", str(6 * 60 * 60)))
+# Inbound text equal to our last outbound text within this window is treated as an echo.
+ECHO_WINDOW_SECONDS = 180
+
+
+class _LRU:
+    """Small thread-safe LRU on top of OrderedDict."""
+
+    def __init__(self, maxsize):
+        self.maxsize = max(1, int(maxsize))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_lru = _LRU(LRU_SIZE)
+
+
+def _key(tenant_id, phone):
+    return f"wabot:contact:{tenant_id}:{phone}"
+
+
+def _outbound_key(tenant_id, phone):
+    return f"wabot:outbound:{tenant_id}:{''.join(filter(str.isdigit, str(phone or '')))}"
+
+
+def _cache_is_shared():
+    backend = settings.CACHES.get("default", {}).get("BACKEND", "")
+    return not backend.endswith(("LocMemCache", "DummyCache"))
+
+
+def text_hash(text):
+    return hashlib.blake2b((text or "").strip().encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _store(key, entry):
+    _lru.put(key, entry)
+    try:
+        cache.set(key, entry, timeout=CACHE_TIMEOUT)
+    except Exception as e:
+        logger.warning("Resolver cache mirror write failed: %s", e)
+
+
+def _entry_for(customer, conversation, last_outbound=None):
+    return {
+        "customer_id": str(customer.customer_id),
+        "phone_number": customer.phone_number,
+        "name": customer.name,
+        "city": customer.city,
+        "state": customer.state,
+        "conversation_id": str(conversation.conversation_id),
+        "connection_id": str(conversation.whatsapp_connection_id),
+        "contest_id": str(conversation.contest_id) if conversation.contest_id else None,
+        "last_outbound_hash": text_hash(last_outbound.text_body) if last_outbound else None,
+        "last_outbound_at": last_outbound.created_at.timestamp() if last_outbound else None,
+    }
+
+
+def _instances_from_entry(entry, tenant, conn):
+    """
+    Rebuild model instances from a cached entry without touching the database.
+    Instances come from `Model.from_db`: fields not cached are deferred (loaded on
+    access) and a plain `save()` only writes the loaded fields.
+    """
+    from .models import Customer, Conversation
+
+    customer_values = {
+        "customer_id": uuid.UUID(entry["customer_id"]),
+        "tenant_id": tenant.pk,
+        "phone_number": entry["phone_number"],
+        "name": entry["name"],
+        "city": entry["city"],
+        "state": entry["state"],
+    }
+    customer = Customer.from_db(
+        router.db_for_read(Customer),
+        [f.attname for f in Customer._meta.concrete_fields if f.attname in customer_values],
+        [customer_values[f.attname] for f in Customer._meta.concrete_fields if f.attname in customer_values],
+    )
+    customer.tenant = tenant
+
+    conversation_values = {
+        "conversation_id": uuid.UUID(entry["conversation_id"]),
+        "tenant_id": tenant.pk,
+        "whatsapp_connection_id": conn.pk,
+        "customer_id": customer.customer_id,
+        "contest_id": uuid.UUID(entry["contest_id"]) if entry.get("contest_id") else None,
+    }
+    conversation = Conversation.from_db(
+        router.db_for_read(Conversation),
+        [f.attname for f in Conversation._meta.concrete_fields if f.attname in conversation_values],
+        [conversation_values[f.attname] for f in Conversation._meta.concrete_fields if f.attname in conversation_values],
+    )
+    conversation.tenant = tenant
+    conversation.whatsapp_connection = conn
+    conversation.customer = customer
+    return customer, conversation
+
+
+def _last_outbound_from_db(conversation_ids):
+    """Conversation id -> latest outbound CoreMessage inside the echo window (one query)."""
+    from .models import CoreMessage
+
+    last_outbound = {}
+    if conversation_ids:
+        for msg in CoreMessage.objects.filter(
+            conversation_id__in=conversation_ids,
+            direction="outbound",
+            created_at__gte=dj_timezone.now() - timedelta(seconds=ECHO_WINDOW_SECONDS),
+        ).order_by("-created_at").only("conversation_id", "text_body", "created_at"):
+            last_outbound.setdefault(msg.conversation_id, msg)
+    return last_outbound
+
+
+def _with_last_outbound(tenant_id, entries):
+    """
+    Overlay each entry with the latest outbound marker: from the shared cache, or
+    (process-local cache) from the database, since the LRU cannot see other
+    processes' sends.
+    """
+    latest = {}
+    if _cache_is_shared():
+        try:
+            markers = cache.get_many([_outbound_key(tenant_id, phone) for phone in entries])
+        except Exception:
+            markers = {}
+        for phone in entries:
+            marker = markers.get(_outbound_key(tenant_id, phone))
+            if marker:
+                latest[phone] = (marker["hash"], marker["at"])
+    else:
+        by_convo = {entry["conversation_id"]: phone for phone, entry in entries.items()}
+        for convo_id, msg in _last_outbound_from_db(list(by_convo)).items():
+            latest[by_convo[str(convo_id)]] = (text_hash(msg.text_body), msg.created_at.timestamp())
+    result = {}
+    for phone, entry in entries.items():
+        found = latest.get(phone)
+        if found and found[1] > (entry.get("last_outbound_at") or 0):
+            entry = {**entry, "last_outbound_hash": found[0], "last_outbound_at": found[1]}
+        result[phone] = entry
+    return result
+
+
+def _load_from_db(tenant, conn, phones):
+    """
+    Resolve cache misses: one SELECT (+ bulk INSERT) for customers, one for
+    conversations and one for the latest outbound message per conversation.
+    """
+    from .models import Customer, Conversation
+
+    customers = {}
+    for customer in Customer.objects.filter(tenant=tenant, phone_number__in=phones).order_by("created_at"):
+        customers.setdefault(customer.phone_number, customer)
+    new_customers = [
+        Customer(tenant=tenant, phone_number=phone, name=f"Customer {phone}", address="")
+        for phone in phones if phone not in customers
+    ]
+    if new_customers:
+        Customer.objects.bulk_create(new_customers)
+        for customer in new_customers:
+            customers[customer.phone_number] = customer
+            logger.info("Created new customer: %s", customer.phone_number)
+
+    conversations = {}
+    for convo in Conversation.objects.filter(
+        tenant=tenant,
+        whatsapp_connection=conn,
+        customer_id__in=[c.customer_id for c in customers.values()],
+    ).order_by("-created_at"):
+        conversations.setdefault(convo.customer_id, convo)
+    new_convos = [
+        Conversation(tenant=tenant, customer=customers[phone], whatsapp_connection=conn)
+        for phone in phones if customers[phone].customer_id not in conversations
+    ]
+    if new_convos:
+        Conversation.objects.bulk_create(new_convos)
+        for convo in new_convos:
+            conversations[convo.customer_id] = convo
+
+    new_convo_ids = {c.conversation_id for c in new_convos}
+    last_outbound = _last_outbound_from_db(
+        [c.conversation_id for c in conversations.values() if c.conversation_id not in new_convo_ids]
+    )
+
+    entries = {}
+    for phone in phones:
+        customer = customers[phone]
+        convo = conversations[customer.customer_id]
+        convo.customer = customer
+        entries[phone] = _entry_for(customer, convo, last_outbound.get(convo.conversation_id))
+    return entries
+
+
+def resolve_contacts(tenant, conn, phones):
+    """
+    Resolve many normalized phones at once.
+    Returns {phone: (customer, conversation, entry)}.
+    """
+    phones = list(dict.fromkeys(p for p in phones if p))
+    entries = {}
+    misses = []
+    for phone in phones:
+        entry = _lru.get(_key(tenant.pk, phone))
+        if entry is not None and entry.get("connection_id") == str(conn.pk):
+            entries[phone] = entry
+        else:
+            misses.append(phone)
+
+    if misses:
+        try:
+            shared = cache.get_many([_key(tenant.pk, p) for p in misses])
+        except Exception:
+            shared = {}
+        still_missing = []
+        for phone in misses:
+            entry = shared.get(_key(tenant.pk, phone))
+            if entry is not None and entry.get("connection_id") == str(conn.pk):
+                _lru.put(_key(tenant.pk, phone), entry)
+                entries[phone] = entry
+            else:
+                still_missing.append(phone)
+        if still_missing:
+            for phone, entry in _load_from_db(tenant, conn, still_missing).items():
+                _store(_key(tenant.pk, phone), entry)
+                entries[phone] = entry
+
+    result = {}
+    for phone, entry in _with_last_outbound(tenant.pk, entries).items():
+        customer, conversation = _instances_from_entry(entry, tenant, conn)
+        result[phone] = (customer, conversation, entry)
+    return result
+
+
+def resolve_contact(tenant, conn, phone):
+    """Resolve a single normalized phone. Returns (customer, conversation, entry)."""
+    return resolve_contacts(tenant, conn, [phone])[phone]
+
+
+def is_echo(entry, text, now=None):
+    """True if `text` equals our last outbound message to this contact sent moments ago."""
+    if not entry or not entry.get("last_outbound_hash") or not entry.get("last_outbound_at"):
+        return False
+    now = now if now is not None else time.time()
+    if now - entry["last_outbound_at"] >= ECHO_WINDOW_SECONDS:
+        return False
+    return entry["last_outbound_hash"] == text_hash(text)
+
+
+def record_outbound(tenant_id, number, text, sent_at=None):
+    """
+    Mark `text` as our latest outbound message to `number` (shared cache, kept for
+    the echo window) so its WABot echo is recognised without a query.
+    """
+    record_outbound_many(tenant_id, [(number, text)], sent_at=sent_at)
+
+
+def record_outbound_many(tenant_id, sends, sent_at=None):
+    """`record_outbound` for many (number, text) pairs in one cache write."""
+    if tenant_id is None or not sends:
+        return
+    at = sent_at.timestamp() if sent_at else time.time()
+    markers = {
+        _outbound_key(tenant_id, number): {"hash": text_hash(text), "at": at}
+        for number, text in sends if number
+    }
+    try:
+        cache.set_many(markers, timeout=ECHO_WINDOW_SECONDS)
+    except Exception as e:
+        logger.warning("Resolver outbound marker write failed: %s", e)
+
+
+def evict_contact(tenant_id, phone):
+    """Drop a contact from the LRU and the shared cache."""
+    key = _key(tenant_id, phone)
+    _lru.pop(key)
+    try:
+        cache.delete(key)
+    except Exception:
+        pass
+
+
+def clear_local():
+    """Clear the process-local LRU (tests/benchmarks)."""
+    _lru.clear()
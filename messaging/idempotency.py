@@ -0,0 +1,357 @@
+"""
+Cross-instance idempotency store for inbound webhook deduplication.
+
+`cache.add` on the default (LocMem) cache only dedupes within one process; with
+several App Engine instances a WABot retry that lands elsewhere was processed again.
+`claim(key)` / `claim_many(keys)` return True only for the first caller anywhere.
+
+The webhook claims a message's key as a short processing lease
+(WABOT_IDEMPOTENCY_PROCESSING_TTL, default 120 s) and only keeps it for the full
+TTL (`complete_many`) once the message has been handled. A handler that fails
+`release`s its keys, and one that crashes lets the lease lapse, so a retry (WABot's
+or the inbox's stale-lock reclaim) processes the message instead of dropping it as
+a duplicate.
+
+Backends (WABOT_IDEMPOTENCY_BACKEND):
+    db      (default) WebhookIdempotencyKey table; one INSERT .. ON CONFLICT .. RETURNING
+            per batch, expired rows are reclaimable and purged by `purge_expired`.
+    redis   SET key 1 NX EX ttl against WABOT_IDEMPOTENCY_REDIS_URL (needs `redis`).
+            `FakeRedis` implements the same calls in memory for tests/local runs.
+
+In front of either backend sits a per-process `SeenFilter`: a Bloom filter plus a
+bounded exact map of keys this process has claimed (and not released). A Bloom
+hit confirmed by the exact map is answered in memory (the common case: WABot retries
+to the same instance); a Bloom miss goes straight to the shared store. A Bloom false
+positive only costs a trip to the store, never a dropped message.
+
+If the shared store is unavailable we fall back to the per-process cache (the old
+behaviour) rather than dropping or double-processing everything.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone as dj_timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = int(os.getenv("WABOT_IDEMPOTENCY_TTL", str(24 * 60 * 60)))
+# Lease on a key while its message is processed; kept below the inbox's stale-lock
+# timeout so a reclaimed event finds the key free again
+PROCESSING_TTL_SECONDS = int(os.getenv("WABOT_IDEMPOTENCY_PROCESSING_TTL", "120"))
+BLOOM_CAPACITY = int(os.getenv("WABOT_IDEMPOTENCY_BLOOM_CAPACITY", "200000"))
+BLOOM_ERROR_RATE = float(os.getenv("WABOT_IDEMPOTENCY_BLOOM_ERROR_RATE", "0.001"))
+LOCAL_EXACT_SIZE = int(os.getenv("WABOT_IDEMPOTENCY_LOCAL_SIZE", "50000"))
+
+stats = {"local_hits": 0, "store_claims": 0, "store_duplicates": 0, "fallbacks": 0}
+
+
+def digest(key):
+    """Fixed-size store key (dedupe keys may embed message text)."""
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# =============================================================================
+# PER-PROCESS FILTER
+# =============================================================================
+
+class BloomFilter:
+    """Plain Bloom filter over a bytearray; k positions by double hashing."""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(1, int(capacity))
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        h = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(h[:8], "little")
+        h2 = int.from_bytes(h[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class SeenFilter:
+    """
+    Keys this process already knows are taken. Two Bloom generations are rotated
+    when the current one fills up so the false-positive rate stays bounded; the
+    exact map (key -> expiry) confirms Bloom hits.
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE, exact_size=LOCAL_EXACT_SIZE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.exact_size = max(1, exact_size)
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self._exact = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key):
+        with self._lock:
+            if key not in self._current and (self._previous is None or key not in self._previous):
+                return False
+            expires = self._exact.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._exact[key]
+                return False
+            return True
+
+    def add(self, key, ttl):
+        with self._lock:
+            if self._current.count >= self.capacity:
+                self._previous, self._current = self._current, BloomFilter(self.capacity, self.error_rate)
+            self._current.add(key)
+            self._exact[key] = time.monotonic() + ttl
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.exact_size:
+                self._exact.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._exact.pop(key, None)
+
+
+# =============================================================================
+# SHARED STORES
+# =============================================================================
+
+class DatabaseIdempotencyStore:
+    """Unique-keyed table; works on Postgres and SQLite (>= 3.35) via RETURNING."""
+
+    def claim_many(self, keys, ttl):
+        from .models import WebhookIdempotencyKey
+
+        if not keys:
+            return set()
+        now = dj_timezone.now()
+        expires = now + timedelta(seconds=ttl)
+        qn = connection.ops.quote_name
+        table, key_col = qn(WebhookIdempotencyKey._meta.db_table), qn("key")
+        now_db = connection.ops.adapt_datetimefield_value(now)
+        expires_db = connection.ops.adapt_datetimefield_value(expires)
+        placeholders = ", ".join(["(%s, %s, %s)"] * len(keys))
+        params = []
+        for key in keys:
+            params += [key, now_db, expires_db]
+        # A live row wins the conflict (no RETURNING row); an expired one is taken over.
+        sql = (
+            f"INSERT INTO {table} ({key_col}, created_at, expires_at) VALUES {placeholders} "
+            f"ON CONFLICT ({key_col}) DO UPDATE SET created_at = excluded.created_at, expires_at = excluded.expires_at "
+            f"WHERE {table}.expires_at < %s RETURNING {key_col}"
+        )
+        params.append(now_db)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return {row[0] for row in cursor.fetchall()}
+
+    def extend_many(self, keys, ttl):
+        from .models import WebhookIdempotencyKey
+        WebhookIdempotencyKey.objects.filter(key__in=keys).update(
+            expires_at=dj_timezone.now() + timedelta(seconds=ttl),
+        )
+
+    def release(self, key):
+        from .models import WebhookIdempotencyKey
+        WebhookIdempotencyKey.objects.filter(key=key).delete()
+
+    def purge_expired(self):
+        from .models import WebhookIdempotencyKey
+        deleted, _ = WebhookIdempotencyKey.objects.filter(expires_at__lt=dj_timezone.now()).delete()
+        return deleted
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis-py used by RedisIdempotencyStore."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def set(self, name, value, ex=None, nx=False):
+        with self._lock:
+            now = time.monotonic()
+            current = self._data.get(name)
+            if nx and current is not None and (current[1] is None or current[1] > now):
+                return None
+            self._data[name] = (value, now + ex if ex else None)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def pipeline(self, transaction=False):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def set(self, *args, **kwargs):
+        self._calls.append((args, kwargs))
+        return self
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        return [self._client.set(*args, **kwargs) for args, kwargs in calls]
+
+
+class RedisIdempotencyStore:
+    """SET NX EX per key, pipelined per batch. Expiry is handled by Redis."""
+
+    def __init__(self, client=None, prefix="wabot:idem:"):
+        if client is None:
+            import redis  # optional dependency, only needed for this backend
+            client = redis.Redis.from_url(os.getenv("WABOT_IDEMPOTENCY_REDIS_URL", "redis://localhost:6379/0"))
+        self.client = client
+        self.prefix = prefix
+
+    def claim_many(self, keys, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(self.prefix + key, 1, ex=ttl, nx=True)
+        return {key for key, ok in zip(keys, pipe.execute()) if ok}
+
+    def extend_many(self, keys, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(self.prefix + key, 1, ex=ttl)
+        pipe.execute()
+
+    def release(self, key):
+        self.client.delete(self.prefix + key)
+
+    def purge_expired(self):
+        return 0
+
+
+_store = None
+_store_lock = threading.Lock()
+_seen = SeenFilter()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = os.getenv("WABOT_IDEMPOTENCY_BACKEND", "db").lower()
+                if backend == "redis":
+                    _store = RedisIdempotencyStore()
+                elif backend == "fake":
+                    _store = RedisIdempotencyStore(client=FakeRedis())
+                else:
+                    _store = DatabaseIdempotencyStore()
+    return _store
+
+
+def set_store(store):
+    """Swap the shared store (tests/benchmarks); also resets the local filter."""
+    global _store, _seen
+    _store = store
+    _seen = SeenFilter()
+
+
+# =============================================================================
+# PUBLIC API
+# =============================================================================
+
+def claim_many(keys, ttl=DEFAULT_TTL_SECONDS):
+    """
+    Claim dedupe keys. Returns the subset claimed by this call (i.e. first seen
+    anywhere); keys not returned are duplicates. Order and repeats are preserved
+    by the caller; each distinct key is claimed at most once.
+    """
+    distinct = list(dict.fromkeys(k for k in keys if k))
+    claimed = set()
+    to_store = []
+    for key in distinct:
+        if _seen.seen(key):
+            stats["local_hits"] += 1
+        else:
+            to_store.append(key)
+    if not to_store:
+        return claimed
+
+    digests = {digest(key): key for key in to_store}
+    try:
+        won = get_store().claim_many(list(digests), ttl)
+    except Exception as e:
+        logger.warning("Idempotency store unavailable, using per-process cache: %s", e)
+        stats["fallbacks"] += 1
+        won = {d for d, key in digests.items() if cache.add(f"wabot:idem:{d}", True, timeout=ttl)}
+
+    for d, key in digests.items():
+        if d in won:
+            # Only our own claims are answered locally: another holder may still release
+            _seen.add(key, ttl)
+            claimed.add(key)
+            stats["store_claims"] += 1
+        else:
+            stats["store_duplicates"] += 1
+    return claimed
+
+
+def claim(key, ttl=DEFAULT_TTL_SECONDS):
+    """True if this caller is the first to handle `key`."""
+    return key in claim_many([key], ttl=ttl)
+
+
+def complete_many(keys, ttl=DEFAULT_TTL_SECONDS):
+    """Keep claimed keys for `ttl` seconds: their messages were handled."""
+    distinct = list(dict.fromkeys(k for k in keys if k))
+    if not distinct:
+        return
+    for key in distinct:
+        _seen.add(key, ttl)
+    try:
+        get_store().extend_many([digest(key) for key in distinct], ttl)
+    except Exception as e:
+        logger.warning("Idempotency store unavailable, using per-process cache: %s", e)
+        stats["fallbacks"] += 1
+        cache.set_many({f"wabot:idem:{digest(key)}": True for key in distinct}, timeout=ttl)
+
+
+def complete(key, ttl=DEFAULT_TTL_SECONDS):
+    complete_many([key], ttl=ttl)
+
+
+def release(key):
+    """Give a key back (processing failed before any side effect) so a retry can run."""
+    _seen.discard(key)
+    try:
+        get_store().release(digest(key))
+    except Exception as e:
+        logger.warning("Idempotency release failed for %s: %s", key, e)
+    cache.delete(f"wabot:idem:{digest(key)}")
+
+
+def release_many(keys):
+    for key in dict.fromkeys(k for k in keys if k):
+        release(key)
+
+
+def purge_expired():
+    """Delete expired keys from the shared store. Returns the number removed."""
+    return get_store().purge_expired()
@@ -0,0 +1,151 @@
+"""
+Benchmark: CPU spent on webhook logging per request.
+
+Runs `process_webhook_payload` on a representative image message that has already
+been seen (msg_id dedupe hit), so every iteration goes through the payload
+diagnostics and stops before any database or provider call. Modes:
+
+- baseline          webhook logger disabled (floor cost of the pipeline itself)
+- legacy_prints     baseline + the unconditional stderr prints this path used to make
+- json_info         structured logging at INFO (production default)
+- json_debug        DEBUG with diagnostics sampled at WABOT_LOG_SAMPLE_RATE
+- json_debug_all    DEBUG with every diagnostic kept
+
+CPU is measured on the calling (request) thread; log writing happens in the queue
+listener thread, which is reported separately as process CPU.
+
+    python manage.py bench_webhook_logging --iterations 20000
+"""
+import base64
+import json
+import logging
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from messaging import idempotency, structured_logging, whatsapp_webhook
+from messaging.structured_logging import AsyncJsonHandler
+from messaging.webhook_events import parse_webhook
+
+
+def _payload(msg_id):
+    thumbnail = base64.b64encode(os.urandom(3000)).decode()
+    return {
+        "instance_id": "BENCH0000001",
+        "data": {
+            "event": "messages.upsert",
+            "data": {
+                "key": {"remoteJid": "60123456789@s.whatsapp.net", "fromMe": False, "id": msg_id},
+                "pushName": "Bench",
+                "messageTimestamp": 1700000000,
+                "message": {
+                    "imageMessage": {
+                        "url": "https://mmg.whatsapp.net/o1/v/t62.7118-24/f1/m233/up-oil-image?ccb=9-4&oh=x&oe=y",
+                        "mimetype": "image/jpeg",
+                        "caption": "RECEIPT",
+                        "fileSha256": "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=",
+                        "fileLength": "183029",
+                        "mediaKey": "BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB=",
+                        "directPath": "/o1/v/t62.7118-24/f1/m233/up-oil-image?ccb=9-4",
+                        "jpegThumbnail": thumbnail,
+                    },
+                },
+            },
+        },
+    }
+
+
+def _legacy_prints(top):
+    """The stderr prints the old webhook made before reaching the msg_id dedupe."""
+    payload = parse_webhook(top)
+    event_type, event_data, ev = payload.event_type, payload.data, payload.first
+    out = sys.stderr
+    print("WEBHOOK POST HIT path=/webhook/whatsapp/ IP=127.0.0.1 UA=bench raw_len=4400", file=out)
+    print("TOP keys=", list(top.keys())[:10], file=out)
+    print("INNER event=", top["data"].get("event"), "INNER keys=", list(top["data"].keys())[:10], file=out)
+    print("EVENT_DATA keys=", list(event_data.keys())[:20], file=out)
+    print("EVENT_DATA sample=", str(event_data)[:500], file=out)
+    print("EVENT type=", event_type, "is_message=", True, "from=", ev.sender, "text=", ev.text[:200], file=out)
+    print("META msg_id=", ev.msg_id, "fromMe=", ev.from_me, "status=", ev.status, file=out)
+    print("SKIP: duplicate message event (msg_id dedupe)", ev.msg_id, file=out)
+    print("WEBHOOK 200 OK (msg_id_dedupe)", file=out)
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request CPU spent on webhook logging (legacy prints vs structured logging)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=10000,
+            help='Requests per mode (default: 10000)'
+        )
+        parser.add_argument(
+            '--sample-rate',
+            type=float,
+            default=structured_logging.DEFAULT_SAMPLE_RATE,
+            help='Diagnostic sample rate for json_debug (default: WABOT_LOG_SAMPLE_RATE)'
+        )
+
+    def handle(self, *args, **options):
+        iterations = max(1, options['iterations'])
+        top = _payload("BENCH-MSG-1")
+        # In-memory store so the duplicate check never touches the database.
+        idempotency.set_store(idempotency.RedisIdempotencyStore(client=idempotency.FakeRedis()))
+        idempotency.claim("wabot:seen:msgid:BENCH-MSG-1")
+
+        logger = whatsapp_webhook.logger
+        saved = (logger.handlers[:], logger.level, logger.propagate, structured_logging.DEFAULT_SAMPLE_RATE)
+        real_stderr = sys.stderr
+        devnull = open(os.devnull, "w")
+        handler = AsyncJsonHandler(stream=devnull)
+
+        modes = [
+            ("baseline", logging.CRITICAL, None, False),
+            ("legacy_prints", logging.CRITICAL, None, True),
+            ("json_info", logging.INFO, None, False),
+            ("json_debug", logging.DEBUG, options['sample_rate'], False),
+            ("json_debug_all", logging.DEBUG, 1.0, False),
+        ]
+        results = {}
+        try:
+            logger.handlers[:] = [handler]
+            logger.propagate = False
+            sys.stderr = devnull
+            for name, level, rate, legacy in modes:
+                logger.setLevel(level)
+                if rate is not None:
+                    structured_logging.DEFAULT_SAMPLE_RATE = rate
+                thread_start, process_start = time.thread_time(), time.process_time()
+                for _ in range(iterations):
+                    if legacy:
+                        _legacy_prints(top)
+                    whatsapp_webhook.process_webhook_payload(top)
+                thread_cpu = time.thread_time() - thread_start
+                # Let the listener finish writing so its CPU lands in this mode.
+                while not handler.queue.empty():
+                    time.sleep(0.01)
+                process_cpu = time.process_time() - process_start
+                results[name] = (thread_cpu / iterations * 1e6, process_cpu / iterations * 1e6)
+        finally:
+            sys.stderr = real_stderr
+            logger.handlers[:], logger.level, logger.propagate, structured_logging.DEFAULT_SAMPLE_RATE = saved
+            handler.close()
+            devnull.close()
+            idempotency.set_store(None)
+
+        base_thread, base_process = results["baseline"]
+        legacy_thread, legacy_process = results["legacy_prints"]
+        self.stdout.write(f"{iterations} requests per mode (payload {len(json.dumps(top))} bytes)")
+        self.stdout.write(f"{'mode':<16}{'request us':>12}{'process us':>12}{'logging us':>12}{'saved us':>10}")
+        for name, (thread_us, process_us) in results.items():
+            logging_us = thread_us - base_thread
+            saved_us = legacy_thread - thread_us if name.startswith("json") else 0.0
+            self.stdout.write(
+                f"{name:<16}{thread_us:>12.1f}{process_us:>12.1f}{logging_us:>12.1f}{saved_us:>10.1f}"
+            )
+        if handler.dropped:
+            self.stdout.write(self.style.WARNING(f"{handler.dropped} records dropped (queue full)"))
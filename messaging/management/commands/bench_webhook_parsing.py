@@ -0,0 +1,232 @@
+"""
+Management command to measure webhook payload parsing cost per payload.
+
+Compares the previous extraction sequence (unwrap, then separate walks for
+sender/text, meta, dedupe key, nested data and media) with `peek_webhook` on
+enqueue plus the single-pass `webhook_events.parse_webhook` in the worker.
+Payloads come from a `record_webhook_payloads` corpus, or a built-in
+text/image/batch mix when --input is not given.
+
+    python manage.py bench_webhook_parsing --input webhook_payloads.jsonl --iterations 20000
+"""
+import gc
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from messaging.webhook_events import parse_webhook, peek_webhook
+from messaging.webhook_replay import load_records
+
+_DIGITS_ONLY = re.compile(r"\D+")
+
+
+# =============================================================================
+# LEGACY EXTRACTION (baseline, as the webhook did it before webhook_events)
+# =============================================================================
+
+def _legacy_norm_number(n):
+    if not n:
+        return None
+    s = str(n).strip()
+    s = _DIGITS_ONLY.sub("", s)
+    return s or None
+
+
+def _legacy_from_and_text(obj):
+    if not isinstance(obj, dict):
+        return None, ""
+    sender = obj.get("from") or obj.get("number") or obj.get("phone")
+    if not sender:
+        key_obj = obj.get("key", {})
+        if isinstance(key_obj, dict):
+            remote_jid_raw = key_obj.get("remoteJid", "") or ""
+            if remote_jid_raw.endswith("@g.us"):
+                remote_jid = key_obj.get("participantAlt") or key_obj.get("participant") or ""
+            else:
+                remote_jid = key_obj.get("remoteJidAlt") or remote_jid_raw
+            if remote_jid:
+                sender = remote_jid.split("@")[0] if "@" in remote_jid else remote_jid
+    msg_obj = obj.get("message")
+    text = ""
+    if isinstance(msg_obj, dict):
+        text = msg_obj.get("conversation", "")
+        if not text:
+            ext_text = msg_obj.get("extendedTextMessage", {})
+            if isinstance(ext_text, dict):
+                text = ext_text.get("text", "")
+        if not text:
+            text = msg_obj.get("body") or msg_obj.get("text") or ""
+    elif isinstance(msg_obj, str):
+        text = msg_obj
+    else:
+        text = obj.get("text") or ""
+    return _legacy_norm_number(sender), (str(text) if text is not None else "")
+
+
+def _legacy_media_info(obj):
+    if not isinstance(obj, dict):
+        return None, None, None, None
+    msg_obj = obj.get("message")
+    if not isinstance(msg_obj, dict):
+        return None, None, None, None
+    for field, kind in (("imageMessage", "image"), ("videoMessage", "video"), ("documentMessage", "document")):
+        if field in msg_obj:
+            media = msg_obj[field]
+            meta = media if isinstance(media, dict) else {}
+            return kind, meta.get("url"), meta.get("caption", ""), meta
+    return None, None, None, None
+
+
+def _legacy_meta(event_data):
+    msg = None
+    if isinstance(event_data, list) and event_data:
+        msg = event_data[0] if isinstance(event_data[0], dict) else None
+    elif isinstance(event_data, dict):
+        msg = event_data
+    if not isinstance(msg, dict):
+        return {"msg_id": None, "from_me": None, "status": None, "remote_jid": None, "timestamp": None}
+    key_obj = msg.get("key", {}) if isinstance(msg.get("key", {}), dict) else {}
+    return {
+        "msg_id": key_obj.get("id"),
+        "from_me": key_obj.get("fromMe"),
+        "remote_jid": key_obj.get("remoteJid"),
+        "status": msg.get("status"),
+        "timestamp": msg.get("messageTimestamp"),
+    }
+
+
+def _legacy_dedupe_key(sender, text, meta):
+    if meta.get("msg_id"):
+        return f"wabot:seen:msgid:{meta['msg_id']}"
+    remote = meta.get("remote_jid") or sender or ""
+    ts = meta.get("timestamp") or ""
+    return f"wabot:seen:fallback:{remote}:{ts}:{(text or '')[:200]}"
+
+
+def _legacy_unwrap(top):
+    event_type = top.get("type")
+    event_data = top.get("data")
+    instance_id = top.get("instance_id") or os.getenv("WABOT_INSTANCE_ID", "")
+    if not event_type and isinstance(event_data, dict):
+        inner_event = event_data.get("event")
+        if inner_event:
+            event_type = inner_event
+            event_data = event_data.get("data")
+    return event_type, event_data, instance_id
+
+
+def _legacy_message(msg):
+    meta = _legacy_meta(msg)
+    sender, text = _legacy_from_and_text(msg)
+    key = _legacy_dedupe_key(sender, text, meta)
+    if (not sender or not text) and isinstance(msg.get("data"), dict):
+        sender2, text2 = _legacy_from_and_text(msg["data"])
+        sender = sender or sender2
+        text = text or text2
+    media = _legacy_media_info(msg)
+    return sender, text, key, media
+
+
+def legacy_parse(top):
+    event_type, event_data, instance_id = _legacy_unwrap(top)
+    # The inbox enqueue unwrapped and read the meta once, the worker then did it all again.
+    _legacy_meta(event_data)
+    event_type, event_data, instance_id = _legacy_unwrap(top)
+    if isinstance(event_data, list):
+        return [_legacy_message(m) for m in event_data if isinstance(m, dict)]
+    if isinstance(event_data, dict):
+        return [_legacy_message(event_data)]
+    return []
+
+
+def new_parse(top):
+    # Inbox enqueue peeks at the envelope; the worker parses once.
+    peek_webhook(top)
+    return [(ev.sender, ev.text, ev.dedupe_key, ev.media_kind) for ev in parse_webhook(top).events]
+
+
+# =============================================================================
+# CORPUS
+# =============================================================================
+
+def _builtin_corpus():
+    def upsert(msg_id, phone, message):
+        return {
+            "key": {"remoteJid": f"{phone}@s.whatsapp.net", "fromMe": False, "id": msg_id},
+            "pushName": "Bench",
+            "messageTimestamp": 1700000000,
+            "message": message,
+        }
+
+    text = upsert("BENCH-T1", "60123456789", {"conversation": "I agree"})
+    image = upsert("BENCH-I1", "60123456780", {
+        "imageMessage": {
+            "url": "https://mmg.whatsapp.net/o1/v/t62.7118-24/f1/m233/up-oil-image?ccb=9-4",
+            "mimetype": "image/jpeg",
+            "caption": "RECEIPT",
+            "fileSha256": "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=",
+            "mediaKey": "BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB=",
+        },
+    })
+    batch = [upsert(f"BENCH-B{i}", f"6012345670{i}", {"extendedTextMessage": {"text": f"msg {i}"}}) for i in range(5)]
+    wrap = lambda data: {"instance_id": "BENCH", "data": {"event": "messages.upsert", "data": data}}
+    return [wrap(text), wrap(image), wrap(batch)]
+
+
+class Command(BaseCommand):
+    help = 'Measure webhook payload parsing time per payload (legacy multi-walk vs single-pass normalizer)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--input',
+            default='',
+            help='JSONL corpus written by record_webhook_payloads (default: built-in sample payloads)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20000,
+            help='Payloads parsed per mode (default: 20000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['input']:
+            try:
+                corpus = [r['payload'] for r in load_records(options['input']) if isinstance(r.get('payload'), dict)]
+            except OSError as e:
+                raise CommandError(f"Cannot read {options['input']}: {e}")
+        else:
+            corpus = _builtin_corpus()
+        if not corpus:
+            raise CommandError('No payloads to parse')
+
+        iterations = max(1, options['iterations'])
+        mismatches = sum(
+            1 for top in corpus
+            if [m[:3] for m in legacy_parse(top)] != [m[:3] for m in new_parse(top)]
+        )
+        self.stdout.write(f"Corpus: {len(corpus)} payloads, {mismatches} with differing sender/text/dedupe key")
+
+        results = {}
+        for label, fn in (('legacy', legacy_parse), ('single-pass', new_parse)):
+            results[label] = self._time(fn, corpus, iterations)
+            self.stdout.write(f"{label:>12}: {results[label]:.2f} us/payload")
+        self.stdout.write(self.style.SUCCESS(
+            f"Speedup: {results['legacy'] / results['single-pass']:.2f}x"
+        ))
+
+    def _time(self, fn, corpus, iterations):
+        n = len(corpus)
+        for i in range(min(iterations, 1000)):
+            fn(corpus[i % n])
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for i in range(iterations):
+                fn(corpus[i % n])
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        return elapsed / iterations * 1e6
@@ -0,0 +1,76 @@
+"""
+Management command to export sanitized webhook payloads (from the inbox) to JSONL
+for `replay_webhook_payloads`.
+"""
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from messaging.models import WebhookInboxEvent
+from messaging.webhook_replay import PayloadSanitizer
+
+
+class Command(BaseCommand):
+    help = 'Record sanitized WABot webhook payloads from the inbox to a JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default='webhook_payloads.jsonl',
+            help='JSONL file to write (default: webhook_payloads.jsonl)'
+        )
+        parser.add_argument(
+            '--since-hours',
+            type=float,
+            default=24,
+            help='Only export events received in the last N hours (default: 24)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=5000,
+            help='Maximum number of payloads to export (default: 5000)'
+        )
+        parser.add_argument(
+            '--event-type',
+            default='',
+            help='Only export this event type (e.g. messages.upsert)'
+        )
+        parser.add_argument(
+            '--salt',
+            default=None,
+            help='Salt for phone/number remapping (default: random per export)'
+        )
+
+    def handle(self, *args, **options):
+        events = WebhookInboxEvent.objects.filter(
+            received_at__gte=timezone.now() - timedelta(hours=options['since_hours'])
+        ).order_by('received_at')
+        if options['event_type']:
+            events = events.filter(event_type=options['event_type'])
+
+        sanitizer = PayloadSanitizer(salt=options['salt'])
+        written = skipped = 0
+        first_at = None
+        with open(options['output'], 'w', encoding='utf-8') as fh:
+            for event in events[: options['limit']].iterator():
+                try:
+                    payload = json.loads(event.raw_body)
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                first_at = first_at or event.received_at
+                record = {
+                    'offset_ms': int((event.received_at - first_at).total_seconds() * 1000),
+                    'instance_id': event.instance_id,
+                    'event_type': event.event_type,
+                    'payload': sanitizer.sanitize(payload),
+                }
+                fh.write(json.dumps(record, ensure_ascii=False) + '\n')
+                written += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} payloads to {options['output']} ({skipped} unreadable skipped)"
+        ))
@@ -0,0 +1,188 @@
+"""
+Management command to replay recorded webhook payloads as a load test.
+
+In-process (default): requests go through the Django test client with WABot and
+receipt OCR stubbed, and DB queries are counted across all threads.
+HTTP (--url): requests go to a running server; the server's own backends are used
+and DB queries are not reported.
+
+    python manage.py replay_webhook_payloads --input webhook_payloads.jsonl --rps 50 --concurrency 16
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from messaging.webhook_replay import QueryCounter, ReplayRunner, load_records, percentile, stub_backends
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded WABot webhook payloads and report latency, error rate and DB queries per message'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--input',
+            default='webhook_payloads.jsonl',
+            help='JSONL file written by record_webhook_payloads'
+        )
+        parser.add_argument(
+            '--rps',
+            type=float,
+            default=10.0,
+            help='Requests per second (default: 10, 0 = as fast as possible)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Maximum requests in flight (default: 4)'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=0,
+            help='Total requests; payloads are looped with fresh msg ids (default: one pass)'
+        )
+        parser.add_argument(
+            '--url',
+            default='',
+            help='Fire at a running server (e.g. http://127.0.0.1:8000/webhook/whatsapp/) instead of in-process'
+        )
+        parser.add_argument(
+            '--instance-id',
+            default='',
+            help='Override instance_id in every payload (route to a local test connection)'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['inbox', 'inline'],
+            default='inbox',
+            help='In-process webhook mode (default: inbox, drained by --workers threads)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Inbox worker threads for in-process inbox mode (default: 4)'
+        )
+        parser.add_argument(
+            '--wabot-latency-ms',
+            type=int,
+            default=50,
+            help='Stub WABot send latency (default: 50)'
+        )
+        parser.add_argument(
+            '--vision-latency-ms',
+            type=int,
+            default=800,
+            help='Stub receipt OCR latency (default: 800)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            records = load_records(options['input'])
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['input']}: {e}")
+        if not records:
+            raise CommandError('No payloads to replay')
+        if options['instance_id']:
+            for record in records:
+                if isinstance(record.get('payload'), dict):
+                    record['payload']['instance_id'] = options['instance_id']
+
+        if options['url']:
+            report = self._replay_http(records, options)
+        else:
+            report = self._replay_in_process(records, options)
+        self._print_report(report)
+
+    def _runner(self, records, send, options):
+        return ReplayRunner(
+            records, send,
+            rps=options['rps'],
+            concurrency=options['concurrency'],
+            count=options['count'] or len(records),
+        )
+
+    def _replay_http(self, records, options):
+        import requests
+
+        session = requests.Session()
+
+        def send(payload):
+            start = time.perf_counter()
+            r = session.post(options['url'], json=payload, timeout=30)
+            return r.status_code == 200, time.perf_counter() - start
+
+        runner = self._runner(records, send, options).run()
+        return {'runner': runner, 'queries': None, 'processing': None}
+
+    def _replay_in_process(self, records, options):
+        import os
+        from django.test import Client
+        from messaging.models import WebhookInboxEvent
+        from messaging.webhook_inbox import InboxWorkerPool
+
+        os.environ['WABOT_WEBHOOK_MODE'] = options['mode']
+        # The harness runs its own inbox workers; don't start the web-process ones too.
+        os.environ['WABOT_INBOX_INPROCESS_WORKERS'] = '0'
+        client = Client()
+
+        def send(payload):
+            start = time.perf_counter()
+            r = client.post('/webhook/whatsapp/', data=json.dumps(payload), content_type='application/json')
+            return r.status_code == 200, time.perf_counter() - start
+
+        started_at = timezone.now()
+        counter = QueryCounter()
+        with stub_backends(options['wabot_latency_ms'], options['vision_latency_ms']), counter.installed():
+            pool = None
+            if options['mode'] == 'inbox':
+                pool = InboxWorkerPool(size=options['workers'], poll_interval=0.2, name='replay').start()
+            runner = self._runner(records, send, options).run()
+            if pool:
+                with counter.ignoring_current_thread():
+                    while WebhookInboxEvent.objects.filter(
+                        received_at__gte=started_at, status__in=['pending', 'deferred', 'processing']
+                    ).exists():
+                        time.sleep(0.2)
+                pool.stop()
+
+        processing = None
+        if options['mode'] == 'inbox':
+            events = WebhookInboxEvent.objects.filter(received_at__gte=started_at)
+            processing = {
+                'latencies': [
+                    (e.processed_at - e.received_at).total_seconds()
+                    for e in events.filter(status='done').only('received_at', 'processed_at')
+                ],
+                'failed': events.filter(status='failed').count(),
+            }
+        return {'runner': runner, 'queries': counter.count, 'processing': processing}
+
+    def _print_report(self, report):
+        runner = report['runner']
+        total = len(runner.latencies)
+        ms = [v * 1000 for v in runner.latencies]
+        self.stdout.write(
+            f"Requests: {total} in {runner.elapsed:.1f}s ({total / runner.elapsed:.1f} req/s), "
+            f"messages: {runner.messages}"
+        )
+        self.stdout.write(
+            f"Webhook latency ms: p50={percentile(ms, 50):.1f} p95={percentile(ms, 95):.1f} "
+            f"p99={percentile(ms, 99):.1f} max={max(ms) if ms else 0:.1f}"
+        )
+        self.stdout.write(f"Error rate: {runner.errors / total * 100 if total else 0:.2f}% ({runner.errors} errors)")
+
+        processing = report['processing']
+        if processing is not None:
+            pms = [v * 1000 for v in processing['latencies']]
+            self.stdout.write(
+                f"End-to-end (received -> processed) ms: p50={percentile(pms, 50):.1f} "
+                f"p95={percentile(pms, 95):.1f} p99={percentile(pms, 99):.1f}; failed events: {processing['failed']}"
+            )
+        if report['queries'] is not None and runner.messages:
+            self.stdout.write(
+                f"DB queries: {report['queries']} total, {report['queries'] / runner.messages:.1f} per message"
+            )
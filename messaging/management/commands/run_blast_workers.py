@@ -0,0 +1,86 @@
+"""
+Management command to send blast campaigns (see messaging/blast_tasks.py).
+
+Run one or more of these when the in-process blast workers are disabled
+(WABOT_BLAST_INPROCESS_WORKERS=0), or to send large campaigns faster. Workers in
+every process share the connection's rate limit, so adding processes only helps
+while that limit is not yet reached.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from messaging.blast_tasks import (
+    CHUNK_SIZE, BlastWorkerPool, blast_worker_stats, materialize_next_campaign, recover_expired_leases,
+    run_next_chunk,
+)
+
+
+class Command(BaseCommand):
+    help = 'Prepare recipient lists and send pending recipients of blast campaigns'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of worker threads (default: 4)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help=f'Recipients claimed and sent per worker iteration (default: {CHUNK_SIZE})'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait when no campaign has pending recipients (default: 2.0)'
+        )
+        parser.add_argument(
+            '--stats-interval',
+            type=int,
+            default=60,
+            help='Seconds between progress reports (default: 60)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Prepare and send until no campaign has work left, then exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            recover_expired_leases()
+            while materialize_next_campaign():
+                pass
+            sent = failed = 0
+            while True:
+                counts = run_next_chunk(chunk_size=options['chunk_size'])
+                if counts is None:
+                    break
+                sent += counts['sent']
+                failed += counts['failed']
+            self.stdout.write(self.style.SUCCESS(f'Blast messages sent: {sent}, failed: {failed}.'))
+            return
+
+        pool = BlastWorkerPool(
+            size=options['workers'],
+            chunk_size=options['chunk_size'],
+            poll_interval=options['poll_interval'],
+        ).start()
+        self.stdout.write(f"Blast workers running ({options['workers']} threads, Ctrl+C to stop)...")
+
+        try:
+            while True:
+                time.sleep(max(1, options['stats_interval']))
+                stats = blast_worker_stats()
+                self.stdout.write(
+                    f"{timezone.now()}: preparing={stats['campaigns_preparing']} sending={stats['campaigns_sending']} "
+                    f"pending={stats['pending']} queued={stats['queued']} sent={stats['sent']} failed={stats['failed']}"
+                )
+        except KeyboardInterrupt:
+            pool.stop()
+            self.stdout.write(self.style.SUCCESS('Blast workers stopped'))
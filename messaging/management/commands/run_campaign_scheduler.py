@@ -0,0 +1,77 @@
+"""
+Management command to run the campaign scheduler (see messaging/campaign_scheduler.py).
+
+Starts scheduled blasts on time and sends queued campaign messages inside their
+campaign's send window. Run one per deployment: a second scheduler is safe (every
+start and send is claimed conditionally) but paces campaigns on its own.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from messaging.campaign_scheduler import (
+    HORIZON_SECONDS, LOAD_LIMIT, TICK_SECONDS, CampaignScheduler, recover_processing, scheduler_stats,
+)
+
+
+class Command(BaseCommand):
+    help = 'Start scheduled blasts and send queued campaign messages within their send windows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tick',
+            type=float,
+            default=TICK_SECONDS,
+            help=f'Seconds between schedule reloads (default: {TICK_SECONDS})'
+        )
+        parser.add_argument(
+            '--horizon',
+            type=int,
+            default=HORIZON_SECONDS,
+            help=f'Seconds ahead loaded into the timer heap (default: {HORIZON_SECONDS})'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=LOAD_LIMIT,
+            help=f'Rows loaded per reload (default: {LOAD_LIMIT})'
+        )
+        parser.add_argument(
+            '--stats-interval',
+            type=int,
+            default=60,
+            help='Seconds between scheduler reports (default: 60)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Start/send everything due now, then exit'
+        )
+
+    def handle(self, *args, **options):
+        scheduler = CampaignScheduler(tick=options['tick'], horizon=options['horizon'], limit=options['limit'])
+        if options['once']:
+            recover_processing()
+            counts = scheduler.tick()
+            self.stdout.write(self.style.SUCCESS(
+                f"Blasts started: {counts['blasts']}, messages sent: {counts['sent']}, "
+                f"retried: {counts['retried']}, failed: {counts['failed']}."
+            ))
+            return
+
+        scheduler.start()
+        self.stdout.write('Campaign scheduler running (Ctrl+C to stop)...')
+
+        try:
+            while True:
+                time.sleep(max(1, options['stats_interval']))
+                stats = scheduler_stats()
+                self.stdout.write(
+                    f"{timezone.now()}: blasts_scheduled={stats['blasts_scheduled']} queue_due={stats['queue_due']} "
+                    f"queue_later={stats['queue_later']} started={stats['blasts_started']} sent={stats['sent']} "
+                    f"failed={stats['failed']} deferred={stats['deferred']} window_closed={stats['window_closed']}"
+                )
+        except KeyboardInterrupt:
+            scheduler.stop()
+            self.stdout.write(self.style.SUCCESS('Campaign scheduler stopped'))
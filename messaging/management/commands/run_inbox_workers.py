@@ -0,0 +1,91 @@
+"""
+Management command to drain the WABot webhook inbox.
+
+Run one or more of these next to the web tier when the in-process inbox workers are
+disabled (WABOT_INBOX_INPROCESS_WORKERS=0), or to add capacity during campaign peaks.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from messaging.idempotency import purge_expired
+from messaging.media_cache import purge_cache
+from messaging.webhook_inbox import InboxWorkerPool, drain_once, inbox_lag_stats, purge_processed
+
+
+class Command(BaseCommand):
+    help = 'Process queued WABot webhook events from the inbox table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of worker threads (default: 4)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='Events claimed per worker iteration (default: 10)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the inbox is empty (default: 1.0)'
+        )
+        parser.add_argument(
+            '--stats-interval',
+            type=int,
+            default=60,
+            help='Seconds between inbox lag reports (default: 60)'
+        )
+        parser.add_argument(
+            '--purge-hours',
+            type=int,
+            default=72,
+            help='Delete processed events older than this many hours (default: 72, 0 disables)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the inbox once and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            total = 0
+            while True:
+                handled = drain_once(batch_size=options['batch_size'])
+                if not handled:
+                    break
+                total += handled
+            self.stdout.write(self.style.SUCCESS(f'Processed {total} inbox events.'))
+            return
+
+        pool = InboxWorkerPool(
+            size=options['workers'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        ).start()
+        self.stdout.write(f"Inbox workers running ({options['workers']} threads, Ctrl+C to stop)...")
+
+        try:
+            while True:
+                time.sleep(max(1, options['stats_interval']))
+                stats = inbox_lag_stats()
+                self.stdout.write(
+                    f"{timezone.now()}: pending={stats['pending']} processing={stats['processing']} "
+                    f"failed={stats['failed']} lag={stats['lag_seconds']}s"
+                )
+                if options['purge_hours'] > 0:
+                    purge_processed(older_than_hours=options['purge_hours'])
+                # Expired dedupe keys are reclaimable anyway; this only keeps the table small.
+                purge_expired()
+                # Prefetched media older than WABOT_MEDIA_CACHE_TTL_HOURS
+                purge_cache()
+        except KeyboardInterrupt:
+            pool.stop()
+            self.stdout.write(self.style.SUCCESS('Inbox workers stopped'))
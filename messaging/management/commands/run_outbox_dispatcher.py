@@ -0,0 +1,78 @@
+"""
+Management command to drain the outbound message outbox (see messaging/outbox.py).
+
+Run one or more of these when the in-process dispatchers are disabled
+(WABOT_OUTBOX_INPROCESS_DISPATCHERS=0), or to add capacity during campaign peaks.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from messaging.outbox import BATCH_SIZE, OutboxDispatcherPool, drain_once, fail_stale, outbox_stats
+
+
+class Command(BaseCommand):
+    help = 'Send queued outbound WhatsApp messages from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dispatchers',
+            type=int,
+            default=2,
+            help='Number of dispatcher threads (default: 2)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Messages claimed and sent per batch (default: {BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the outbox is empty (default: 1.0)'
+        )
+        parser.add_argument(
+            '--stats-interval',
+            type=int,
+            default=60,
+            help='Seconds between outbox reports (default: 60)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the outbox once and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            fail_stale()
+            total = 0
+            while True:
+                handled = drain_once(batch_size=options['batch_size'])
+                if not handled:
+                    break
+                total += handled
+            self.stdout.write(self.style.SUCCESS(f'Dispatched {total} outbox messages.'))
+            return
+
+        pool = OutboxDispatcherPool(
+            size=options['dispatchers'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        ).start()
+        self.stdout.write(f"Outbox dispatchers running ({options['dispatchers']} threads, Ctrl+C to stop)...")
+
+        try:
+            while True:
+                time.sleep(max(1, options['stats_interval']))
+                stats = outbox_stats()
+                self.stdout.write(
+                    f"{timezone.now()}: queued={stats['queued']} sending={stats['sending']} "
+                    f"failed={stats['failed']} sent_5m={stats['sent_last_5m']} lag={stats['lag_seconds']}s"
+                )
+        except KeyboardInterrupt:
+            pool.stop()
+            self.stdout.write(self.style.SUCCESS('Outbox dispatchers stopped'))
@@ -0,0 +1,104 @@
+"""
+Management command to run the local WABot simulator (see messaging/wabot_simulator.py).
+
+    python manage.py run_wabot_simulator 127.0.0.1:8765 --latency lognormal:60:0.5 --error-rate 0.01 \
+        --webhook-url http://127.0.0.1:8000/webhook/whatsapp/
+    WABOT_API_URL=http://127.0.0.1:8765/api python manage.py ...
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import run
+
+from messaging.wabot_simulator import WABotSimulator, parse_latency
+
+
+class Command(BaseCommand):
+    help = 'Run a local WABot stand-in (/send, /status, /get_media, /set_webhook) for benchmarks and tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'addrport',
+            nargs='?',
+            default='127.0.0.1:8765',
+            help='Address and port to listen on (default: 127.0.0.1:8765)'
+        )
+        parser.add_argument(
+            '--latency',
+            default='50',
+            help='Send latency in ms: "50", "uniform:20:200", "normal:80:20", "lognormal:60:0.5" or "exp:50" (default: 50)'
+        )
+        parser.add_argument(
+            '--error-rate',
+            type=float,
+            default=0.0,
+            help='Fraction of sends answered with 500 (default: 0)'
+        )
+        parser.add_argument(
+            '--throttle-rate',
+            type=float,
+            default=0.0,
+            help='Fraction of sends answered with 429 (default: 0)'
+        )
+        parser.add_argument(
+            '--rate-per-min',
+            type=float,
+            default=0,
+            help='Per-instance send limit; over it sends get 429 (default: 0 = unlimited)'
+        )
+        parser.add_argument(
+            '--webhook-url',
+            default='',
+            help='Default callback URL for instances without set_webhook'
+        )
+        parser.add_argument(
+            '--reply-rate',
+            type=float,
+            default=0.0,
+            help='Fraction of sends answered by a messages.upsert reply callback (default: 0)'
+        )
+        parser.add_argument(
+            '--reply-text',
+            default='hello',
+            help='Text of simulated replies (default: hello)'
+        )
+        parser.add_argument(
+            '--callback-delay-ms',
+            type=int,
+            default=200,
+            help='Delay before each callback (default: 200)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed for reproducible latency/error sequences'
+        )
+
+    def handle(self, *args, **options):
+        addr, _, port = options['addrport'].rpartition(':')
+        if not port.isdigit():
+            raise CommandError(f"{options['addrport']} is not a valid address:port")
+        try:
+            parse_latency(options['latency'])
+        except (ValueError, TypeError) as e:
+            raise CommandError(f"Invalid --latency: {e}")
+
+        app = WABotSimulator(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            throttle_rate=options['throttle_rate'],
+            rate_per_min=options['rate_per_min'],
+            webhook_url=options['webhook_url'],
+            reply_rate=options['reply_rate'],
+            reply_text=options['reply_text'],
+            callback_delay_ms=options['callback_delay_ms'],
+            seed=options['seed'],
+        )
+        addr = addr or '127.0.0.1'
+        self.stdout.write(self.style.SUCCESS(f"WABot simulator on http://{addr}:{port}/api"))
+        self.stdout.write(f"Point the app at it with WABOT_API_URL=http://{addr}:{port}/api (Ctrl-C to stop)")
+        try:
+            run(addr, int(port), app, threading=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            app.close()
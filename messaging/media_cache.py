@@ -0,0 +1,250 @@
+"""
+Eager fetch + decrypt of inbound WhatsApp media into a content-addressed local cache.
+
+The signed mmg.whatsapp.net URLs in a webhook expire, and receipt OCR used to
+download (and decrypt) the `.enc` file only once the contest flow reached
+`_handle_receipt_submission` - possibly minutes later, after PDPA consent, and
+always on the critical path of the reply.
+
+Now the webhook calls `prefetch(...)` as soon as a message carries image, video or
+document media. A small background pool downloads the file, decrypts it with
+`decrypt_whatsapp_media` (checked against `fileSha256`) and stores the plaintext
+under `<cache dir>/<sha[:2]>/<sha>`, where `sha` is the hex of `fileSha256`.
+`ReceiptOCRService` asks `lookup(media_meta)` first, waiting briefly for an
+in-flight fetch, and only goes to the network itself on a miss.
+
+Settings (env):
+- WABOT_MEDIA_CACHE_DIR: cache directory (default: <tmp>/wabot_media)
+- WABOT_MEDIA_PREFETCH_WORKERS: background fetchers (default 4, 0 disables prefetch)
+- WABOT_MEDIA_CACHE_TTL_HOURS: `purge_cache` age limit (default 24)
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.getenv("WABOT_MEDIA_CACHE_DIR") or Path(tempfile.gettempdir()) / "wabot_media")
+PREFETCH_WORKERS = int(os.getenv("WABOT_MEDIA_PREFETCH_WORKERS", "4") or 0)
+CACHE_TTL_HOURS = float(os.getenv("WABOT_MEDIA_CACHE_TTL_HOURS", "24") or 24)
+DOWNLOAD_TIMEOUT = 30
+
+# HKDF info strings per media kind (see whatsapp_media_crypto)
+MEDIA_INFO = {
+    "image": "WhatsApp Image Keys",
+    "video": "WhatsApp Video Keys",
+    "document": "WhatsApp Document Keys",
+}
+
+stats = {"prefetched": 0, "hits": 0, "misses": 0, "errors": 0}
+
+_executor = None
+_executor_lock = threading.Lock()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def looks_like_image(content):
+    return (
+        content[:3] == b"\xFF\xD8\xFF"
+        or content[:8] == b"\x89PNG\r\n\x1a\n"
+        or (content[:4] == b"RIFF" and content[8:12] == b"WEBP")
+    )
+
+
+def is_encrypted_url(url):
+    return ".enc" in url or ("mmg.whatsapp.net" in url and "/t62." in url)
+
+
+def cache_key(media_meta):
+    """Hex of the plaintext SHA-256 (`fileSha256`), or None when it is missing/invalid."""
+    sha_b64 = (media_meta or {}).get("fileSha256")
+    if not sha_b64 or not isinstance(sha_b64, str):
+        return None
+    try:
+        raw = base64.b64decode(sha_b64, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return raw.hex() if len(raw) == 32 else None
+
+
+def cache_path(key):
+    return CACHE_DIR / key[:2] / key
+
+
+def is_cached_file(path):
+    """True for files owned by the cache (callers must not delete them)."""
+    try:
+        return Path(path).resolve().is_relative_to(CACHE_DIR.resolve())
+    except (OSError, ValueError):
+        return False
+
+
+def fetch_to_cache(url, media_meta, media_kind="image"):
+    """
+    Download `url`, decrypt it if it is WhatsApp `.enc` media and store the plaintext
+    in the cache. Returns the cached Path. Raises on download/decrypt failure.
+    """
+    from . import wabot_http
+    from .whatsapp_media_crypto import decrypt_whatsapp_media
+
+    key = cache_key(media_meta)
+    if key is None:
+        raise ValueError("media has no fileSha256")
+    path = cache_path(key)
+    if path.exists():
+        return path
+
+    response = wabot_http.get(
+        url,
+        timeout=(wabot_http.CONNECT_TIMEOUT, DOWNLOAD_TIMEOUT),
+        headers={"User-Agent": "Mozilla/5.0 (compatible; ReceiptOCRService/1.0)", "Accept": "*/*"},
+    )
+    response.raise_for_status()
+    content = response.content or b""
+
+    media_key = media_meta.get("mediaKey")
+    if media_key and is_encrypted_url(url) and not looks_like_image(content):
+        content = decrypt_whatsapp_media(
+            enc_bytes=content,
+            media_key_b64=str(media_key),
+            media_info=MEDIA_INFO.get(media_kind, MEDIA_INFO["image"]),
+            expected_file_sha256_b64=media_meta.get("fileSha256"),
+        )
+    elif is_encrypted_url(url) and not looks_like_image(content):
+        raise ValueError("encrypted media without mediaKey")
+
+    return _write(key, content)
+
+
+def _write(key, content):
+    """Store plaintext under its SHA-256; content that does not match `key` is refused."""
+    if hashlib.sha256(content).hexdigest() != key:
+        raise ValueError("media content does not match fileSha256")
+    path = cache_path(key)
+    # Write-then-rename so readers never see a partial file.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".part-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="media-prefetch")
+    return _executor
+
+
+def _fetch_job(key, url, media_meta, media_kind):
+    try:
+        path = fetch_to_cache(url, media_meta, media_kind)
+        stats["prefetched"] += 1
+        logger.info("Media prefetched: kind=%s key=%s bytes=%s", media_kind, key[:12], path.stat().st_size)
+        return path
+    except Exception as e:
+        stats["errors"] += 1
+        logger.warning("Media prefetch failed: kind=%s key=%s error=%s", media_kind, key[:12], str(e)[:200])
+        return None
+
+
+def _forget(key):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+
+
+def prefetch(url, media_meta, media_kind="image"):
+    """
+    Start fetching media in the background (no-op if already cached, in flight,
+    disabled, or the payload carries no `fileSha256`). Never raises.
+    """
+    if PREFETCH_WORKERS <= 0 or not url or not media_meta:
+        return None
+    key = cache_key(media_meta)
+    if key is None or cache_path(key).exists():
+        return None
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        try:
+            future = _get_executor().submit(_fetch_job, key, url, dict(media_meta), media_kind)
+        except RuntimeError:
+            return None
+        _inflight[key] = future
+    future.add_done_callback(lambda _f: _forget(key))
+    return future
+
+
+def lookup(media_meta, wait=None):
+    """
+    Path of the cached plaintext for `media_meta`, or None.
+    An in-flight prefetch is waited for up to `wait` seconds (default: the download timeout).
+    """
+    key = cache_key(media_meta)
+    if key is None:
+        return None
+    path = cache_path(key)
+    if not path.exists():
+        with _inflight_lock:
+            future = _inflight.get(key)
+        if future is not None:
+            try:
+                future.result(timeout=DOWNLOAD_TIMEOUT if wait is None else wait)
+            except FutureTimeoutError:
+                pass
+    if path.exists():
+        stats["hits"] += 1
+        return path
+    stats["misses"] += 1
+    return None
+
+
+def store(media_meta, content):
+    """Put already-fetched plaintext into the cache (used by the OCR fallback download)."""
+    key = cache_key(media_meta)
+    if key is None or not content:
+        return None
+    path = cache_path(key)
+    if path.exists():
+        return path
+    try:
+        return _write(key, content)
+    except (OSError, ValueError) as e:
+        logger.debug("Media not cached: %s", e)
+        return None
+
+
+def purge_cache(older_than_hours=None):
+    """Delete cached media older than the TTL. Returns the number of files removed."""
+    cutoff = time.time() - 3600 * (CACHE_TTL_HOURS if older_than_hours is None else older_than_hours)
+    removed = 0
+    if not CACHE_DIR.exists():
+        return 0
+    for path in CACHE_DIR.glob("*/*"):
+        try:
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            continue
+    return removed
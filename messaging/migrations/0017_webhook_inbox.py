@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:51
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0016_contestentry_customer_notification_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookInboxEvent',
+            fields=[
+                ('event_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('instance_id', models.TextField(blank=True, default='')),
+                ('event_type', models.TextField(blank=True, default='')),
+                ('msg_id', models.TextField(blank=True, default='', help_text='Provider message id (key.id) if present')),
+                ('raw_body', models.TextField(help_text='Raw JSON body as received from WABot')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['received_at'],
+                'indexes': [models.Index(fields=['status', 'received_at'], name='messaging_w_status_132c27_idx'), models.Index(fields=['msg_id'], name='messaging_w_msg_id_c4c782_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0017_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='coremessage',
+            name='provider_msg_id',
+            field=models.TextField(blank=True, db_index=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='WebhookIdempotencyKey',
+            fields=[
+                ('key', models.CharField(help_text='blake2b digest of the dedupe key', max_length=64, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='messaging_w_expires_914f18_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0018_webhook_idempotency'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='webhookinboxevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('deferred', 'Deferred'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
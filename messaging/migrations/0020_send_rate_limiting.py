@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0019_webhook_inbox_deferred_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendRateBucket',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.FloatField(help_text='Unix time of the last refill')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='blastcampaign',
+            name='throttle_per_min',
+            field=models.IntegerField(blank=True, help_text='Max sends per minute for this blast (blank = connection limit only)', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0020_send_rate_limiting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blastcampaign',
+            name='prepared_media',
+            field=models.JSONField(blank=True, default=dict, help_text='Validated/optimized media handle sent to every recipient (see blast_media)'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0021_blast_prepared_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coremessage',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coremessage',
+            name='available_at',
+            field=models.DateTimeField(blank=True, help_text='Retry not before this time', null=True),
+        ),
+        migrations.AddField(
+            model_name='coremessage',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=128, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='coremessage',
+            name='last_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coremessage',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coremessage',
+            name='outbox_payload',
+            field=models.JSONField(blank=True, help_text='Send request (message/media) drained by the outbox dispatcher', null=True),
+        ),
+        migrations.AddField(
+            model_name='coremessage',
+            name='to_number',
+            field=models.CharField(blank=True, help_text='Recipient number (digits) for outbox sends', max_length=32, null=True),
+        ),
+        migrations.AlterField(
+            model_name='coremessage',
+            name='status',
+            field=models.TextField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('failed', 'Failed')], default='queued'),
+        ),
+        migrations.AddIndex(
+            model_name='coremessage',
+            index=models.Index(fields=['status', 'created_at'], name='messages_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coremessage',
+            index=models.Index(fields=['to_number', 'created_at'], name='messages_to_number_idx'),
+        ),
+    ]
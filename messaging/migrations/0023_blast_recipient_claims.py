@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0022_message_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blastrecipient',
+            name='claim_token',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='blastrecipient',
+            index=models.Index(fields=['blast_campaign', 'status'], name='blast_recipient_status_idx'),
+        ),
+    ]
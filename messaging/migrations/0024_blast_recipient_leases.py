@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0023_blast_recipient_claims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blastrecipient',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='blastrecipient',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='blast_recipient_lease_idx'),
+        ),
+    ]
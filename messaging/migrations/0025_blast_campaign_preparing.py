@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0024_blast_recipient_leases'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blastcampaign',
+            name='status',
+            field=models.CharField(choices=[('preparing', 'Preparing recipients'), ('draft', 'Draft'), ('scheduled', 'Scheduled'), ('sending', 'Sending'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='draft', max_length=20),
+        ),
+    ]
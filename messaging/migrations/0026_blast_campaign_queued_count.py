@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0025_blast_campaign_preparing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blastcampaign',
+            name='queued_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
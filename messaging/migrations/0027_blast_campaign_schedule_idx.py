@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0026_blast_campaign_queued_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blastcampaign',
+            index=models.Index(fields=['status', 'scheduled_at'], name='blast_campaign_schedule_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0027_blast_campaign_schedule_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendqueue',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -155,6 +155,7 @@ class CoreMessage(models.Model):
     
     STATUS_CHOICES = [
         ('queued', 'Queued'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('delivered', 'Delivered'),
         ('read', 'Read'),
@@ -167,17 +168,30 @@ class CoreMessage(models.Model):
     direction = models.TextField(choices=DIRECTION_CHOICES, blank=True, null=True)
     status = models.TextField(choices=STATUS_CHOICES, default='queued')
     text_body = models.TextField(blank=True, null=True)
-    provider_msg_id = models.TextField(blank=True, null=True)
+    provider_msg_id = models.TextField(blank=True, null=True, db_index=True)
     sent_at = models.DateTimeField(blank=True, null=True)
     delivered_at = models.DateTimeField(blank=True, null=True)
     read_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(default=dj_timezone.now)
     
+    # Outbox (see messaging/outbox.py): what to send, and the dispatcher's bookkeeping
+    to_number = models.CharField(max_length=32, blank=True, null=True, help_text='Recipient number (digits) for outbox sends')
+    outbox_payload = models.JSONField(blank=True, null=True, help_text='Send request (message/media) drained by the outbox dispatcher')
+    idempotency_key = models.CharField(max_length=128, unique=True, blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(blank=True, null=True, help_text='Retry not before this time')
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    
     def __str__(self):
         return f"{self.direction} - {self.status} - {self.created_at}"
 
     class Meta:
         db_table = 'messages'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='messages_status_created_idx'),
+            models.Index(fields=['to_number', 'created_at'], name='messages_to_number_idx'),
+        ]
 
 class MessageAttachment(models.Model):
     """Attachments for messages"""
@@ -394,6 +408,8 @@ class SendQueue(models.Model):
     error_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(default=dj_timezone.now)
     processed_at = models.DateTimeField(blank=True, null=True)
+    # When a scheduler claimed the row (queued -> processing)
+    locked_at = models.DateTimeField(blank=True, null=True)
     
     class Meta:
         ordering = ['scheduled_at']
@@ -804,6 +820,7 @@ class GroupMember(models.Model):
 class BlastCampaign(models.Model):
     """WhatsApp blast messaging campaigns"""
     STATUS_CHOICES = [
+        ('preparing', 'Preparing recipients'),
         ('draft', 'Draft'),
         ('scheduled', 'Scheduled'),
         ('sending', 'Sending'),
@@ -819,6 +836,7 @@ class BlastCampaign(models.Model):
     name = models.CharField(max_length=200)
     message_text = models.TextField(help_text='Message to be sent to recipients')
     message_image_url = models.URLField(blank=True, null=True, help_text='Optional image URL')
+    prepared_media = models.JSONField(default=dict, blank=True, help_text='Validated/optimized media handle sent to every recipient (see blast_media)')
     
     # Target recipients
     target_groups = models.ManyToManyField(CustomerGroup, related_name='blast_campaigns', blank=True)
@@ -827,12 +845,15 @@ class BlastCampaign(models.Model):
     # Campaign settings
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     scheduled_at = models.DateTimeField(blank=True, null=True)
+    throttle_per_min = models.IntegerField(blank=True, null=True, help_text='Max sends per minute for this blast (blank = connection limit only)')
     
     # Statistics
     total_recipients = models.IntegerField(default=0)
     sent_count = models.IntegerField(default=0)
     delivered_count = models.IntegerField(default=0)
     failed_count = models.IntegerField(default=0)
+    # Recipients claimed by a blast worker and not yet recorded (kept by blast_tasks)
+    queued_count = models.IntegerField(default=0)
     
     # Timestamps
     created_at = models.DateTimeField(default=dj_timezone.now)
@@ -841,6 +862,10 @@ class BlastCampaign(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The campaign scheduler's due-campaign lookup (see campaign_scheduler)
+            models.Index(fields=['status', 'scheduled_at'], name='blast_campaign_schedule_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.status}"
@@ -876,11 +901,93 @@ class BlastRecipient(models.Model):
     delivered_at = models.DateTimeField(blank=True, null=True)
     error_message = models.TextField(blank=True, null=True)
     
+    # Set when a blast worker claims the recipient (pending -> queued); see blast_tasks
+    claim_token = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # The claim lapses at this time unless the worker renews it (dead workers' chunks are reclaimed)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    
     created_at = models.DateTimeField(default=dj_timezone.now)
     
     class Meta:
         unique_together = ['blast_campaign', 'customer']
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['blast_campaign', 'status'], name='blast_recipient_status_idx'),
+            models.Index(fields=['status', 'lease_expires_at'], name='blast_recipient_lease_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.customer.name} - {self.blast_campaign.name} ({self.status})"
\ No newline at end of file
+        return f"{self.customer.name} - {self.blast_campaign.name} ({self.status})"
+# =============================================================================
+# WEBHOOK INBOX (ack-then-process)
+# =============================================================================
+
+class WebhookInboxEvent(models.Model):
+    """
+    Raw WABot webhook payload persisted before processing.
+    The webhook view only inserts a row and returns 200; inbox workers drain it.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('deferred', 'Deferred'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    instance_id = models.TextField(blank=True, default='')
+    event_type = models.TextField(blank=True, default='')
+    msg_id = models.TextField(blank=True, default='', help_text='Provider message id (key.id) if present')
+    raw_body = models.TextField(help_text='Raw JSON body as received from WABot')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+
+    received_at = models.DateTimeField(default=dj_timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['received_at']
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+            models.Index(fields=['msg_id']),
+        ]
+
+    def __str__(self):
+        return f"Inbox {self.event_id} - {self.event_type or 'unknown'} ({self.status})"
+
+
+class WebhookIdempotencyKey(models.Model):
+    """
+    Shared "already handled" marker for inbound webhook messages.
+    Inserted with ON CONFLICT so exactly one instance claims each key; rows past
+    `expires_at` can be reclaimed and are purged by the inbox workers.
+    """
+    key = models.CharField(max_length=64, primary_key=True, help_text='blake2b digest of the dedupe key')
+    created_at = models.DateTimeField(default=dj_timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} (expires {self.expires_at})"
+
+
+class SendRateBucket(models.Model):
+    """
+    Token-bucket state shared by every sender process (see rate_limiter).
+    One row per bucket key, e.g. "conn:<whatsapp_connection_id>"; rows are locked
+    with SELECT .. FOR UPDATE while tokens are taken.
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField(help_text='Unix time of the last refill')
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.1f} tokens"
@@ -0,0 +1,327 @@
+"""
+Transactional outbox for outbound WhatsApp messages.
+
+Senders used to call WABot synchronously and then write a `CoreMessage`, so every
+request path waited on the provider, and a crash between the two either lost the
+record or (on retry) sent twice. Now a sender calls `enqueue_message(...)`, which
+inserts `CoreMessage(status='queued')` carrying the send request
+(`outbox_payload`) in the caller's transaction and returns at once. Dispatchers
+drain the table after commit:
+
+- claiming is a conditional UPDATE (queued -> sending), so any number of threads
+  and processes can drain the same table without double-sending a row
+- only the oldest unsent message per recipient is claimable, so messages to one
+  number go out in the order they were queued (contest replies, image + text)
+- a claimed batch is sent through `AsyncWhatsAppAPIService` with the connection's
+  rate limiter and circuit breaker, and its outcomes are written in one bulk UPDATE
+- `idempotency_key` (unique) makes enqueueing idempotent: the same key returns the
+  existing row instead of queueing a second send
+
+Outcomes: sent; re-queued with backoff when WABot says it did not take the
+message (circuit open, 429, 502/503/504) until WABOT_OUTBOX_MAX_ATTEMPTS; failed
+otherwise. A row left in `sending` by a dead dispatcher is marked failed, not
+resent: the provider may already have delivered it.
+
+Dispatchers run either:
+- in-process (daemon threads started lazily after an enqueue commits), sized by
+  WABOT_OUTBOX_INPROCESS_DISPATCHERS (default 1, set 0 to disable), or
+- as dedicated processes via `python manage.py run_outbox_dispatcher`.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Exists, F, Min, OuterRef, Q
+from django.utils import timezone as dj_timezone
+
+from .customer_resolver import record_outbound, record_outbound_many
+from .models import CoreMessage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("WABOT_OUTBOX_BATCH_SIZE", "50") or 50)
+MAX_ATTEMPTS = int(os.getenv("WABOT_OUTBOX_MAX_ATTEMPTS", "5") or 5)
+RETRY_BASE_SECONDS = float(os.getenv("WABOT_OUTBOX_RETRY_SECONDS", "5") or 5)
+STALE_SECONDS = int(os.getenv("WABOT_OUTBOX_STALE_SECONDS", "300") or 300)
+# Responses that mean WABot did not take the message; safe to send again
+RETRY_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+_wakeup = threading.Event()
+_inprocess_lock = threading.Lock()
+_inprocess_pool = None
+
+
+def _digits(number):
+    return "".join(filter(str.isdigit, str(number or "")))
+
+
+def enqueue_message(tenant, number, message="", media_url=None, filename=None, conversation=None,
+                    text_body=None, idempotency_key=None):
+    """
+    Queue one outbound message and return its CoreMessage (status 'queued').
+
+    `message` is what WABot sends (the caption for media); `text_body` is what the
+    chat history shows (defaults to `message`). Dispatch starts after the surrounding
+    transaction commits. A repeated `idempotency_key` returns the existing row.
+    """
+    payload = {"number": _digits(number), "message": message or ""}
+    if media_url:
+        payload["media_url"] = media_url
+        if filename:
+            payload["filename"] = filename
+    fields = dict(
+        tenant=tenant,
+        conversation=conversation,
+        direction="outbound",
+        status="queued",
+        text_body=message if text_body is None else text_body,
+        to_number=payload["number"],
+        outbox_payload=payload,
+    )
+    if idempotency_key:
+        try:
+            with transaction.atomic():
+                msg, created = CoreMessage.objects.get_or_create(idempotency_key=idempotency_key, defaults=fields)
+        except IntegrityError:
+            msg, created = CoreMessage.objects.get(idempotency_key=idempotency_key), False
+        if not created:
+            logger.info("Outbox: duplicate enqueue ignored (key=%s)", idempotency_key)
+            return msg
+    else:
+        msg = CoreMessage.objects.create(**fields)
+    # The webhook must recognise this message's echo, whichever process sends it
+    record_outbound(getattr(tenant, "pk", tenant), payload["number"], payload["message"])
+    transaction.on_commit(_wake)
+    return msg
+
+
+def _wake():
+    _wakeup.set()
+    ensure_inprocess_dispatchers()
+
+
+# =============================================================================
+# CLAIM + DISPATCH
+# =============================================================================
+
+def _outbox():
+    return CoreMessage.objects.filter(outbox_payload__isnull=False)
+
+
+def _has_older_unsent():
+    """An earlier queued/sending message to the same number (keeps per-recipient order)."""
+    return Exists(_outbox().filter(
+        to_number=OuterRef("to_number"),
+        status__in=["queued", "sending"],
+        created_at__lt=OuterRef("created_at"),
+    ))
+
+
+def fail_stale():
+    """Rows a dead dispatcher left in `sending`: outcome unknown, so fail rather than resend."""
+    stale_before = dj_timezone.now() - timedelta(seconds=STALE_SECONDS)
+    return _outbox().filter(status="sending", locked_at__lt=stale_before).update(
+        status="failed", locked_at=None, last_error="dispatcher stopped mid-send; delivery unknown",
+    )
+
+
+def claim_messages(limit=BATCH_SIZE):
+    """Claim up to `limit` due messages, at most one per recipient, oldest first."""
+    now = dj_timezone.now()
+    due = _outbox().filter(status="queued").filter(Q(available_at__isnull=True) | Q(available_at__lte=now))
+    candidate_ids = list(
+        due.exclude(_has_older_unsent()).order_by("created_at").values_list("message_id", flat=True)[:limit]
+    )
+    claimed = []
+    for message_id in candidate_ids:
+        updated = CoreMessage.objects.filter(message_id=message_id, status="queued").exclude(
+            _has_older_unsent()
+        ).update(status="sending", locked_at=now, attempts=F("attempts") + 1)
+        if updated:
+            claimed.append(message_id)
+    if not claimed:
+        return []
+    return list(CoreMessage.objects.filter(message_id__in=claimed).select_related(
+        "tenant", "conversation__whatsapp_connection",
+    ).order_by("created_at"))
+
+
+def _provider_msg_id(data):
+    if not isinstance(data, dict):
+        return None
+    inner = data.get("data") if isinstance(data.get("data"), dict) else {}
+    key = inner.get("key") if isinstance(inner.get("key"), dict) else {}
+    return data.get("id") or data.get("message_id") or inner.get("id") or key.get("id")
+
+
+def _apply(msg, result, now):
+    """Record one SendResult on its (claimed) CoreMessage, in memory."""
+    msg.locked_at = None
+    if result.success:
+        msg.status = "sent"
+        msg.sent_at = now
+        msg.provider_msg_id = _provider_msg_id(result.data)
+        msg.last_error = None
+        return "sent"
+    msg.last_error = (result.error or "Unknown error")[:1000]
+    if result.extra.get("circuit_open"):
+        # Never went out; does not count as an attempt
+        msg.status = "queued"
+        msg.attempts = max(0, msg.attempts - 1)
+        msg.available_at = now + timedelta(seconds=RETRY_BASE_SECONDS)
+        return "requeued"
+    if result.extra.get("status_code") in RETRY_STATUS_CODES and msg.attempts < MAX_ATTEMPTS:
+        delay = RETRY_BASE_SECONDS * 2 ** (msg.attempts - 1)
+        msg.status = "queued"
+        msg.available_at = now + timedelta(seconds=random.uniform(delay / 2, delay))
+        return "requeued"
+    msg.status = "failed"
+    return "failed"
+
+
+def dispatch(messages):
+    """Send claimed messages (grouped per connection) and store the outcomes in one UPDATE."""
+    from .async_whatsapp_service import AsyncWhatsAppAPIService, SendJob
+    from .connection_routing import get_tenant_connection
+    from .rate_limiter import limiter_for_connection
+    from .whatsapp_service import WhatsAppAPIService
+
+    # Each connection sends with its own instance/token (and so its own breaker and limiter)
+    default_service = WhatsAppAPIService()
+    services = {}
+    by_connection = {}
+    for msg in messages:
+        wa_connection = msg.conversation.whatsapp_connection if msg.conversation else get_tenant_connection(msg.tenant)
+        if wa_connection is None:
+            conn_id = f"instance:{default_service.instance_id}"
+            services[conn_id] = default_service
+        else:
+            conn_id = wa_connection.pk
+            if conn_id not in services:
+                services[conn_id] = WhatsAppAPIService.for_connection(wa_connection)
+        by_connection.setdefault((conn_id, msg.tenant_id), []).append(msg)
+
+    outcomes = {"sent": 0, "requeued": 0, "failed": 0}
+    for (conn_id, tenant_id), group in by_connection.items():
+        by_id = {msg.message_id: msg for msg in group}
+        jobs = [
+            SendJob(
+                key=msg.message_id,
+                number=msg.outbox_payload.get("number") or msg.to_number,
+                message=msg.outbox_payload.get("message", ""),
+                media_url=msg.outbox_payload.get("media_url"),
+                filename=msg.outbox_payload.get("filename"),
+            )
+            for msg in group
+        ]
+        service = AsyncWhatsAppAPIService(
+            sync_service=services[conn_id], limiter=limiter_for_connection(conn_id, tenant_id), max_wait=0,
+        )
+        now = dj_timezone.now()
+        for result in service.send_iter(jobs):
+            outcomes[_apply(by_id[result.key], result, now)] += 1
+        # Refresh the echo markers from the actual send time (the queue may have lagged)
+        record_outbound_many(tenant_id, [
+            (msg.outbox_payload.get("number") or msg.to_number, msg.outbox_payload.get("message", ""))
+            for msg in group if msg.status == "sent"
+        ], sent_at=now)
+        CoreMessage.objects.bulk_update(
+            group, ["status", "sent_at", "provider_msg_id", "last_error", "attempts", "available_at", "locked_at"]
+        )
+    if outcomes["failed"]:
+        logger.warning("Outbox batch: %s", outcomes)
+    return outcomes
+
+
+def drain_once(batch_size=BATCH_SIZE):
+    """Claim and send one batch. Returns the number of messages handled."""
+    messages = claim_messages(limit=batch_size)
+    if messages:
+        dispatch(messages)
+    return len(messages)
+
+
+def outbox_stats():
+    now = dj_timezone.now()
+    queued = _outbox().filter(status="queued")
+    oldest = queued.aggregate(oldest=Min("created_at"))["oldest"]
+    return {
+        "queued": queued.count(),
+        "sending": _outbox().filter(status="sending").count(),
+        "failed": _outbox().filter(status="failed").count(),
+        "sent_last_5m": _outbox().filter(status="sent", sent_at__gte=now - timedelta(minutes=5)).count(),
+        "oldest_queued_at": oldest.isoformat() if oldest else None,
+        "lag_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+
+class OutboxDispatcherPool:
+    """
+    Threads draining the outbox. Used by both the in-process dispatchers and the
+    `run_outbox_dispatcher` management command.
+    """
+
+    def __init__(self, size=1, batch_size=BATCH_SIZE, poll_interval=1.0, name="outbox"):
+        self.size = max(1, int(size))
+        self.batch_size = max(1, int(batch_size))
+        self.poll_interval = float(poll_interval)
+        self.name = name
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target=self._run, name=f"{self.name}-dispatcher-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("Outbox dispatcher pool started: %s threads (%s)", self.size, self.worker_id)
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        _wakeup.set()
+        for t in self._threads:
+            t.join(timeout=timeout)
+
+    def is_alive(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def _run(self):
+        last_stale_check = 0.0
+        try:
+            while not self._stop.is_set():
+                handled = 0
+                try:
+                    close_old_connections()
+                    if time.monotonic() - last_stale_check > STALE_SECONDS / 2:
+                        fail_stale()
+                        last_stale_check = time.monotonic()
+                    handled = drain_once(batch_size=self.batch_size)
+                except Exception as e:
+                    logger.error("Outbox dispatcher loop error: %s", e, exc_info=True)
+                    time.sleep(self.poll_interval)
+                if not handled:
+                    _wakeup.wait(self.poll_interval)
+                    _wakeup.clear()
+        finally:
+            connection.close()
+
+
+def ensure_inprocess_dispatchers():
+    """Lazily start the in-process dispatcher pool (once per process)."""
+    global _inprocess_pool
+    size = int(os.getenv("WABOT_OUTBOX_INPROCESS_DISPATCHERS", "1") or 0)
+    if size <= 0:
+        return None
+    if _inprocess_pool is not None and _inprocess_pool.is_alive():
+        return _inprocess_pool
+    with _inprocess_lock:
+        if _inprocess_pool is None or not _inprocess_pool.is_alive():
+            _inprocess_pool = OutboxDispatcherPool(size=size, name="outbox-inprocess").start()
+    return _inprocess_pool
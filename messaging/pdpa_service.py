@@ -6,8 +6,9 @@ import re
 import logging
 from datetime import datetime
 from django.utils import timezone
-from .models import Customer, Consent, Tenant, WhatsAppConnection, Conversation, CoreMessage, Contest, ContestEntry
+from .models import Customer, Consent, Tenant, WhatsAppConnection, Conversation, Contest, ContestEntry
 from .whatsapp_service import WhatsAppAPIService
+from .outbox import enqueue_message
 
 logger = logging.getLogger(__name__)
 
@@ -151,13 +152,13 @@ class PDPAConsentService:
             en_message = self._get_first_contact_template_en(brand_name, customer_name)
             
             # Send BM version first
-            self._send_message_to_customer(tenant, customer, bm_message)
+            sent_bm = self._send_message_to_customer(tenant, customer, bm_message)
             
             # Send EN version after a short delay (in real implementation)
             # For now, we'll send both immediately
-            self._send_message_to_customer(tenant, customer, en_message)
+            sent_en = self._send_message_to_customer(tenant, customer, en_message)
             
-            return True
+            return sent_bm and sent_en
             
         except Exception as e:
             logger.error(f"Error sending first contact template: {str(e)}")
@@ -400,8 +401,7 @@ Your information has been updated. Thank you!"""
 
 You can send your IC number first, and I'll automatically extract your age, gender, and state information!"""
             
-            self._send_message_to_customer(tenant, customer, response)
-            return True
+            return self._send_message_to_customer(tenant, customer, response)
             
         except Exception as e:
             logger.error(f"Error sending info collection prompt: {str(e)}")
@@ -425,40 +425,30 @@ You can send your IC number first, and I'll automatically extract your age, gend
     def _send_message_to_customer(self, tenant, customer, message_text):
         """Send message to customer via WhatsApp"""
         try:
+            if not customer.phone_number:
+                logger.error(f"No phone number for customer {customer.customer_id}")
+                return False
+            
             # Get WhatsApp connection
             conn = WhatsAppConnection.objects.filter(tenant=tenant).first()
             if not conn:
                 logger.error(f"No WhatsApp connection found for tenant {tenant.tenant_id}")
                 return False
             
-            # Send via WhatsApp API
-            result = self.wa_service.send_text_message(customer.phone_number, message_text)
-            
-            if result['success']:
-                # Get or create conversation
-                conversation, _ = Conversation.objects.get_or_create(
-                    tenant=tenant,
-                    customer=customer,
-                    whatsapp_connection=conn,
-                    defaults={}
-                )
-                
-                # Create message record
-                CoreMessage.objects.create(
-                    tenant=tenant,
-                    conversation=conversation,
-                    direction='outbound',
-                    status='sent',
-                    text_body=message_text,
-                    provider_msg_id=result.get('data', {}).get('id'),
-                    sent_at=timezone.now()
-                )
-                
-                logger.info(f"Sent PDPA message to {customer.phone_number}")
-                return True
-            else:
-                logger.error(f"Failed to send message: {result.get('error')}")
-                return False
+            # Get or create conversation
+            conversation, _ = Conversation.objects.get_or_create(
+                tenant=tenant,
+                customer=customer,
+                whatsapp_connection=conn,
+                defaults={}
+            )
+            
+            # Queue in the outbox; the dispatcher sends it after commit
+            # (a failed enqueue raises and is reported as not sent below)
+            enqueue_message(tenant, customer.phone_number, message_text, conversation=conversation)
+            
+            logger.info(f"Queued PDPA message to {customer.phone_number}")
+            return True
                 
         except Exception as e:
             logger.error(f"Error sending message to customer: {str(e)}")
@@ -588,32 +578,16 @@ You can opt out anytime by typing STOP."""
             if not conn:
                 return False
             
-            result = self.wa_service.send_media_message(
-                customer.phone_number,
-                "Contest Information",
-                image_url
+            conversation, _ = Conversation.objects.get_or_create(
+                tenant=tenant,
+                customer=customer,
+                whatsapp_connection=conn,
+                defaults={}
             )
             
-            if result['success']:
-                # Create message record
-                conversation, _ = Conversation.objects.get_or_create(
-                    tenant=tenant,
-                    customer=customer,
-                    whatsapp_connection=conn,
-                    defaults={}
-                )
-                
-                CoreMessage.objects.create(
-                    tenant=tenant,
-                    conversation=conversation,
-                    direction='outbound',
-                    status='sent',
-                    text_body='[Image: Contest Information]',
-                    provider_msg_id=result.get('data', {}).get('id'),
-                    sent_at=timezone.now()
-                )
-                
-                return True
+            enqueue_message(tenant, customer.phone_number, "Contest Information", media_url=image_url,
+                            conversation=conversation, text_body='[Image: Contest Information]')
+            return True
         except Exception as e:
             logger.error(f"Error sending contest image: {str(e)}")
             return False
@@ -625,33 +599,16 @@ You can opt out anytime by typing STOP."""
             if not conn:
                 return False
             
-            result = self.wa_service.send_media_message(
-                customer.phone_number,
-                "Contest Animation",
-                gif_url,
-                filename="contest.gif"
+            conversation, _ = Conversation.objects.get_or_create(
+                tenant=tenant,
+                customer=customer,
+                whatsapp_connection=conn,
+                defaults={}
             )
             
-            if result['success']:
-                # Create message record
-                conversation, _ = Conversation.objects.get_or_create(
-                    tenant=tenant,
-                    customer=customer,
-                    whatsapp_connection=conn,
-                    defaults={}
-                )
-                
-                CoreMessage.objects.create(
-                    tenant=tenant,
-                    conversation=conversation,
-                    direction='outbound',
-                    status='sent',
-                    text_body='[GIF: Contest Animation]',
-                    provider_msg_id=result.get('data', {}).get('id'),
-                    sent_at=timezone.now()
-                )
-                
-                return True
+            enqueue_message(tenant, customer.phone_number, "Contest Animation", media_url=gif_url, filename="contest.gif",
+                            conversation=conversation, text_body='[GIF: Contest Animation]')
+            return True
         except Exception as e:
             logger.error(f"Error sending contest GIF: {str(e)}")
             return False
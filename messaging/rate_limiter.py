@@ -0,0 +1,198 @@
+"""
+Token-bucket rate limiting for outbound WABot sends.
+
+Two campaigns on the same WhatsApp number, running in different processes, used to
+send independently (each with its own 0.5s sleep) and together exceeded what WABot
+tolerates. Buckets are now keyed by what WABot actually limits:
+
+- "conn:<whatsapp_connection_id>"   WABOT_CONNECTION_RATE_PER_MIN (default 300)
+- "tenant:<tenant_id>"              WABOT_TENANT_RATE_PER_MIN (default 0 = off)
+- "blast:<blast_id>"                BlastCampaign.throttle_per_min, when set
+
+A send needs one token from every bucket that applies. Senders take tokens in
+batches (`acquire(n)` grants up to n at once), so the shared store is hit once
+per batch, not once per message.
+
+Stores (WABOT_RATE_LIMIT_BACKEND):
+    db      (default) SendRateBucket rows, locked with SELECT .. FOR UPDATE while
+            tokens are taken, so limits hold across processes/instances
+    local   in-memory buckets for one process (tests, local runs)
+"""
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_RATE_PER_MIN = float(os.getenv("WABOT_CONNECTION_RATE_PER_MIN", "300") or 0)
+TENANT_RATE_PER_MIN = float(os.getenv("WABOT_TENANT_RATE_PER_MIN", "0") or 0)
+# Bucket capacity in seconds of rate (e.g. 300/min with 2s burst = 10 tokens)
+BURST_SECONDS = float(os.getenv("WABOT_RATE_BURST_SECONDS", "2") or 2)
+
+
+@dataclass(frozen=True)
+class Bucket:
+    key: str
+    rate_per_min: float
+    burst: float = 0.0
+
+    @property
+    def rate(self):
+        """Tokens per second."""
+        return self.rate_per_min / 60.0
+
+    @property
+    def capacity(self):
+        return max(1.0, self.burst or self.rate * BURST_SECONDS)
+
+
+def _refill(bucket, tokens, updated_at, now):
+    return min(bucket.capacity, tokens + max(0.0, now - updated_at) * bucket.rate)
+
+
+def _grant(buckets, levels, n):
+    """Tokens grantable from every bucket at once, and the wait for one more if none."""
+    granted = min(n, min(int(math.floor(level)) for level in levels))
+    if granted > 0:
+        return granted, 0.0
+    wait = max((1.0 - level) / b.rate for b, level in zip(buckets, levels) if level < 1.0)
+    return 0, wait
+
+
+# =============================================================================
+# STORES
+# =============================================================================
+
+class LocalRateLimitStore:
+    """Per-process buckets (tests / single-process runs)."""
+
+    def __init__(self, start_full=True):
+        self.start_full = start_full
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets, n, now):
+        with self._lock:
+            levels = [
+                _refill(b, *self._state.get(b.key, (b.capacity if self.start_full else 0.0, now)), now)
+                for b in buckets
+            ]
+            granted, wait = _grant(buckets, levels, n)
+            for b, level in zip(buckets, levels):
+                self._state[b.key] = (level - granted, now)
+            return granted, wait
+
+
+class DatabaseRateLimitStore:
+    """SendRateBucket rows shared by every process; rows are locked in key order."""
+
+    def take(self, buckets, n, now):
+        from .models import SendRateBucket
+
+        keys = sorted(b.key for b in buckets)
+        with transaction.atomic():
+            rows = {r.key: r for r in SendRateBucket.objects.select_for_update().filter(key__in=keys).order_by("key")}
+            missing = [b for b in buckets if b.key not in rows]
+            if missing:
+                SendRateBucket.objects.bulk_create(
+                    [SendRateBucket(key=b.key, tokens=b.capacity, updated_at=now) for b in missing],
+                    ignore_conflicts=True,
+                )
+                rows = {r.key: r for r in SendRateBucket.objects.select_for_update().filter(key__in=keys).order_by("key")}
+            levels = [_refill(b, rows[b.key].tokens, rows[b.key].updated_at, now) for b in buckets]
+            granted, wait = _grant(buckets, levels, n)
+            for b, level in zip(buckets, levels):
+                rows[b.key].tokens = level - granted
+                rows[b.key].updated_at = now
+            SendRateBucket.objects.bulk_update(list(rows.values()), ["tokens", "updated_at"])
+            return granted, wait
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = os.getenv("WABOT_RATE_LIMIT_BACKEND", "db").lower()
+                _store = LocalRateLimitStore() if backend == "local" else DatabaseRateLimitStore()
+    return _store
+
+
+def set_store(store):
+    """Swap the bucket store (tests/benchmarks)."""
+    global _store
+    _store = store
+
+
+# =============================================================================
+# LIMITER
+# =============================================================================
+
+class RateLimiter:
+    """Takes tokens from all of `buckets` together."""
+
+    def __init__(self, buckets, store=None):
+        self.buckets = [b for b in buckets if b.rate_per_min > 0]
+        self.store = store
+        self.waited = 0.0
+
+    def try_acquire(self, n=1):
+        """(granted, wait_seconds): up to `n` tokens now, else how long until one is free."""
+        if not self.buckets or n <= 0:
+            return n, 0.0
+        store = self.store or get_store()
+        try:
+            return store.take(self.buckets, n, time.time())
+        except Exception as e:
+            # Never stall a blast on a broken store; fall back to this process's buckets,
+            # starting empty so the fallback does not hand out a second burst.
+            logger.warning("Rate limit store unavailable, limiting per process: %s", e)
+            self.store = LocalRateLimitStore(start_full=False)
+            return self.store.take(self.buckets, n, time.time())
+
+    def acquire(self, n=1, timeout=None):
+        """
+        Block until at least one token is granted (or `timeout` seconds pass, then 0).
+        Returns the number of tokens granted, at most `n`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            granted, wait = self.try_acquire(n)
+            if granted:
+                return granted
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return 0
+                wait = min(wait, left)
+            self.waited += wait
+            time.sleep(wait)
+
+
+def connection_buckets(connection_id, tenant_id=None):
+    """Buckets every send on a WhatsApp connection draws from."""
+    buckets = [Bucket(f"conn:{connection_id}", CONNECTION_RATE_PER_MIN)]
+    if TENANT_RATE_PER_MIN > 0 and tenant_id:
+        buckets.append(Bucket(f"tenant:{tenant_id}", TENANT_RATE_PER_MIN))
+    return buckets
+
+
+def limiter_for_connection(connection_id, tenant_id=None):
+    return RateLimiter(connection_buckets(connection_id, tenant_id))
+
+
+def limiter_for_blast(campaign):
+    """Limiter for a BlastCampaign: its connection, tenant and own throttle."""
+    buckets = connection_buckets(campaign.whatsapp_connection_id, campaign.tenant_id)
+    if campaign.throttle_per_min:
+        buckets.append(Bucket(f"blast:{campaign.blast_id}", float(campaign.throttle_per_min)))
+    return RateLimiter(buckets)
@@ -8,6 +8,7 @@ from typing import Optional, Dict, Any, List, Tuple
 from decimal import Decimal
 import tempfile
 import requests
+from . import media_cache
 from .deepseek_ocr_wrapper import DeepSeekOCRWrapper
 
 logger = logging.getLogger(__name__)
@@ -85,11 +86,12 @@ class ReceiptOCRService:
             # Format WhatsApp message
             result['formatted_message'] = self._format_receipt_message(result)
             
-            # Cleanup temp file
-            try:
-                image_path.unlink()
-            except Exception:
-                pass
+            # Cleanup temp file (cached media stays for retries / re-OCR)
+            if not media_cache.is_cached_file(image_path):
+                try:
+                    image_path.unlink()
+                except Exception:
+                    pass
             
             return result
             
@@ -107,6 +109,15 @@ class ReceiptOCRService:
             # If it's already a local path, return it
             if Path(image_url).exists():
                 return Path(image_url)
+
+            # Prefetched (and decrypted) by the webhook as soon as the message arrived
+            cached = media_cache.lookup(media_meta)
+            if cached is not None:
+                with open(cached, 'rb') as fh:
+                    head = fh.read(12)
+                if media_cache.looks_like_image(head):
+                    logger.info(f"Receipt image from media cache: {cached.name[:12]}")
+                    return cached
             
             # Download from URL
             logger.info(f"Downloading receipt image: {image_url[:120]}")
@@ -167,6 +178,11 @@ class ReceiptOCRService:
                     )
                 raise ValueError("The downloaded file is not a valid image. Please resend a clear receipt photo.")
             
+            # Keep the plaintext in the media cache (keyed by fileSha256) when we can
+            cached = media_cache.store(media_meta, content)
+            if cached is not None:
+                return cached
+
             # Save to temp file
             temp_dir = Path(tempfile.gettempdir()) / 'receipt_ocr'
             temp_dir.mkdir(exist_ok=True)
@@ -1,11 +1,13 @@
 import logging
 
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
-from .models import ContestEntry
-from .whatsapp_service import WhatsAppAPIService
+from .models import ContestEntry, Customer, Tenant, WhatsAppConnection
+from .connection_routing import invalidate_routing_cache
+from .customer_resolver import evict_contact
+from .outbox import enqueue_message
 
 logger = logging.getLogger(__name__)
 
@@ -61,8 +63,6 @@ def _contest_entry_notify_customer_on_review_completion(sender, instance: Contes
                 logger.info(f"Skipping signal notification for auto-OCR entry {instance.entry_id} (receipt-first flow)")
                 return
 
-        wa = WhatsAppAPIService()
-
         if new_status == "verified":
             msg = (
                 "✅ Update: Your receipt submission has been **approved** after manual review.\n\n"
@@ -87,20 +87,36 @@ def _contest_entry_notify_customer_on_review_completion(sender, instance: Contes
                 "Our team will contact you with next steps."
             )
 
-        result = wa.send_text_message(instance.customer.phone_number, msg)
-        if result.get("success"):
-            # Mark as notified (use update_fields to reduce churn)
-            instance.last_customer_notification_status = new_status
-            instance.last_customer_notification_at = timezone.now()
-            instance.save(update_fields=["last_customer_notification_status", "last_customer_notification_at"])
-            logger.info("Notified customer %s for ContestEntry %s status=%s", instance.customer.phone_number, instance.entry_id, new_status)
-        else:
-            logger.warning("Failed to notify customer %s for ContestEntry %s status=%s error=%s",
-                           instance.customer.phone_number, instance.entry_id, new_status, result.get("error"))
+        # Queued with the entry's save; one notification per (entry, status) even if saved twice
+        enqueue_message(
+            instance.tenant, instance.customer.phone_number, msg,
+            idempotency_key=f"entry-notify:{instance.entry_id}:{new_status}",
+        )
+        # Mark as notified (use update_fields to reduce churn)
+        instance.last_customer_notification_status = new_status
+        instance.last_customer_notification_at = timezone.now()
+        instance.save(update_fields=["last_customer_notification_status", "last_customer_notification_at"])
+        logger.info("Queued notification to %s for ContestEntry %s status=%s", instance.customer.phone_number, instance.entry_id, new_status)
 
     except Exception as e:
         logger.error("ContestEntry notification signal error: %s", str(e), exc_info=True)
 
 
+@receiver(post_save, sender=WhatsAppConnection)
+@receiver(post_delete, sender=WhatsAppConnection)
+@receiver(post_save, sender=Tenant)
+@receiver(post_delete, sender=Tenant)
+def _invalidate_connection_routing(sender, instance, **kwargs):
+    """
+    Drop the cached instance_id -> (tenant, connection) routing table in this process.
+    """
+    invalidate_routing_cache()
 
 
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def _evict_cached_contact(sender, instance, **kwargs):
+    """
+    Drop the cached phone -> customer/conversation entry so display fields stay fresh.
+    """
+    evict_contact(instance.tenant_id, instance.phone_number)
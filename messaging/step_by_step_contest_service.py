@@ -15,8 +15,11 @@ from django.utils import timezone
 from django.db import transaction
 from django.core.cache import cache
 import re
-from .models import Contest, ContestEntry, Customer, Tenant, Conversation, WhatsAppConnection, ContestFlowState
+from .models import Contest, ContestEntry, Customer, Tenant, Conversation, ContestFlowState
 from .whatsapp_service import WhatsAppAPIService
+from .connection_routing import get_tenant_connection
+from .customer_resolver import record_outbound
+from .outbox import enqueue_message
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +87,7 @@ class StepByStepContestService:
                     results['flows_created'] += 1
                 elif result.get('action') == 'advanced':
                     results['flows_advanced'] += 1
-                logger.info(f"Step-by-step contest processing (resume) completed: {results}")
+                logger.info("Step-by-step contest processing (resume) completed: %s", results)
                 return results
 
             # 2) No in-progress flow -> start only the first matching contest
@@ -92,7 +95,7 @@ class StepByStepContestService:
             results['contests_checked'] = len(active_contests)
 
             if not active_contests:
-                logger.info(f"No active contests found for tenant {tenant.name}")
+                logger.info("No active contests found for tenant %s", tenant.name)
                 return results
 
             # Receipt-first: if user sends an image first, start the contest without requiring keywords.
@@ -173,7 +176,7 @@ class StepByStepContestService:
             elif result.get('action') == 'advanced':
                 results['flows_advanced'] += 1
 
-            logger.info(f"Step-by-step contest processing (new match) completed: {results}")
+            logger.info("Step-by-step contest processing (new match) completed: %s", results)
             return results
 
         except Exception as e:
@@ -214,7 +217,7 @@ class StepByStepContestService:
             )
             
             if created:
-                logger.info(f"Created new flow state for {customer.name} in contest {contest.name}")
+                logger.info("Created new flow state for %s in contest %s", customer.name, contest.name)
                 # Receipt-first: if the first message is a receipt image OR keyword/text, handle it immediately.
                 if (media_type == "image" and media_url) or contest.matches_message(message_text) or (message_text or "").strip():
                     # NOTE: use locals().get(...) so this code is resilient even if an older
@@ -951,44 +954,34 @@ class StepByStepContestService:
             return None
     
     def _send_message_to_customer(self, tenant, customer, message_text, contest=None, conversation=None):
-        """Send text message to customer"""
+        """Queue text message to customer (sent by the outbox dispatcher, in order)"""
         try:
-            result = self.wa_service.send_text_message(customer.phone_number, message_text)
-            
-            if result['success']:
-                # Create message record
-                self._create_message_record(tenant, customer, message_text, 'outbound', 'sent', contest=contest, conversation=conversation)
-                logger.info(f"Sent message to {customer.name}")
-            else:
-                logger.error(f"Failed to send message to {customer.name}: {result.get('error', 'Unknown error')}")
+            self._create_message_record(tenant, customer, message_text, 'outbound', 'queued', contest=contest, conversation=conversation,
+                                        send={'number': customer.phone_number, 'message': message_text})
+            logger.debug("Queued message to %s", customer.name)
                 
         except Exception as e:
             logger.error(f"Error sending message to customer: {str(e)}")
     
     def _send_media_message(self, customer, tenant, media_url, caption="", contest=None, conversation=None):
-        """Send media message to customer"""
+        """Queue media message to customer (sent by the outbox dispatcher, in order)"""
         try:
-            result = self.wa_service.send_media_message(customer.phone_number, caption, media_url)
-            
-            if result['success']:
-                # Create message record
-                self._create_message_record(tenant, customer, f"{caption} [Media]", 'outbound', 'sent', contest=contest, conversation=conversation)
-                logger.info(f"Sent media message to {customer.name}")
-            else:
-                logger.error(f"Failed to send media to {customer.name}: {result.get('error', 'Unknown error')}")
+            self._create_message_record(tenant, customer, f"{caption} [Media]", 'outbound', 'queued', contest=contest, conversation=conversation,
+                                        send={'number': customer.phone_number, 'message': caption, 'media_url': media_url})
+            logger.debug("Queued media message to %s", customer.name)
                 
         except Exception as e:
             logger.error(f"Error sending media message: {str(e)}")
     
-    def _create_message_record(self, tenant, customer, message_text, direction, status, contest=None, conversation=None):
-        """Create message record in database"""
+    def _create_message_record(self, tenant, customer, message_text, direction, status, contest=None, conversation=None, send=None):
+        """Create message record in database (`send`: outbox request; the record is then queued for sending)"""
         try:
             # Prefer provided conversation
             conv = conversation
 
             # Otherwise, get or create conversation
             if conv is None:
-                conn = WhatsAppConnection.objects.filter(tenant=tenant).first()
+                conn = get_tenant_connection(tenant)
                 if conn:
                     conv, _ = Conversation.objects.get_or_create(
                         tenant=tenant,
@@ -1006,15 +999,22 @@ class StepByStepContestService:
                     pass
             
             # Create message record
-            from .models import CoreMessage
-            CoreMessage.objects.create(
-                tenant=tenant,
-                conversation=conv,
-                direction=direction,
-                status=status,
-                text_body=message_text,
-                created_at=timezone.now()
-            )
+            if send is not None:
+                enqueue_message(tenant, conversation=conv, text_body=message_text, **send)
+            else:
+                from .models import CoreMessage
+                CoreMessage.objects.create(
+                    tenant=tenant,
+                    conversation=conv,
+                    direction=direction,
+                    status=status,
+                    text_body=message_text,
+                    created_at=timezone.now()
+                )
+                if direction == 'outbound' and customer is not None:
+                    # Sent elsewhere; mark it so the webhook can spot the WABot echo
+                    # (enqueue_message does this for outbox sends)
+                    record_outbound(tenant.pk, customer.phone_number, message_text)
             
         except Exception as e:
             logger.error(f"Error creating message record: {str(e)}")
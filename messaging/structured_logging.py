@@ -0,0 +1,119 @@
+"""
+Structured (JSON) logging for the webhook and contest hot paths.
+
+- `log_event(logger, level, event, **fields)` emits one JSON line per event. It
+  returns immediately when the level is disabled, and field values may be
+  zero-argument callables that are only evaluated when the line is written.
+- `sample=` drops a fraction of noisy diagnostics (e.g. payload shapes) before any
+  formatting work happens.
+- `AsyncJsonHandler` puts records on an in-memory queue; a single listener thread
+  formats and writes them, so log I/O never blocks request/worker threads.
+
+Enabled through LOGGING in settings_production.py. Levels:
+    WABOT_WEBHOOK_LOG_LEVEL   level of the webhook/contest loggers (default INFO;
+                              DEBUG turns on the per-request diagnostics)
+    WABOT_LOG_SAMPLE_RATE     fraction of sampled diagnostics kept (default 0.01)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+DEFAULT_SAMPLE_RATE = float(os.getenv("WABOT_LOG_SAMPLE_RATE", "0.01"))
+
+# Attributes every LogRecord has; anything else was passed through `extra=`.
+_RESERVED = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def log_event(logger, level, event, sample=None, exc_info=None, **fields):
+    """
+    Log a structured event. Cheap when `level` is disabled: nothing is formatted.
+
+    `sample` (0..1) keeps only that fraction of events; pass True for the default
+    WABOT_LOG_SAMPLE_RATE. Callable field values are resolved lazily by the formatter.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample is not None:
+        rate = DEFAULT_SAMPLE_RATE if sample is True else float(sample)
+        if rate < 1.0 and random.random() >= rate:
+            return
+    if exc_info is True:
+        exc_info = sys.exc_info()
+    # makeRecord + handle instead of logger.log(): skips the caller stack walk, which
+    # is most of the cost of an enabled log call on the request thread.
+    record = logger.makeRecord(logger.name, level, "(structured)", 0, event, None, exc_info or None,
+                               extra={"fields": fields})
+    logger.handle(record)
+
+
+def _resolve(value):
+    if callable(value):
+        try:
+            value = value()
+        except Exception as e:
+            value = f"<error: {e}>"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event/message, fields."""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            for key, value in fields.items():
+                data[key] = _resolve(value)
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key != "fields" and key not in data:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class AsyncJsonHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler whose listener writes JSON lines to stderr (or `stream`).
+
+    Unlike the stdlib QueueHandler, `prepare` does not format the message on the
+    calling thread; the record is handed over as-is and formatted by the listener.
+    Callers must therefore only pass values that are safe to read later
+    (immutable data or callables over immutable data).
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JsonFormatter())
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request thread on logging; count and drop instead.
+            self.dropped += 1
+
+    def close(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+        super().close()
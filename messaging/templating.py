@@ -0,0 +1,138 @@
+"""
+Per-recipient message templating for blasts and scheduled campaign messages.
+
+A message body may contain placeholders: `{{name}}`, or `{{name|there}}` with a
+fallback used when the recipient has no value. A body is parsed once
+(`compile_template`, cached by text) into a render plan: its literal text with
+numbered slots for the placeholders, so rendering a recipient is a single
+`str.format` call and rendering a batch (`render_many`) is one list comprehension.
+Rendering never queries: values come from a dict per recipient, built from the
+already-fetched Customer row (`customer_context`) plus that recipient's
+`GroupMember.custom_data` (the extra columns of a group import), which the caller
+fetches once per batch.
+
+Bodies are checked when a campaign is created (`validate_template`): a placeholder
+that is neither a customer field nor a custom column of the targeted groups, and
+has no fallback, is rejected rather than sent as an empty string. Text without
+`{{ }}` renders as-is, so single braces and existing messages are unaffected.
+"""
+import logging
+import re
+from functools import lru_cache
+
+from .models import GroupMember
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\|([^{}]*))?\}\}")
+# Anything that looks like a placeholder, valid or not (for validation)
+BRACES_RE = re.compile(r"\{\{.*?\}\}", re.S)
+CUSTOMER_FIELDS = ('name', 'first_name', 'phone_number', 'gender', 'age', 'city', 'state', 'store_name')
+# Members per group inspected for custom column names
+CUSTOM_FIELD_SAMPLE = 200
+
+
+class TemplateError(ValueError):
+    """A message body with placeholders that cannot be rendered."""
+
+
+def _escape(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _text(value, default):
+    if value is None or value == "":
+        return default
+    return value if isinstance(value, str) else str(value)
+
+
+class CompiledTemplate:
+    """A message body parsed into literal text with numbered slots for its placeholders."""
+
+    __slots__ = ("source", "fields", "invalid", "_slots", "_format")
+
+    def __init__(self, source):
+        self.source = source or ""
+        pieces, slots, pos = [], [], 0
+        for match in PLACEHOLDER_RE.finditer(self.source):
+            pieces.append(_escape(self.source[pos:match.start()]))
+            pieces.append("{%d}" % len(slots))
+            slots.append((match.group(1).lower(), (match.group(2) or "").strip()))
+            pos = match.end()
+        pieces.append(_escape(self.source[pos:]))
+        self._slots = tuple(slots)
+        self._format = "".join(pieces).format if slots else None
+        self.fields = tuple(dict.fromkeys(field for field, _ in slots))
+        self.invalid = tuple(
+            m.group(0) for m in BRACES_RE.finditer(self.source) if not PLACEHOLDER_RE.fullmatch(m.group(0))
+        )
+
+    def render(self, context):
+        if self._format is None:
+            return self.source
+        return self._format(*[_text(context.get(field), default) for field, default in self._slots])
+
+    def render_many(self, contexts):
+        """Render one message per context, in order."""
+        if self._format is None:
+            return [self.source] * len(contexts)
+        fmt, slots = self._format, self._slots
+        return [fmt(*[_text(context.get(field), default) for field, default in slots]) for context in contexts]
+
+    def unknown_fields(self, known):
+        """Placeholders without a fallback that are not in `known`."""
+        with_default = {field for field, default in self._slots if default}
+        return [field for field in self.fields if field not in known and field not in with_default]
+
+
+@lru_cache(maxsize=512)
+def compile_template(source):
+    return CompiledTemplate(source)
+
+
+def customer_context(customer, custom_data=None):
+    """Placeholder values for one recipient: its customer fields over its custom columns."""
+    context = {str(key).lower(): value for key, value in (custom_data or {}).items()}
+    for field in CUSTOMER_FIELDS:
+        if field == 'first_name':
+            context[field] = (customer.name or "").split(" ", 1)[0]
+        else:
+            context[field] = getattr(customer, field, None)
+    return context
+
+
+def needs_custom_data(template):
+    return any(field not in CUSTOMER_FIELDS for field in template.fields)
+
+
+def group_custom_fields(group_ids):
+    """Custom column names found on members of the given groups (a sample per group)."""
+    fields = set()
+    for group_id in group_ids:
+        for data in (
+            GroupMember.objects.filter(group_id=group_id).exclude(custom_data={})
+            .values_list('custom_data', flat=True)[:CUSTOM_FIELD_SAMPLE]
+        ):
+            if isinstance(data, dict):
+                fields.update(str(key).lower() for key in data)
+    return fields
+
+
+def validate_template(source, group_ids=()):
+    """Raise TemplateError if `source` has malformed or unknown placeholders."""
+    template = compile_template(source)
+    if template.invalid:
+        raise TemplateError(
+            f"Invalid placeholder {template.invalid[0]}: use letters, digits and underscores, e.g. {{{{first_name}}}}"
+        )
+    if not template.fields:
+        return template
+    known = set(CUSTOMER_FIELDS)
+    if needs_custom_data(template):
+        known |= group_custom_fields(group_ids)
+    unknown = template.unknown_fields(known)
+    if unknown:
+        names = ", ".join(f"{{{{{field}}}}}" for field in unknown)
+        available = ", ".join(f"{{{{{field}}}}}" for field in sorted(known))
+        raise TemplateError(f"Unknown placeholder {names}. Available: {available}")
+    return template
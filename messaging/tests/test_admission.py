@@ -0,0 +1,64 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from .. import idempotency
+from ..admission import ADMIT, DEFER, DROP, AdmissionController
+from ..idempotency import DatabaseIdempotencyStore
+from ..models import WebhookInboxEvent
+
+
+def message_event(msg_id):
+    return {"type": "messages.upsert", "instance_id": "INSTANCE", "data": {"key": {"id": msg_id}}}
+
+
+STATUS_EVENT = {"type": "messages.update", "instance_id": "INSTANCE", "data": {"key": {"id": "MSG-1"}}}
+
+
+class AdmissionControllerTest(TestCase):
+    def setUp(self):
+        idempotency.set_store(DatabaseIdempotencyStore())
+        self.addCleanup(idempotency.set_store, None)
+
+    def busy(self, max_inflight=2):
+        controller = AdmissionController(max_inflight=max_inflight, max_inbox_depth=0)
+        controller.in_flight = max_inflight
+        return controller
+
+    def test_healthy_webhook_admits_everything(self):
+        controller = AdmissionController(max_inflight=2, max_inbox_depth=10)
+        self.assertEqual(controller.decide(STATUS_EVENT), (ADMIT, None))
+        self.assertEqual(controller.decide(message_event("MSG-1")), (ADMIT, None))
+
+    def test_overloaded_webhook_defers_messages_and_drops_status_events(self):
+        controller = self.busy()
+        self.assertEqual(controller.decide(message_event("MSG-1")), (DEFER, "inflight"))
+        self.assertEqual(controller.decide(STATUS_EVENT), (DROP, "inflight"))
+
+    def test_retries_of_a_deferred_message_are_coalesced(self):
+        controller = self.busy()
+        self.assertEqual(controller.decide(message_event("MSG-1"))[0], DEFER)
+        self.assertEqual(controller.decide(message_event("MSG-1"))[0], DROP)
+        self.assertEqual(controller.decide(message_event("MSG-2"))[0], DEFER)
+
+    def test_track_counts_in_flight_payloads(self):
+        controller = AdmissionController(max_inflight=1, max_inbox_depth=0)
+        with self.assertRaises(RuntimeError), controller.track():
+            self.assertEqual(controller.overload_reason(), "inflight")
+            raise RuntimeError("handler crashed")
+        self.assertEqual(controller.in_flight, 0)
+        self.assertIsNone(controller.overload_reason())
+
+    def test_deep_inbox_defers_and_depth_is_counted_once_per_refresh(self):
+        WebhookInboxEvent.objects.bulk_create([WebhookInboxEvent(raw_body="{}", status="pending") for _ in range(3)])
+        controller = AdmissionController(max_inflight=0, max_inbox_depth=3, depth_refresh_seconds=60)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(controller.overload_reason(), "inbox_depth")
+            self.assertEqual(controller.overload_reason(), "inbox_depth")
+
+    def test_errors_admit_the_request(self):
+        controller = self.busy()
+        with mock.patch("messaging.webhook_events.peek_webhook", side_effect=ValueError("bad body")), \
+                self.assertLogs("messaging.admission", "WARNING"):
+            self.assertEqual(controller.decide(message_event("MSG-1")), (ADMIT, None))
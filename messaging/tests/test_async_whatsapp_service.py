@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import uuid
+
+import httpx
+from django.test import SimpleTestCase
+
+from ..async_whatsapp_service import AsyncWhatsAppAPIService, SendJob
+from ..circuit_breaker import CircuitBreaker
+from ..whatsapp_service import WhatsAppAPIService
+
+
+class FakeSender(AsyncWhatsAppAPIService):
+    """Sends nothing: `_post` sleeps `latency(job)` seconds and records what was in flight."""
+
+    def __init__(self, latency=0.01, status_code=None, **kwargs):
+        sync_service = WhatsAppAPIService()
+        # Own instance id, so the shared breaker registry starts clean
+        sync_service.set_instance_id(uuid.uuid4().hex)
+        super().__init__(sync_service=sync_service, **kwargs)
+        self.latency = latency if callable(latency) else (lambda job: latency)
+        self.status_code = status_code
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.posted = []
+
+    async def _post(self, job):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency(job))
+            self.posted.append(job.key)
+            if self.status_code:
+                request = httpx.Request("POST", f"{self.base_url}/send")
+                httpx.Response(self.status_code, request=request).raise_for_status()
+            return {"status": "success", "number": job.number}
+        finally:
+            self.in_flight -= 1
+
+
+def jobs(n):
+    return [SendJob(i, f"6012{i:07d}", "hi") for i in range(n)]
+
+
+class AsyncSenderTest(SimpleTestCase):
+    def test_concurrency_is_bounded(self):
+        sender = FakeSender(concurrency=4)
+
+        results = sender.send_all(jobs(20))
+
+        self.assertEqual(sorted(r.key for r in results), list(range(20)))
+        self.assertTrue(all(r.success for r in results))
+        self.assertEqual(sender.max_in_flight, 4)
+
+    def test_results_come_back_on_the_calling_thread_as_they_complete(self):
+        sender = FakeSender(latency=lambda job: 0.2 if job.key == 0 else 0.01, concurrency=4)
+        caller = threading.get_ident()
+        threads, keys = set(), []
+
+        for result in sender.send_iter(jobs(3)):
+            threads.add(threading.get_ident())
+            keys.append(result.key)
+
+        self.assertEqual(threads, {caller})
+        self.assertEqual(keys[-1], 0)
+
+    def test_deadline_fails_a_slow_send(self):
+        sender = FakeSender(latency=1.0, deadline=0.05)
+
+        [result] = sender.send_all(jobs(1))
+
+        self.assertFalse(result.success)
+        self.assertIn("deadline exceeded", result.error)
+
+    def test_client_errors_do_not_open_the_breaker(self):
+        sender = FakeSender(status_code=400, concurrency=1)
+        sender.breaker = CircuitBreaker("test", failure_threshold=2)
+
+        results = sender.send_all(jobs(5))
+
+        self.assertEqual(len(sender.posted), 5)
+        self.assertEqual([r.extra["status_code"] for r in results], [400] * 5)
+
+    def test_jobs_the_open_breaker_holds_back_come_back_unsent(self):
+        sender = FakeSender(status_code=503, concurrency=1, max_wait=0)
+        sender.breaker = CircuitBreaker("test", failure_threshold=2, base_backoff=60)
+
+        results = sender.send_all(jobs(5))
+
+        self.assertEqual(sender.posted, [0, 1])
+        self.assertEqual([r.key for r in results if r.extra.get("circuit_open")], [2, 3, 4])
+        self.assertFalse(any(r.success for r in results))
@@ -0,0 +1,91 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from .. import blast_progress
+from ..blast_progress import (
+    RETRY_AFTER_SECONDS, campaign_progress, progress_payload, progress_snapshot, progress_version, wait_for_progress,
+)
+from ..models import BlastCampaign, BlastRecipient, Customer, Tenant, WhatsAppConnection
+
+
+class BlastProgressTest(TestCase):
+    def setUp(self):
+        blast_progress._snapshots.clear()
+        blast_progress._versions.clear()
+        tenant = Tenant.objects.create(name="Test Tenant", plan="pro")
+        conn = WhatsAppConnection.objects.create(
+            tenant=tenant, phone_number="60100000000", access_token_ref="ref", instance_id="instance",
+        )
+        self.campaign = BlastCampaign.objects.create(
+            tenant=tenant, whatsapp_connection=conn, name="Blast", message_text="Hi", status="sending",
+            total_recipients=10, sent_count=4, delivered_count=4, failed_count=1, queued_count=2,
+        )
+        customers = Customer.objects.bulk_create([
+            Customer(tenant=tenant, name=f"Customer {i}", phone_number=f"6012{i:07d}") for i in range(3)
+        ])
+        BlastRecipient.objects.bulk_create([
+            BlastRecipient(tenant=tenant, blast_campaign=self.campaign, customer=c, status=status)
+            for c, status in zip(customers, ["sent", "pending", "pending"])
+        ])
+
+    def test_counts_come_from_the_campaign_row(self):
+        with self.assertNumQueries(0):
+            counts = progress_snapshot(self.campaign)["status_counts"]
+        self.assertEqual((counts["pending"], counts["queued"], counts["sent"], counts["failed"]), (3, 2, 4, 1))
+
+    def test_counters_that_do_not_add_up_fall_back_to_recipients(self):
+        self.campaign.queued_count = 20
+
+        with self.assertNumQueries(1):
+            counts = progress_snapshot(self.campaign)["status_counts"]
+        self.assertEqual((counts["pending"], counts["sent"]), (2, 1))
+
+    def test_snapshot_is_shared_between_callers(self):
+        with self.assertNumQueries(1):
+            first = campaign_progress(self.campaign.blast_id)
+            again = campaign_progress(self.campaign.blast_id)
+        self.assertEqual(first, again)
+        self.assertEqual(first[0], self.campaign.tenant_id)
+
+    def test_wait_without_version_answers_at_once(self):
+        _, progress, retry_after = wait_for_progress(self.campaign.blast_id, timeout=60)
+        self.assertEqual((progress["sent_count"], retry_after), (4, 0))
+
+    def test_wait_returns_when_progress_changes(self):
+        before = campaign_progress(self.campaign.blast_id)
+        after = (before[0], {**before[1], "sent_count": 5})
+        with mock.patch.object(blast_progress, "WAIT_INTERVAL", 0), \
+                mock.patch.object(blast_progress, "campaign_progress", side_effect=[before, before, after]):
+            _, progress, _ = wait_for_progress(self.campaign.blast_id, progress_version(before[1]), timeout=60)
+        self.assertEqual(progress["sent_count"], 5)
+
+    def test_wait_gives_up_after_timeout(self):
+        version = progress_version(campaign_progress(self.campaign.blast_id)[1])
+        with mock.patch.object(blast_progress, "WAIT_INTERVAL", 0):
+            _, progress, retry_after = wait_for_progress(self.campaign.blast_id, version, timeout=0.05)
+        self.assertEqual((progress_version(progress), retry_after), (version, 0))
+
+    def test_busy_process_tells_the_client_to_come_back(self):
+        with mock.patch.object(blast_progress, "_waiters", mock.Mock(**{"acquire.return_value": False})):
+            _, _, retry_after = wait_for_progress(self.campaign.blast_id, "stale", timeout=60)
+        self.assertEqual(retry_after, RETRY_AFTER_SECONDS)
+
+    def test_payload_has_only_changes_for_a_known_version(self):
+        progress = campaign_progress(self.campaign.blast_id)[1]
+        first = progress_payload(progress)
+        self.assertEqual(first["sent_count"], 4)
+        self.assertNotIn("changes", first)
+
+        later = {**progress, "sent_count": 5, "status_counts": {**progress["status_counts"], "sent": 5}}
+        delta = progress_payload(later, since=first["version"])
+
+        self.assertEqual(delta, {
+            "version": progress_version(later),
+            "changes": {"sent_count": 5, "status_counts": later["status_counts"]},
+        })
+        self.assertEqual(progress_payload(later, since=delta["version"])["changes"], {})
+
+    def test_unknown_version_gets_the_full_payload(self):
+        progress = campaign_progress(self.campaign.blast_id)[1]
+        self.assertEqual(progress_payload(progress, since="from-another-process")["sent_count"], 4)
@@ -0,0 +1,116 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ..async_whatsapp_service import SendResult
+from ..blast_tasks import (
+    UNKNOWN_OUTCOME, _flush_results, _hold_window, _queue_messages, claim_recipients,
+    recover_expired_leases, send_blast_campaign_task,
+)
+from ..models import BlastCampaign, BlastRecipient, Customer, Tenant, WhatsAppConnection
+
+
+class BlastLeaseTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Test Tenant", plan="pro")
+        conn = WhatsAppConnection.objects.create(
+            tenant=self.tenant, phone_number="60100000000", access_token_ref="ref", instance_id="instance",
+        )
+        customers = Customer.objects.bulk_create([
+            Customer(tenant=self.tenant, name=f"Customer {i}", phone_number=f"6012{i:07d}") for i in range(10)
+        ])
+        self.campaign = BlastCampaign.objects.create(
+            tenant=self.tenant, whatsapp_connection=conn, name="Blast", message_text="Hi {{first_name}}",
+            status="sending", total_recipients=len(customers),
+        )
+        BlastRecipient.objects.bulk_create([
+            BlastRecipient(tenant=self.tenant, blast_campaign=self.campaign, customer=c) for c in customers
+        ])
+
+    def claim(self):
+        recipients = claim_recipients(self.campaign, 10)
+        _queue_messages(self.campaign, recipients)
+        return recipients
+
+    def counters(self):
+        self.campaign.refresh_from_db()
+        return self.campaign.sent_count, self.campaign.failed_count, self.campaign.queued_count
+
+    def test_flush_writes_outcomes_and_counters(self):
+        recipients = self.claim()
+        self.assertEqual(self.counters(), (0, 0, 10))
+        for recipient in recipients[:6]:
+            recipient.status = recipient.message.status = "sent"
+        for recipient in recipients[6:8]:
+            recipient.status = recipient.message.status = "failed"
+
+        applied = _flush_results(self.campaign, recipients[:8])
+
+        self.assertEqual(applied, {"sent": 6, "failed": 2, "requeued": 0})
+        self.assertEqual(self.counters(), (6, 2, 2))
+        self.assertEqual(BlastRecipient.objects.filter(status="sent").count(), 6)
+
+    def test_flush_cost_does_not_grow_with_the_batch(self):
+        recipients = self.claim()
+        for recipient in recipients:
+            recipient.status = recipient.message.status = "sent"
+
+        with CaptureQueriesContext(connection) as small:
+            _flush_results(self.campaign, recipients[:2])
+        # A bulk UPDATE per table, whatever the batch size
+        with self.assertNumQueries(len(small.captured_queries)):
+            _flush_results(self.campaign, recipients[2:])
+
+    def test_late_flush_after_lease_expiry_writes_nothing(self):
+        recipients = self.claim()
+        # Half the chunk had been handed to WABot when the worker stalled
+        _hold_window(recipients[:5])
+        BlastRecipient.objects.filter(blast_campaign=self.campaign).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        self.assertEqual(recover_expired_leases(), (5, 5))
+        self.assertEqual(self.counters(), (0, 5, 0))
+
+        # The stalled worker comes back and reports every send as successful
+        for recipient in recipients:
+            recipient.status = recipient.message.status = "sent"
+        applied = _flush_results(self.campaign, recipients)
+
+        self.assertEqual(applied, {"sent": 0, "failed": 0, "requeued": 0})
+        self.assertEqual(self.counters(), (0, 5, 0))
+        statuses = dict(BlastRecipient.objects.values_list("recipient_id", "status"))
+        self.assertEqual(sorted(statuses.values()), ["failed"] * 5 + ["pending"] * 5)
+        self.assertEqual(
+            BlastRecipient.objects.filter(status="failed", error_message=UNKNOWN_OUTCOME).count(), 5,
+        )
+
+    def test_released_recipients_are_claimed_again(self):
+        self.claim()
+        BlastRecipient.objects.filter(blast_campaign=self.campaign).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        recover_expired_leases()
+
+        self.assertEqual(len(claim_recipients(self.campaign, 10)), 10)
+
+    def test_worker_error_keeps_the_campaign_sending(self):
+        def send_results(wa_service, campaign, window, media=None):
+            for recipient in window[:3]:
+                yield SendResult(recipient.recipient_id, True)
+            raise RuntimeError("worker crashed")
+
+        with mock.patch("messaging.blast_tasks.SEND_WINDOW", 5), \
+                mock.patch("messaging.blast_tasks._send_results", send_results):
+            result = send_blast_campaign_task(self.campaign.blast_id)
+
+        self.assertFalse(result["success"])
+        self.assertEqual(BlastCampaign.objects.get(pk=self.campaign.pk).status, "sending")
+        # Sent results are kept, the unsent window goes back, the two mid-send stay leased
+        statuses = sorted(BlastRecipient.objects.values_list("status", flat=True))
+        self.assertEqual(statuses, ["pending"] * 5 + ["queued"] * 2 + ["sent"] * 3)
+        self.assertEqual(self.counters(), (3, 0, 2))
@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone as dj_timezone
+
+from ..campaign_scheduler import STALE_SECONDS, CampaignScheduler, due_rows, recover_processing, window_open_at
+from ..models import (
+    BlastCampaign, Campaign, CampaignMessage, CampaignRecipient, CampaignRun, CampaignVariant, CoreMessage, Customer,
+    SendQueue, Segment, TemplateMessage, Tenant, WhatsAppConnection,
+)
+
+NEW_YORK = ZoneInfo("America/New_York")
+KUALA_LUMPUR = ZoneInfo("Asia/Kuala_Lumpur")
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class WindowOpenAtTest(SimpleTestCase):
+    # 09:00-17:00 New York time, Fri 30 Oct - Wed 4 Nov 2026; DST ends Sun 1 Nov
+    start = datetime(2026, 10, 30, 9, 0, tzinfo=NEW_YORK)
+    end = datetime(2026, 11, 4, 17, 0, tzinfo=NEW_YORK)
+
+    def open_at(self, when, start=None, end=None, zone="America/New_York"):
+        return window_open_at(when, start or self.start, end or self.end, zone)
+
+    def test_no_window(self):
+        when = utc(2026, 10, 31, 3, 0)
+        self.assertEqual(window_open_at(when), when)
+
+    def test_start_only(self):
+        self.assertEqual(window_open_at(utc(2026, 10, 1), start_at=self.start), self.start)
+        self.assertEqual(window_open_at(utc(2026, 12, 1), start_at=self.start), utc(2026, 12, 1))
+
+    def test_before_start_waits_for_start(self):
+        self.assertEqual(self.open_at(utc(2026, 10, 29, 12, 0)), self.start)
+
+    def test_inside_daily_hours(self):
+        when = datetime(2026, 11, 2, 12, 30, tzinfo=NEW_YORK)
+        self.assertEqual(self.open_at(when), when)
+
+    def test_after_hours_moves_to_next_morning(self):
+        result = self.open_at(datetime(2026, 10, 30, 18, 0, tzinfo=NEW_YORK))
+        self.assertEqual(result, utc(2026, 10, 31, 13, 0))
+
+    def test_next_morning_after_dst_ends(self):
+        # 09:00 local is 13:00 UTC on Saturday but 14:00 UTC on Sunday
+        result = self.open_at(datetime(2026, 10, 31, 18, 0, tzinfo=NEW_YORK))
+        self.assertEqual(result, utc(2026, 11, 1, 14, 0))
+        self.assertEqual(result.astimezone(NEW_YORK).hour, 9)
+
+    def test_next_morning_after_dst_starts(self):
+        start = datetime(2027, 3, 12, 9, 0, tzinfo=NEW_YORK)
+        end = datetime(2027, 3, 16, 17, 0, tzinfo=NEW_YORK)
+        result = self.open_at(datetime(2027, 3, 13, 18, 0, tzinfo=NEW_YORK), start, end)
+        self.assertEqual(result, utc(2027, 3, 14, 13, 0))
+        self.assertEqual(result.astimezone(NEW_YORK).hour, 9)
+
+    def test_early_morning_waits_for_opening_same_day(self):
+        result = self.open_at(datetime(2026, 11, 3, 7, 0, tzinfo=NEW_YORK))
+        self.assertEqual(result, datetime(2026, 11, 3, 9, 0, tzinfo=NEW_YORK))
+
+    def test_closed_after_last_day(self):
+        self.assertIsNone(self.open_at(datetime(2026, 11, 4, 17, 30, tzinfo=NEW_YORK)))
+        self.assertIsNone(self.open_at(self.end))
+
+    def test_hours_use_campaign_time_zone(self):
+        # 09:00-18:00 Kuala Lumpur (UTC+8), Mon 19 - Fri 23 Oct 2026
+        start = datetime(2026, 10, 19, 9, 0, tzinfo=KUALA_LUMPUR)
+        end = datetime(2026, 10, 23, 18, 0, tzinfo=KUALA_LUMPUR)
+        # 11:00 UTC is 19:00 in Kuala Lumpur: after hours there
+        result = self.open_at(utc(2026, 10, 20, 11, 0), start, end, "Asia/Kuala_Lumpur")
+        self.assertEqual(result, utc(2026, 10, 21, 1, 0))
+
+    def test_overnight_window_is_one_stretch(self):
+        start = datetime(2026, 10, 30, 22, 0, tzinfo=NEW_YORK)
+        end = datetime(2026, 11, 2, 6, 0, tzinfo=NEW_YORK)
+        when = datetime(2026, 10, 31, 12, 0, tzinfo=NEW_YORK)
+        self.assertEqual(self.open_at(when, start, end), when)
+
+    def test_unknown_time_zone_falls_back_to_utc(self):
+        start, end = utc(2026, 10, 30, 9, 0), utc(2026, 11, 4, 17, 0)
+        with self.assertLogs("messaging.campaign_scheduler", "WARNING"):
+            result = self.open_at(utc(2026, 10, 31, 18, 0), start, end, "Mars/Olympus")
+        self.assertEqual(result, utc(2026, 11, 1, 9, 0))
+
+
+class SchedulerTest(TestCase):
+    def setUp(self):
+        self.now = dj_timezone.now()
+        self.tenant = Tenant.objects.create(name="Test Tenant", plan="pro")
+        self.conn = WhatsAppConnection.objects.create(
+            tenant=self.tenant, phone_number="60100000000", access_token_ref="ref", instance_id="instance",
+        )
+        self.customer = Customer.objects.create(tenant=self.tenant, name="Ali bin Abu", phone_number="60123456789")
+        segment = Segment.objects.create(tenant=self.tenant, name="All")
+        self.campaign = Campaign.objects.create(tenant=self.tenant, name="Promo", segment=segment, status="scheduled")
+        self.template = TemplateMessage.objects.create(
+            tenant=self.tenant, whatsapp_connection=self.conn, category="marketing", body="Hi {{first_name}}",
+        )
+        self.variant = CampaignVariant.objects.create(
+            tenant=self.tenant, campaign=self.campaign, name="A", split_pct=100, template=self.template,
+        )
+        self.run = CampaignRun.objects.create(tenant=self.tenant, campaign=self.campaign)
+        patcher = mock.patch("messaging.blast_tasks.wake_blast_workers")
+        self.wake = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def blast(self, seconds, status="scheduled"):
+        return BlastCampaign.objects.create(
+            tenant=self.tenant, whatsapp_connection=self.conn, name="Blast", message_text="Hi",
+            status=status, scheduled_at=self.now + timedelta(seconds=seconds),
+        )
+
+    def queue(self, seconds, status="queued"):
+        recipient = CampaignRecipient.objects.create(
+            tenant=self.tenant, run=self.run, campaign=self.campaign, variant=self.variant, customer=self.customer,
+            whatsapp_connection=self.conn,
+        )
+        message = CampaignMessage.objects.create(
+            tenant=self.tenant, recipient=recipient, campaign=self.campaign, variant=self.variant,
+            template=self.template,
+        )
+        return SendQueue.objects.create(
+            tenant=self.tenant, campaign_message=message, scheduled_at=self.now + timedelta(seconds=seconds),
+            status=status,
+        )
+
+    def status(self, obj):
+        obj.refresh_from_db()
+        return obj.status
+
+    def test_due_rows_unions_blasts_and_queued_messages(self):
+        blast = self.blast(-10)
+        queued = self.queue(-20)
+        self.blast(-30, status="draft")
+        self.queue(-40, status="sent")
+        self.blast(60)
+        self.queue(60)
+
+        rows = due_rows(self.now)
+
+        self.assertEqual([(row[0], row[1]) for row in rows], [("queue", queued.pk), ("blast", blast.pk)])
+        self.assertEqual(rows[0][3], self.campaign.pk)
+        self.assertEqual(rows[0][7], 60)
+        self.assertEqual(rows[1][3:], (None, None, None, None, None))
+
+    def test_tick_starts_due_blast_and_sends_due_message(self):
+        blast = self.blast(-1)
+        task = self.queue(-1)
+
+        counts = CampaignScheduler(horizon=0).tick()
+
+        self.assertEqual(counts, {"blasts": 1, "sent": 1, "retried": 0, "failed": 0})
+        self.assertEqual(self.status(blast), "sending")
+        self.assertEqual(self.status(task), "sent")
+        self.wake.assert_called_once()
+        message = CoreMessage.objects.get(idempotency_key=f"sendqueue:{task.pk}")
+        self.assertEqual((message.text_body, message.status), ("Hi Ali", "queued"))
+        self.assertEqual(self.status(self.campaign), "completed")
+
+    def test_blast_cancelled_after_loading_is_not_started(self):
+        blast = self.blast(5)
+        scheduler = CampaignScheduler(horizon=60)
+        self.assertEqual(scheduler.refresh(self.now), 1)
+        BlastCampaign.objects.filter(pk=blast.pk).update(status="cancelled")
+
+        counts = scheduler.fire_due(self.now + timedelta(seconds=10))
+
+        self.assertEqual(counts["blasts"], 0)
+        self.assertEqual(self.status(blast), "cancelled")
+
+    def test_blast_rescheduled_earlier_fires_at_its_new_time(self):
+        blast = self.blast(50)
+        scheduler = CampaignScheduler(horizon=60)
+        scheduler.refresh(self.now)
+        BlastCampaign.objects.filter(pk=blast.pk).update(scheduled_at=self.now + timedelta(seconds=5))
+
+        scheduler.refresh(self.now)
+
+        self.assertEqual(scheduler.next_due(), self.now + timedelta(seconds=5))
+        self.assertEqual(scheduler.fire_due(self.now + timedelta(seconds=10))["blasts"], 1)
+        self.assertEqual(self.status(blast), "sending")
+        # The replaced timer does nothing when its old time comes
+        self.assertEqual(scheduler.fire_due(self.now + timedelta(seconds=60))["blasts"], 0)
+
+    def test_message_rescheduled_later_waits_for_its_new_time(self):
+        task = self.queue(5)
+        scheduler = CampaignScheduler(horizon=60)
+        scheduler.refresh(self.now)
+        SendQueue.objects.filter(pk=task.pk).update(scheduled_at=self.now + timedelta(hours=1))
+
+        self.assertEqual(scheduler.fire_due(self.now + timedelta(seconds=10))["sent"], 0)
+        self.assertEqual(self.status(task), "queued")
+
+    def test_recover_processing_leaves_live_claims_alone(self):
+        stale = self.queue(-60, status="processing")
+        live = self.queue(-60, status="processing")
+        SendQueue.objects.filter(pk=stale.pk).update(locked_at=self.now - timedelta(seconds=STALE_SECONDS + 1))
+        SendQueue.objects.filter(pk=live.pk).update(locked_at=self.now)
+
+        self.assertEqual(recover_processing(self.now), 1)
+        self.assertEqual((self.status(stale), self.status(live)), ("queued", "processing"))
+
+    def test_process_send_queue_starts_scheduled_blasts(self):
+        blast = self.blast(-1)
+        task = self.queue(-1)
+
+        call_command("process_send_queue", stdout=mock.Mock())
+
+        self.assertEqual(self.status(blast), "sending")
+        self.assertEqual(self.status(task), "sent")
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+from collections import deque
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..async_whatsapp_service import AsyncWhatsAppAPIService, SendJob
+from ..circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, is_provider_failure
+
+
+def breaker(**kwargs):
+    kwargs.setdefault("failure_threshold", 3)
+    kwargs.setdefault("error_rate", 0.5)
+    kwargs.setdefault("window", 10)
+    kwargs.setdefault("min_calls", 4)
+    kwargs.setdefault("half_open_probes", 1)
+    return CircuitBreaker("test", **kwargs)
+
+
+def end_backoff(b):
+    b.open_until = time.monotonic() - 1
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def test_consecutive_failures_open_it(self):
+        b = breaker()
+        b.record(False)
+        b.record(False)
+        self.assertEqual(b.state, CLOSED)
+        b.record(False)
+        self.assertEqual(b.state, OPEN)
+        self.assertEqual(b.allow(5), 0)
+        self.assertGreater(b.retry_after(), 0)
+
+    def test_success_resets_the_consecutive_count(self):
+        b = breaker(error_rate=0)
+        for ok in (False, False, True, False, False):
+            b.record(ok)
+        self.assertEqual(b.state, CLOSED)
+
+    def test_error_rate_opens_it(self):
+        b = breaker(failure_threshold=0)
+        for ok in (True, False, True, False):
+            b.record(ok)
+        self.assertEqual(b.state, OPEN)
+
+    def test_error_rate_needs_min_calls(self):
+        b = breaker(failure_threshold=0)
+        b.record(False)
+        b.record(False)
+        self.assertEqual(b.state, CLOSED)
+
+    def test_half_open_lets_probes_through(self):
+        b = breaker(half_open_probes=2)
+        for _ in range(3):
+            b.record(False)
+        end_backoff(b)
+
+        self.assertTrue(b.available())
+        self.assertEqual(b.allow(5), 2)
+        self.assertEqual(b.state, HALF_OPEN)
+        self.assertEqual(b.allow(5), 0)
+        self.assertFalse(b.available())
+
+    def test_successful_probe_closes_it(self):
+        b = breaker()
+        for _ in range(3):
+            b.record(False)
+        end_backoff(b)
+        b.allow()
+        b.record(True)
+
+        self.assertEqual(b.state, CLOSED)
+        self.assertEqual(b.trips, 0)
+        self.assertEqual(b.allow(5), 5)
+
+    def test_failed_probe_reopens_with_longer_backoff(self):
+        b = breaker(base_backoff=10, max_backoff=1000)
+        for _ in range(3):
+            b.record(False)
+        end_backoff(b)
+        b.allow()
+        b.record(False)
+
+        self.assertEqual(b.state, OPEN)
+        self.assertEqual(b.trips, 2)
+        # Second trip: a jittered draw from the upper half of 2 x base
+        self.assertGreaterEqual(b.retry_after(), 9)
+
+    def test_released_probe_can_be_granted_again(self):
+        b = breaker()
+        for _ in range(3):
+            b.record(False)
+        end_backoff(b)
+        self.assertEqual(b.allow(), 1)
+        b.release(1)
+        self.assertEqual(b.allow(), 1)
+
+    def test_only_provider_trouble_counts(self):
+        self.assertTrue(is_provider_failure(None))
+        self.assertTrue(is_provider_failure(429))
+        self.assertTrue(is_provider_failure(503))
+        self.assertFalse(is_provider_failure(400))
+
+
+class AsyncSenderBreakerTest(SimpleTestCase):
+    def service(self, limiter=None):
+        service = AsyncWhatsAppAPIService(limiter=limiter)
+        service.breaker = breaker()
+        for _ in range(3):
+            service.breaker.record(False)
+        end_backoff(service.breaker)
+        return service
+
+    def start(self, service, n):
+        async def run():
+            ready, pending = deque(SendJob(i, "60123456789", "hi") for i in range(n)), set()
+            service._slots = asyncio.Semaphore(service.concurrency)
+            started = await service._start(ready, n, pending)
+            return started, await asyncio.gather(*pending)
+        return asyncio.run(run())
+
+    def test_half_open_takes_tokens_only_for_the_probe(self):
+        limiter = mock.Mock()
+        limiter.acquire.side_effect = lambda n, timeout=None: n
+        service = self.service(limiter)
+        service.send = mock.AsyncMock(return_value=None)
+
+        started, _ = self.start(service, 5)
+
+        self.assertEqual(started, 1)
+        limiter.acquire.assert_called_once_with(1)
+
+    def test_disabled_sends_leave_the_probe_free(self):
+        service = self.service()
+        with mock.patch.dict(os.environ, {"WABOT_DISABLE_SEND": "true"}):
+            started, results = self.start(service, 3)
+
+        self.assertEqual(started, 3)
+        self.assertFalse(any(result.success for result in results))
+        self.assertEqual(service.breaker.allow(), 1)
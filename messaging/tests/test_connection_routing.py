@@ -0,0 +1,51 @@
+from django.test import TestCase
+
+from ..connection_routing import get_tenant_connection, invalidate_routing_cache, resolve_instance
+from ..models import Tenant, WhatsAppConnection
+
+
+class ResolveInstanceTest(TestCase):
+    def setUp(self):
+        invalidate_routing_cache()
+        self.addCleanup(invalidate_routing_cache)
+        self.tenant = Tenant.objects.create(name="Test Tenant", plan="pro")
+        self.connection = self.connect(self.tenant, "INSTANCE-A")
+
+    def connect(self, tenant, instance_id):
+        return WhatsAppConnection.objects.create(
+            tenant=tenant, phone_number="60100000000", access_token_ref="ref", instance_id=instance_id,
+        )
+
+    def test_instance_id_lookup(self):
+        other = Tenant.objects.create(name="Other Tenant", plan="pro")
+        other_connection = self.connect(other, "INSTANCE-B")
+
+        self.assertEqual(resolve_instance("INSTANCE-A"), (self.tenant, self.connection))
+        self.assertEqual(resolve_instance(" instance-b "), (other, other_connection))
+        self.assertEqual(get_tenant_connection(other), other_connection)
+
+    def test_unknown_instance_goes_to_the_only_connection(self):
+        self.assertEqual(resolve_instance("UNKNOWN"), (self.tenant, self.connection))
+        self.assertEqual(resolve_instance(None), (self.tenant, self.connection))
+
+    def test_unknown_instance_is_rejected_with_several_connections(self):
+        self.connect(Tenant.objects.create(name="Other Tenant", plan="pro"), "INSTANCE-B")
+
+        self.assertEqual(resolve_instance("UNKNOWN"), (None, None))
+        self.assertEqual(resolve_instance(""), (None, None))
+
+    def test_saving_a_connection_reloads_the_table(self):
+        self.assertEqual(resolve_instance("INSTANCE-A"), (self.tenant, self.connection))
+
+        self.connection.instance_id = "INSTANCE-C"
+        self.connection.save()
+        self.connect(Tenant.objects.create(name="Other Tenant", plan="pro"), "INSTANCE-B")
+
+        self.assertEqual(resolve_instance("INSTANCE-C"), (self.tenant, self.connection))
+        self.assertEqual(resolve_instance("INSTANCE-A"), (None, None))
+
+    def test_no_connections(self):
+        WhatsAppConnection.objects.all().delete()
+
+        self.assertEqual(resolve_instance("INSTANCE-A"), (None, None))
+        self.assertIsNone(get_tenant_connection(self.tenant))
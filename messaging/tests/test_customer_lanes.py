@@ -0,0 +1,68 @@
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from .. import customer_lanes
+from ..customer_lanes import KeyedExecutor, run_for_customer, submit_for_customer
+
+
+class KeyedExecutorTest(SimpleTestCase):
+    def keys_on_different_lanes(self, executor):
+        first = ("tenant", "customer-0")
+        for i in range(1, 100):
+            key = ("tenant", f"customer-{i}")
+            if executor._lane_for(key) != executor._lane_for(first):
+                return first, key
+        self.fail("no two keys on different lanes")
+
+    def test_work_for_one_key_runs_in_submission_order(self):
+        executor = KeyedExecutor(lanes=4, name="test-lane")
+        order = []
+
+        def step(n):
+            # Earlier steps take longer: only queueing keeps them in order
+            time.sleep((10 - n) * 0.002)
+            order.append(n)
+
+        futures = [executor.submit(("tenant", "customer"), step, n) for n in range(10)]
+        for future in futures:
+            future.result(timeout=5)
+
+        self.assertEqual(order, list(range(10)))
+
+    def test_different_lanes_run_in_parallel(self):
+        executor = KeyedExecutor(lanes=4, name="test-lane")
+        first, second = self.keys_on_different_lanes(executor)
+        # Both calls must be running at once to get past the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        futures = [executor.submit(key, barrier.wait) for key in (first, second)]
+
+        for future in futures:
+            future.result(timeout=5)
+
+    def test_a_failure_is_returned_and_the_lane_keeps_going(self):
+        executor = KeyedExecutor(lanes=1, name="test-lane")
+
+        def fail():
+            raise ValueError("flow crashed")
+
+        failed = executor.submit("key", fail)
+        after = executor.submit("key", lambda: "next")
+
+        with self.assertRaises(ValueError):
+            failed.result(timeout=5)
+        self.assertEqual(after.result(timeout=5), "next")
+
+
+class InlineCustomerCallTest(TestCase):
+    def test_without_lanes_the_call_runs_on_the_caller_thread(self):
+        with mock.patch.object(customer_lanes, "LANE_COUNT", 0):
+            self.assertEqual(run_for_customer(uuid.uuid4(), uuid.uuid4(), threading.get_ident), threading.get_ident())
+
+            future = submit_for_customer(uuid.uuid4(), uuid.uuid4(), int, "not a number")
+            self.assertTrue(future.done())
+            self.assertIsInstance(future.exception(), ValueError)
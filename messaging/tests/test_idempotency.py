@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import idempotency
+from ..idempotency import DatabaseIdempotencyStore, FakeRedis, RedisIdempotencyStore, digest
+from ..models import WebhookIdempotencyKey
+
+
+class DatabaseClaimManyTest(TestCase):
+    def make_store(self):
+        return DatabaseIdempotencyStore()
+
+    def setUp(self):
+        self.store = self.make_store()
+        idempotency.set_store(self.store)
+
+    def tearDown(self):
+        idempotency.set_store(None)
+
+    def restart(self):
+        """A fresh process: same shared store, empty local filter."""
+        idempotency.set_store(self.store)
+
+    def test_first_claim_wins(self):
+        self.assertEqual(idempotency.claim_many(["a", "b", "a", ""]), {"a", "b"})
+        self.assertEqual(idempotency.claim_many(["a", "b", "c"]), {"c"})
+
+    def test_shared_store_dedupes_across_processes(self):
+        self.assertTrue(idempotency.claim("msg-1"))
+        self.restart()
+        self.assertFalse(idempotency.claim("msg-1"))
+
+    def test_released_key_can_be_claimed_again(self):
+        self.assertTrue(idempotency.claim("msg-1"))
+        idempotency.release("msg-1")
+        self.assertTrue(idempotency.claim("msg-1"))
+
+
+class DatabaseStoreExpiryTest(TestCase):
+    def test_expired_key_is_taken_over(self):
+        store = DatabaseIdempotencyStore()
+        key = digest("msg-1")
+        self.assertEqual(store.claim_many([key], ttl=60), {key})
+        self.assertEqual(store.claim_many([key], ttl=60), set())
+
+        WebhookIdempotencyKey.objects.filter(key=key).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(store.claim_many([key], ttl=60), {key})
+        self.assertEqual(store.purge_expired(), 0)
+
+    def test_completed_key_outlives_its_processing_lease(self):
+        idempotency.set_store(DatabaseIdempotencyStore())
+        self.addCleanup(idempotency.set_store, None)
+        self.assertTrue(idempotency.claim("msg-1", ttl=60))
+        idempotency.complete("msg-1", ttl=3600)
+
+        expires_at = WebhookIdempotencyKey.objects.get(key=digest("msg-1")).expires_at
+        self.assertGreater(expires_at, timezone.now() + timedelta(seconds=3000))
+
+
+class RedisClaimManyTest(DatabaseClaimManyTest):
+    def make_store(self):
+        return RedisIdempotencyStore(client=FakeRedis())
@@ -1,5 +1,5 @@
 from django.test import TestCase
-from .models import Contact, Message, BulkMessage
+from ..models import Contact, Message, BulkMessage
 
 class ContactModelTest(TestCase):
     def test_contact_creation(self):
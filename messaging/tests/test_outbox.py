@@ -0,0 +1,116 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ..connection_routing import invalidate_routing_cache
+from ..models import Conversation, CoreMessage, Customer, Tenant, WhatsAppConnection
+from ..outbox import STALE_SECONDS, claim_messages, drain_once, enqueue_message, fail_stale
+
+
+class OutboxClaimTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Test Tenant", plan="pro")
+
+    def claimed_ids(self):
+        return [msg.message_id for msg in claim_messages()]
+
+    def test_one_message_per_recipient_in_queue_order(self):
+        first = enqueue_message(self.tenant, "+60 12-345 6789", "first")
+        second = enqueue_message(self.tenant, "60123456789", "second")
+        other = enqueue_message(self.tenant, "60199999999", "other")
+
+        self.assertEqual(self.claimed_ids(), [first.message_id, other.message_id])
+        # The second message waits while the first is being sent
+        self.assertEqual(self.claimed_ids(), [])
+
+        CoreMessage.objects.filter(pk=first.pk).update(status="sent")
+        self.assertEqual(self.claimed_ids(), [second.message_id])
+
+    def test_requeued_message_holds_back_later_ones(self):
+        first = enqueue_message(self.tenant, "60123456789", "first")
+        enqueue_message(self.tenant, "60123456789", "second")
+        CoreMessage.objects.filter(pk=first.pk).update(
+            status="queued", available_at=timezone.now() + timedelta(minutes=5),
+        )
+
+        self.assertEqual(self.claimed_ids(), [])
+
+    def test_claim_marks_sending_and_counts_attempt(self):
+        msg = enqueue_message(self.tenant, "60123456789", "hello")
+        claim_messages()
+
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, "sending")
+        self.assertEqual(msg.attempts, 1)
+        self.assertIsNotNone(msg.locked_at)
+
+    def test_repeated_idempotency_key_returns_existing_row(self):
+        first = enqueue_message(self.tenant, "60123456789", "hello", idempotency_key="order:1")
+        again = enqueue_message(self.tenant, "60123456789", "hello", idempotency_key="order:1")
+
+        self.assertEqual(first.pk, again.pk)
+        self.assertEqual(CoreMessage.objects.filter(idempotency_key="order:1").count(), 1)
+
+    def test_stale_sending_row_is_failed_not_resent(self):
+        msg = enqueue_message(self.tenant, "60123456789", "hello")
+        claim_messages()
+        CoreMessage.objects.filter(pk=msg.pk).update(
+            locked_at=timezone.now() - timedelta(seconds=STALE_SECONDS + 1),
+        )
+
+        self.assertEqual(fail_stale(), 1)
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, "failed")
+        self.assertEqual(self.claimed_ids(), [])
+
+
+class OutboxDispatchTest(TestCase):
+    def setUp(self):
+        invalidate_routing_cache()
+        self.addCleanup(invalidate_routing_cache)
+        self.sent = []
+
+        async def post(service, job):
+            payload = service._payload(job)
+            self.sent.append((payload["instance_id"], payload["access_token"], job.message))
+            return {"status": "success"}
+
+        patcher = mock.patch("messaging.async_whatsapp_service.AsyncWhatsAppAPIService._post", post)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connection(self, name, instance_id, token):
+        tenant = Tenant.objects.create(name=name, plan="pro")
+        connection = WhatsAppConnection.objects.create(
+            tenant=tenant, phone_number="60100000000", access_token_ref=token, instance_id=instance_id,
+        )
+        customer = Customer.objects.create(tenant=tenant, name="Ali", phone_number="60123456789")
+        conversation = Conversation.objects.create(tenant=tenant, whatsapp_connection=connection, customer=customer)
+        return tenant, conversation
+
+    def test_each_connection_sends_with_its_own_credentials(self):
+        tenant_a, conversation_a = self.connection("Tenant A", "INSTANCE-A", "token-a")
+        tenant_b, conversation_b = self.connection("Tenant B", "INSTANCE-B", "token-b")
+        enqueue_message(tenant_a, "60123456789", "to a", conversation=conversation_a)
+        enqueue_message(tenant_b, "60122222222", "to b", conversation=conversation_b)
+        # No conversation: the tenant's connection
+        enqueue_message(tenant_b, "60199999999", "tenant b")
+
+        self.assertEqual(drain_once(), 3)
+        self.assertEqual(sorted(self.sent), [
+            ("INSTANCE-A", "token-a", "to a"),
+            ("INSTANCE-B", "token-b", "tenant b"),
+            ("INSTANCE-B", "token-b", "to b"),
+        ])
+        self.assertEqual(CoreMessage.objects.filter(status="sent").count(), 3)
+
+    def test_token_ref_naming_an_env_var_is_resolved(self):
+        tenant, conversation = self.connection("Tenant A", "INSTANCE-A", "TENANT_A_WABOT_TOKEN")
+        enqueue_message(tenant, "60123456789", "hello", conversation=conversation)
+
+        with mock.patch.dict("os.environ", {"TENANT_A_WABOT_TOKEN": "secret-a"}):
+            drain_once()
+
+        self.assertEqual(self.sent, [("INSTANCE-A", "secret-a", "hello")])
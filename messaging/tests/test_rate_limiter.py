@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from ..models import SendRateBucket
+from ..rate_limiter import Bucket, DatabaseRateLimitStore, LocalRateLimitStore, RateLimiter
+
+# 300/min: 5 tokens a second, 10 in a full bucket (2s burst)
+CONN = Bucket("conn:1", 300)
+
+
+class LocalStoreTest(SimpleTestCase):
+    def test_full_bucket_grants_its_burst_then_waits(self):
+        store = LocalRateLimitStore()
+
+        self.assertEqual(store.take([CONN], 12, now=100.0), (10, 0.0))
+        granted, wait = store.take([CONN], 1, now=100.0)
+        self.assertEqual(granted, 0)
+        self.assertAlmostEqual(wait, 0.2)
+
+    def test_tokens_refill_at_the_rate_up_to_capacity(self):
+        store = LocalRateLimitStore()
+        store.take([CONN], 10, now=100.0)
+
+        self.assertEqual(store.take([CONN], 10, now=101.0)[0], 5)
+        self.assertEqual(store.take([CONN], 20, now=200.0)[0], 10)
+
+    def test_every_bucket_must_have_the_tokens(self):
+        store = LocalRateLimitStore()
+        blast = Bucket("blast:1", 60, burst=3)
+
+        self.assertEqual(store.take([CONN, blast], 10, now=100.0)[0], 3)
+        # Both buckets paid for the grant
+        self.assertEqual(store.take([CONN], 10, now=100.0)[0], 7)
+
+    def test_empty_start(self):
+        self.assertEqual(LocalRateLimitStore(start_full=False).take([CONN], 1, now=100.0)[0], 0)
+
+
+class RateLimiterTest(SimpleTestCase):
+    def test_no_buckets_means_no_limit(self):
+        limiter = RateLimiter([Bucket("tenant:1", 0)])
+        self.assertEqual(limiter.acquire(50), 50)
+
+    def test_acquire_gives_up_after_timeout(self):
+        limiter = RateLimiter([Bucket("conn:1", 1)], store=LocalRateLimitStore(start_full=False))
+        self.assertEqual(limiter.acquire(1, timeout=0.01), 0)
+
+    def test_acquire_waits_for_a_refill(self):
+        limiter = RateLimiter([Bucket("conn:1", 6000)], store=LocalRateLimitStore(start_full=False))
+        self.assertGreaterEqual(limiter.acquire(5, timeout=1), 1)
+        self.assertGreater(limiter.waited, 0)
+
+    def test_broken_store_falls_back_to_an_empty_local_bucket(self):
+        store = mock.Mock(**{"take.side_effect": RuntimeError("database is down")})
+        limiter = RateLimiter([CONN], store=store)
+
+        with self.assertLogs("messaging.rate_limiter", "WARNING"):
+            self.assertEqual(limiter.try_acquire(5)[0], 0)
+        self.assertIsInstance(limiter.store, LocalRateLimitStore)
+
+
+class DatabaseStoreTest(TestCase):
+    def test_buckets_are_shared_between_stores(self):
+        self.assertEqual(DatabaseRateLimitStore().take([CONN], 8, now=100.0)[0], 8)
+        self.assertEqual(DatabaseRateLimitStore().take([CONN], 8, now=100.0)[0], 2)
+        self.assertEqual(DatabaseRateLimitStore().take([CONN], 8, now=101.0)[0], 5)
+        self.assertAlmostEqual(SendRateBucket.objects.get(key="conn:1").tokens, 0)
@@ -0,0 +1,65 @@
+from django.test import SimpleTestCase, TestCase
+
+from ..models import Customer, CustomerGroup, GroupMember, Tenant
+from ..templating import TemplateError, compile_template, customer_context, validate_template
+
+
+class CompiledTemplateTest(SimpleTestCase):
+    def test_text_without_placeholders_is_unchanged(self):
+        source = "Promo {CODE} 100% off {0} {{ }}"
+        self.assertEqual(compile_template(source).render({}), source)
+
+    def test_literal_braces_around_placeholders_are_kept(self):
+        template = compile_template("Hi {{name}}, use {CODE} or {0} by {date}")
+        self.assertEqual(template.render({"name": "Ali"}), "Hi Ali, use {CODE} or {0} by {date}")
+
+    def test_values_are_not_formatted(self):
+        template = compile_template("Hi {{name}}")
+        self.assertEqual(template.render({"name": "{0} {name} {{city}}"}), "Hi {0} {name} {{city}}")
+
+    def test_fallback_for_missing_or_empty_values(self):
+        template = compile_template("Hi {{ name | there }}!")
+        self.assertEqual(template.render({}), "Hi there!")
+        self.assertEqual(template.render({"name": ""}), "Hi there!")
+        self.assertEqual(template.render({"name": 0}), "Hi 0!")
+
+    def test_field_names_are_case_insensitive(self):
+        self.assertEqual(compile_template("{{First_Name}}").render({"first_name": "Ali"}), "Ali")
+
+    def test_render_many_keeps_order(self):
+        template = compile_template("{{name}}:{{city|-}}")
+        contexts = [{"name": "A", "city": "KL"}, {"name": "B"}]
+        self.assertEqual(template.render_many(contexts), ["A:KL", "B:-"])
+
+    def test_customer_context(self):
+        customer = Customer(name="Ali bin Abu", phone_number="60123456789", city="Ipoh")
+        context = customer_context(customer, {"Voucher": "V1", "city": "ignored"})
+        self.assertEqual(context["first_name"], "Ali")
+        self.assertEqual(context["voucher"], "V1")
+        # Customer fields win over custom columns
+        self.assertEqual(context["city"], "Ipoh")
+
+
+class ValidateTemplateTest(TestCase):
+    def setUp(self):
+        tenant = Tenant.objects.create(name="Test Tenant", plan="pro")
+        self.group = CustomerGroup.objects.create(tenant=tenant, name="Import")
+        customer = Customer.objects.create(tenant=tenant, name="Ali", phone_number="60123456789")
+        GroupMember.objects.create(tenant=tenant, group=self.group, customer=customer, custom_data={"Voucher": "V1"})
+
+    def test_customer_fields_are_known(self):
+        self.assertEqual(validate_template("Hi {{first_name}} from {{city}}").fields, ("first_name", "city"))
+
+    def test_malformed_placeholder_is_rejected(self):
+        with self.assertRaisesMessage(TemplateError, "Invalid placeholder {{first name}}"):
+            validate_template("Hi {{first name}}")
+
+    def test_unknown_placeholder_is_rejected(self):
+        with self.assertRaisesMessage(TemplateError, "Unknown placeholder {{voucher}}"):
+            validate_template("Code: {{voucher}}")
+
+    def test_unknown_placeholder_with_fallback_is_allowed(self):
+        validate_template("Code: {{voucher|none}}")
+
+    def test_custom_columns_of_targeted_groups_are_known(self):
+        validate_template("Code: {{voucher}}", group_ids=[self.group.pk])
@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ..models import WebhookInboxEvent
+from ..webhook_inbox import STALE_LOCK_SECONDS, claim_events
+
+
+class InboxClaimTest(TestCase):
+    def event(self, status, minutes_ago, locked_minutes_ago=None):
+        now = timezone.now()
+        return WebhookInboxEvent.objects.create(
+            raw_body="{}",
+            status=status,
+            received_at=now - timedelta(minutes=minutes_ago),
+            locked_at=None if locked_minutes_ago is None else now - timedelta(minutes=locked_minutes_ago),
+        )
+
+    def test_pending_then_stale_then_deferred(self):
+        deferred = self.event("deferred", 30)
+        stale = self.event("processing", 20, locked_minutes_ago=STALE_LOCK_SECONDS / 60 + 1)
+        self.event("processing", 10, locked_minutes_ago=0)
+        newer = self.event("pending", 1)
+        older = self.event("pending", 5)
+        self.event("done", 40)
+
+        claimed = claim_events(limit=10)
+
+        # Claimed in arrival order; a live worker's event is left alone
+        self.assertEqual(
+            [e.event_id for e in claimed], [deferred.event_id, stale.event_id, older.event_id, newer.event_id],
+        )
+        self.assertTrue(all(e.status == "processing" for e in claimed))
+
+    def test_limit_prefers_pending_work(self):
+        self.event("deferred", 30)
+        pending = self.event("pending", 1)
+
+        self.assertEqual([e.event_id for e in claim_events(limit=1)], [pending.event_id])
+
+    def test_claimed_events_are_not_claimed_twice(self):
+        event = self.event("pending", 1)
+
+        self.assertEqual(len(claim_events()), 1)
+        self.assertEqual(claim_events(), [])
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 1)
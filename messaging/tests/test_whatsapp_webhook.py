@@ -0,0 +1,102 @@
+from concurrent.futures import Future
+from unittest import mock
+
+from django.test import TestCase
+
+from .. import idempotency
+from ..connection_routing import invalidate_routing_cache
+from ..idempotency import DatabaseIdempotencyStore
+from ..models import CoreMessage, Tenant, WebhookIdempotencyKey, WhatsAppConnection
+from ..whatsapp_webhook import process_webhook_payload
+
+INSTANCE_ID = "TESTINSTANCE"
+
+
+def message(msg_id, text, sender="60123456789", from_me=False):
+    return {
+        "key": {"id": msg_id, "remoteJid": f"{sender}@s.whatsapp.net", "fromMe": from_me},
+        "message": {"conversation": text},
+    }
+
+
+def payload(data):
+    return {"type": "messages.upsert", "instance_id": INSTANCE_ID, "data": data}
+
+
+def done(value=None):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def failed(error):
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+class WebhookRetryTest(TestCase):
+    def setUp(self):
+        idempotency.set_store(DatabaseIdempotencyStore())
+        invalidate_routing_cache()
+        self.tenant = Tenant.objects.create(name="Test Tenant", plan="pro")
+        WhatsAppConnection.objects.create(
+            tenant=self.tenant, phone_number="60100000000", access_token_ref="ref", instance_id=INSTANCE_ID,
+        )
+        patcher = mock.patch("messaging.whatsapp_webhook._submit_contest_flow")
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        idempotency.set_store(None)
+        invalidate_routing_cache()
+
+    def inbound(self):
+        return list(CoreMessage.objects.filter(direction="inbound").values_list("text_body", "status"))
+
+    def test_failed_message_is_processed_on_retry(self):
+        self.submit.side_effect = [RuntimeError("flow crashed"), done()]
+        body = payload(message("MSG-1", "hello"))
+
+        with self.assertRaises(RuntimeError):
+            process_webhook_payload(body)
+        self.assertEqual(self.inbound(), [])
+
+        self.assertEqual(process_webhook_payload(body), "processed")
+        self.assertEqual(self.inbound(), [("hello", "delivered")])
+        self.assertEqual(process_webhook_payload(body), "msg_id_dedupe")
+        self.assertEqual(self.submit.call_count, 2)
+
+    def test_failed_batch_message_is_processed_on_retry(self):
+        self.submit.side_effect = [done(), failed(RuntimeError("flow crashed")), done()]
+        body = payload([message("MSG-1", "first"), message("MSG-2", "second", sender="60199999999")])
+
+        with self.assertRaises(RuntimeError):
+            process_webhook_payload(body)
+        self.assertEqual(self.inbound(), [("first", "delivered")])
+
+        # Only the message that failed runs again
+        self.assertEqual(process_webhook_payload(body), "batch_processed")
+        self.assertEqual(self.submit.call_count, 3)
+        self.assertEqual(self.submit.call_args.args[1], "second")
+        self.assertEqual(sorted(self.inbound()), [("first", "delivered"), ("second", "delivered")])
+
+    def test_message_without_connection_is_processed_once_one_exists(self):
+        self.submit.return_value = done()
+        WhatsAppConnection.objects.all().delete()
+        body = payload(message("MSG-1", "hello"))
+
+        self.assertEqual(process_webhook_payload(body), "no_connection")
+
+        WhatsAppConnection.objects.create(
+            tenant=self.tenant, phone_number="60100000000", access_token_ref="ref", instance_id=INSTANCE_ID,
+        )
+        self.assertEqual(process_webhook_payload(body), "processed")
+        self.assertEqual(self.submit.call_count, 1)
+
+    def test_outbound_message_does_not_claim_a_key(self):
+        body = payload(message("MSG-1", "hello", from_me=True))
+
+        self.assertEqual(process_webhook_payload(body), "bot_message_skipped")
+        self.assertFalse(WebhookIdempotencyKey.objects.exists())
+        self.submit.assert_not_called()
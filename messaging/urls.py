@@ -86,6 +86,7 @@ urlpatterns = [
     path('webhook/whatsapp/', whatsapp_webhook, name='whatsapp_webhook'),
     path('debug-webhook/', debug_webhook, name='debug_webhook'),
     path('debug/wabot-status/', views.wabot_status, name='wabot_status'),
+    path('debug/webhook-inbox/', views.webhook_inbox_status, name='webhook_inbox_status'),
     path('error-handling/', views.error_handling_dashboard, name='error_handling_dashboard'),
     
     # Incoming messages
@@ -112,6 +113,8 @@ urlpatterns = [
     path('blast/campaigns/create/', blast_views.blast_create_campaign, name='blast_create_campaign'),
     path('blast/campaigns/<str:blast_id>/send/', blast_views.blast_send_campaign, name='blast_send_campaign'),
     path('blast/campaigns/<str:blast_id>/cancel/', blast_views.blast_cancel_campaign, name='blast_cancel_campaign'),
+    path('blast/campaigns/<str:blast_id>/resume/', blast_views.blast_resume_campaign, name='blast_resume_campaign'),
     path('blast/campaigns/<str:blast_id>/progress/', blast_views.blast_campaign_progress, name='blast_campaign_progress'),
+    path('blast/campaigns/<str:blast_id>/progress/wait/', blast_views.blast_campaign_progress_wait, name='blast_campaign_progress_wait'),
     path('blast/campaigns/<str:blast_id>/', blast_views.blast_campaign_detail, name='blast_campaign_detail'),
 ]
\ No newline at end of file
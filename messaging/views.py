@@ -24,6 +24,7 @@ except Exception:  # during migrations or model refactors
     WhatsAppMessage = None
     OCRProcessingLog = None
 from .whatsapp_service import WhatsAppAPIService
+from .outbox import enqueue_message
 from .temp_image_storage import TemporaryImageStorage
 from .cloudinary_service import cloudinary_service
 from .ocr_service import OCRService
@@ -448,44 +449,26 @@ def contest_send_message(request):
                 messages.error(request, 'Please enter a message')
                 return redirect('contest_send_message')
             
-            # Initialize WhatsApp service
-            wa_service = WhatsAppAPIService()
-            
-            # Send messages
+            # Queue messages in the outbox (sent by the dispatcher after commit)
             success_count = 0
             error_count = 0
+            conn = WhatsAppConnection.objects.filter(tenant=tenant).first()
             
             for customer_id in customer_ids:
                 try:
                     customer = Customer.objects.get(tenant=tenant, customer_id=customer_id)
                     
-                    # Send via WABot
-                    result = wa_service.send_text_message(customer.phone_number, message_text)
-                    
-                    if result['success']:
-                        # Create conversation and message record
-                        conn = WhatsAppConnection.objects.filter(tenant=tenant).first()
-                        if conn:
-                            convo, _ = Conversation.objects.get_or_create(
-                                tenant=tenant, 
-                                customer=customer, 
-                                whatsapp_connection=conn, 
-                                contest=contest,
-                                defaults={}
-                            )
-                            CoreMessage.objects.create(
-                                tenant=tenant,
-                                conversation=convo,
-                                direction='outbound',
-                                status='sent',
-                                text_body=message_text,
-                                provider_msg_id=result['data'].get('id'),
-                                sent_at=dj_timezone.now()
-                            )
-                        success_count += 1
-                    else:
-                        error_count += 1
-                        logger.error(f"Failed to send message to {customer.phone_number}: {result.get('error')}")
+                    convo = None
+                    if conn:
+                        convo, _ = Conversation.objects.get_or_create(
+                            tenant=tenant, 
+                            customer=customer, 
+                            whatsapp_connection=conn, 
+                            contest=contest,
+                            defaults={}
+                        )
+                    enqueue_message(tenant, customer.phone_number, message_text, conversation=convo)
+                    success_count += 1
                         
                 except Customer.DoesNotExist:
                     error_count += 1
@@ -495,7 +478,7 @@ def contest_send_message(request):
             
             # Show results
             if success_count > 0:
-                messages.success(request, f'Successfully sent {success_count} message(s)')
+                messages.success(request, f'Queued {success_count} message(s) for sending')
             if error_count > 0:
                 messages.warning(request, f'Failed to send {error_count} message(s)')
             
@@ -832,6 +815,39 @@ def wabot_status(request):
         return JsonResponse({"success": False, "error": str(e)}, status=500)
 
 
+@login_required
+@require_http_methods(["GET"])
+def webhook_inbox_status(request):
+    """
+    JSON endpoint showing webhook inbox depth and lag (oldest pending event age),
+    plus admission-control counters (how often the webhook deferred/dropped events)
+    WABot HTTP connection reuse and the outbound outbox backlog.
+    Use it to confirm the inbox workers and outbox dispatchers keep up during campaigns.
+    Staff only: the figures span every tenant.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"success": False, "error": "Staff access required"}, status=403)
+    try:
+        from .admission import admission_stats
+        from .circuit_breaker import breaker_stats
+        from .outbox import outbox_stats
+        from .wabot_http import http_stats
+        from .webhook_inbox import inbox_lag_stats
+        return JsonResponse(
+            {
+                "success": True,
+                "inbox": inbox_lag_stats(),
+                "admission": admission_stats(),
+                "wabot_http": http_stats(),
+                "circuit_breakers": breaker_stats(),
+                "outbox": outbox_stats(),
+            },
+            status=200,
+        )
+    except Exception as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+
 @login_required
 def error_handling_dashboard(request):
     """Error handling and system status dashboard"""
@@ -1305,10 +1321,8 @@ def contest_verify_entry(request, entry_id):
             entry.verification_notes = verification_notes
             entry.save()
             
-            # Send eligibility message
-            from .whatsapp_service import WhatsAppAPIService
-            wa_service = WhatsAppAPIService()
-            wa_service.send_text_message(entry.customer.phone_number, entry.contest.eligibility_message)
+            # Queue eligibility message
+            enqueue_message(entry.tenant, entry.customer.phone_number, entry.contest.eligibility_message)
             
             messages.success(request, f'Entry verified for {entry.customer.name}')
             
@@ -2513,61 +2527,20 @@ def send_bulk_message(request):
         bulk_message = BulkMessage.objects.create(message=message)
         recipient_ids = data.get('recipients', [])
         
-        # Initialize WhatsApp service
-        wa_service = WhatsAppAPIService()
-        
-        print(f"DEBUG: WhatsApp service initialized with:")  # Debug log
-        print(f"  - access_token: {wa_service.access_token}")  # Debug log
-        print(f"  - instance_id: {wa_service.instance_id}")  # Debug log
-        print(f"  - base_url: {wa_service.base_url}")  # Debug log
-        
-        # Use instance ID from settings if not already set
-        if not wa_service.instance_id:
-            from django.conf import settings
-            default_instance = getattr(settings, 'WHATSAPP_API', {}).get('DEFAULT_INSTANCE_ID')
-            if default_instance:
-                wa_service.set_instance_id(default_instance)
-                print(f"DEBUG: Set instance_id from settings: {default_instance}")  # Debug log
-            else:
-                print("DEBUG: No default instance ID found in settings")  # Debug log
-        
+        tenant = _get_tenant(request)
         successful_sends = 0
         failed_sends = 0
         
-        print(f"DEBUG: Processing {len(recipient_ids)} recipients")  # Debug log
+        logger.debug("Queueing %s recipients", len(recipient_ids))
         
         for recipient_id in recipient_ids:
             try:
-                customer = Customer.objects.get(customer_id=recipient_id, tenant=_get_tenant(request))
+                customer = Customer.objects.get(customer_id=recipient_id, tenant=tenant)
                 bulk_message.recipients.add(customer)
                 
-                print(f"DEBUG: Sending to {customer.name} ({customer.phone_number})")  # Debug log
-                
-                # Send via WhatsApp API
-                if image_url:
-                    print(f"DEBUG: Sending media message with URL: {image_url}")  # Debug log
-                    # Send media message
-                    result = wa_service.send_media_message(
-                        customer.phone_number, 
-                        data.get('message', ''), 
-                        image_url
-                    )
-                else:
-                    print(f"DEBUG: Sending text message: {data.get('message', '')}")  # Debug log
-                    # Send text message
-                    result = wa_service.send_text_message(
-                        customer.phone_number, 
-                        data.get('message', '')
-                    )
-                
-                print(f"DEBUG: WhatsApp API result: {result}")  # Debug log
-                
-                if result['success']:
-                    successful_sends += 1
-                    print(f"DEBUG: Successfully sent to {customer.phone_number}")  # Debug log
-                else:
-                    failed_sends += 1
-                    print(f"DEBUG: Failed to send to {customer.phone_number}: {result.get('error', 'Unknown error')}")  # Debug log
+                # Queue in the outbox; the dispatcher sends it (media if an image was given)
+                enqueue_message(tenant, customer.phone_number, data.get('message', ''), media_url=image_url or None)
+                successful_sends += 1
                     
             except Customer.DoesNotExist:
                 failed_sends += 1
@@ -2577,7 +2550,7 @@ def send_bulk_message(request):
         if successful_sends > 0:
             return JsonResponse({
                 'success': True, 
-                'message': f'Message sent successfully to {successful_sends} recipients. {failed_sends} failed.',
+                'message': f'Message queued for {successful_sends} recipients. {failed_sends} failed.',
                 'successful_sends': successful_sends,
                 'failed_sends': failed_sends
             })
@@ -0,0 +1,124 @@
+"""
+Process-wide pooled HTTP client for WABot (app.wabot.my) calls.
+
+Bare `requests.post` opens a new TCP+TLS connection per call, so a 2,000-recipient
+blast paid 2,000 handshakes, and the send paths had no timeout at all. Every
+WABot call now goes through one `requests.Session` per process with a sized
+`HTTPAdapter` (keep-alive connections reused across threads) and default
+(connect, read) timeouts.
+
+Reuse is instrumented: `http_stats()` reports requests made vs. connections
+opened; a healthy blast shows a reuse ratio close to 1.
+
+Settings (env):
+- WABOT_HTTP_POOL_SIZE: keep-alive connections per host (default 32)
+- WABOT_HTTP_POOL_HOSTS: hosts kept in the pool manager (default 4)
+- WABOT_HTTP_CONNECT_TIMEOUT / WABOT_HTTP_READ_TIMEOUT: seconds (default 5 / 30)
+- WABOT_HTTP_CONNECT_RETRIES: retries for failed connects only (default 1);
+  sends are never retried once the request went out
+"""
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("WABOT_HTTP_POOL_SIZE", "32") or 32)
+POOL_HOSTS = int(os.getenv("WABOT_HTTP_POOL_HOSTS", "4") or 4)
+CONNECT_TIMEOUT = float(os.getenv("WABOT_HTTP_CONNECT_TIMEOUT", "5") or 5)
+READ_TIMEOUT = float(os.getenv("WABOT_HTTP_READ_TIMEOUT", "30") or 30)
+CONNECT_RETRIES = int(os.getenv("WABOT_HTTP_CONNECT_RETRIES", "1") or 0)
+
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+stats = {"requests": 0, "connections_opened": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        stats[key] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count("connections_opened")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count("connections_opened")
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools count every new (non-reused) connection."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+def build_session(pool_size=POOL_SIZE, pool_hosts=POOL_HOSTS, connect_retries=CONNECT_RETRIES):
+    session = requests.Session()
+    adapter = PooledAdapter(
+        pool_connections=pool_hosts,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=connect_retries, connect=connect_retries, read=0, status=0, redirect=0),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """The shared Session for this process (rebuilt after a fork)."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def request(method, url, timeout=None, **kwargs):
+    """`requests.request` over the pooled session, with the default timeouts."""
+    _count("requests")
+    try:
+        return get_session().request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+    except requests.exceptions.RequestException:
+        _count("errors")
+        raise
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def http_stats():
+    with _stats_lock:
+        snapshot = dict(stats)
+    made = snapshot["requests"]
+    snapshot["reused"] = max(0, made - snapshot["connections_opened"])
+    snapshot["reuse_ratio"] = round(snapshot["reused"] / made, 3) if made else 0.0
+    snapshot["pool_size"] = POOL_SIZE
+    return snapshot
@@ -1,12 +1,14 @@
 """
 WABOT Message Poller - Polls WABOT API for new messages
 """
-import requests
 import json
 import logging
 from datetime import datetime, timedelta
 from django.utils import timezone
-from .models import Customer, CoreMessage, Conversation, WhatsAppConnection, Tenant
+from .models import Customer, CoreMessage, Conversation
+from .connection_routing import resolve_instance
+from .customer_lanes import run_for_customer
+from . import wabot_http
 from .pdpa_service import PDPAConsentService
 from .step_by_step_contest_service import StepByStepContestService
 
@@ -37,7 +39,7 @@ class WABOTPoller:
                 'since': since.isoformat()
             }
             
-            response = requests.get(url, headers=headers, params=params)
+            response = wabot_http.get(url, headers=headers, params=params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -68,21 +70,15 @@ class WABOTPoller:
             if not from_number or not message_text:
                 return
             
-            # Get or create customer
-            customer = self._get_or_create_customer(from_number)
-            if not customer:
-                return
-            
-            # Get tenant (assuming first tenant for now)
-            tenant = Tenant.objects.first()
-            if not tenant:
-                logger.error("No tenant found")
+            # Route the polled instance to its tenant + connection (cached routing table)
+            tenant, conn = resolve_instance(self.instance_id)
+            if not tenant or not conn:
+                logger.error("No WhatsApp connection found for instance %s", self.instance_id)
                 return
             
-            # Get WhatsApp connection
-            conn = WhatsAppConnection.objects.filter(tenant=tenant).first()
-            if not conn:
-                logger.error("No WhatsApp connection found")
+            # Get or create customer
+            customer = self._get_or_create_customer(from_number, tenant)
+            if not customer:
                 return
             
             # Create conversation
@@ -107,9 +103,12 @@ class WABOTPoller:
             # Process with PDPA service
             self.pdpa_service.handle_incoming_message(customer, message_text, tenant)
             
-            # Process step-by-step contest flow (after PDPA)
-            contest_results = self.step_contest_service.process_message_for_contests(
-                customer, message_text, tenant, conversation
+            # Process step-by-step contest flow (after PDPA), in the customer's ordered lane
+            # so it never races the webhook on the same ContestFlowState
+            contest_results = run_for_customer(
+                tenant.pk, customer.pk,
+                self.step_contest_service.process_message_for_contests,
+                customer, message_text, tenant, conversation,
             )
             
             # Log contest processing results
@@ -121,7 +120,7 @@ class WABOTPoller:
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
     
-    def _get_or_create_customer(self, phone_number):
+    def _get_or_create_customer(self, phone_number, tenant):
         """Get or create customer from phone number"""
         try:
             # Clean phone number
@@ -131,10 +130,10 @@ class WABOTPoller:
             
             # Get or create customer
             customer, created = Customer.objects.get_or_create(
+                tenant=tenant,
                 phone_number=clean_number,
                 defaults={
                     'name': f'Customer {clean_number}',
-                    'email': '',
                     'address': '',
                     'created_at': timezone.now()
                 }
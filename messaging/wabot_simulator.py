@@ -0,0 +1,296 @@
+"""
+Local stand-in for the WABot API (app.wabot.my), for offline benchmarks and tests.
+
+`WABotSimulator` is a plain WSGI app implementing the endpoints this app uses:
+
+    POST /send           text/media/template sends -> message id
+    GET  /status         instance state
+    GET  /get_media      {"url": ...} pointing at the simulator's own /media/<id>
+    POST /set_webhook    per-instance callback URL
+    GET  /_stats         request/outcome counters (simulator only)
+
+Any path prefix is accepted, so WABOT_API_URL=http://127.0.0.1:8765/api works
+unchanged. Behaviour is configurable and seeded, so runs are reproducible:
+
+- latency: "50" (fixed ms), "uniform:20:200", "normal:80:20", "lognormal:60:0.5"
+  (median ms, sigma) or "exp:50" (mean ms)
+- error_rate / throttle_rate: fraction of sends answered 500 / 429
+- rate_per_min: per-instance token bucket; over it, 429 with Retry-After
+- callbacks: when an instance has a webhook (set_webhook or `webhook_url`), each
+  accepted send is followed by a `messages.update` status callback and, with
+  probability `reply_rate`, a `messages.upsert` reply from the recipient
+
+Run it with `python manage.py run_wabot_simulator`, or in-process with
+`start_in_thread(WABotSimulator(...))`.
+"""
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import requests
+
+from .rate_limiter import Bucket, LocalRateLimitStore
+
+logger = logging.getLogger(__name__)
+
+# Smallest valid JPEG-ish body served for /media/<id>
+MEDIA_BYTES = b"\xFF\xD8\xFF\xE0" + b"\x00" * 60 + b"\xFF\xD9"
+
+_STATUS_TEXT = {200: "200 OK", 400: "400 Bad Request", 401: "401 Unauthorized", 404: "404 Not Found",
+                429: "429 Too Many Requests", 500: "500 Internal Server Error"}
+
+
+def parse_latency(spec):
+    """Latency spec -> function(rng) returning seconds. See module docstring."""
+    kind, _, args = str(spec or "0").partition(":")
+    if not args:
+        kind, args = "fixed", kind
+    values = [float(v) for v in args.split(":") if v]
+    kind = kind.lower()
+    if kind == "fixed":
+        ms = values[0] if values else 0.0
+        return lambda rng: ms / 1000.0
+    if kind == "uniform":
+        low, high = values
+        return lambda rng: rng.uniform(low, high) / 1000.0
+    if kind == "normal":
+        mean, sd = values
+        return lambda rng: max(0.0, rng.gauss(mean, sd)) / 1000.0
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: rng.lognormvariate(math.log(median), sigma) / 1000.0
+    if kind == "exp":
+        mean = values[0]
+        return lambda rng: rng.expovariate(1.0 / mean) / 1000.0 if mean > 0 else 0.0
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+class WABotSimulator:
+    """WSGI app standing in for WABot. Thread-safe; state lives on the instance."""
+
+    def __init__(self, latency="50", error_rate=0.0, throttle_rate=0.0, rate_per_min=0,
+                 webhook_url=None, reply_rate=0.0, reply_text="hello", callback_delay_ms=200,
+                 seed=None, callback_workers=4):
+        self.latency = parse_latency(latency)
+        self.error_rate = float(error_rate)
+        self.throttle_rate = float(throttle_rate)
+        self.rate_per_min = float(rate_per_min or 0)
+        self.webhook_url = webhook_url or None
+        self.reply_rate = float(reply_rate)
+        self.reply_text = reply_text
+        self.callback_delay = callback_delay_ms / 1000.0
+        self.stats = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._webhooks = {}
+        self._buckets = LocalRateLimitStore()
+        self._callbacks = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix="wabot-sim-callback")
+        self._session = requests.Session()
+
+    # -------------------------------------------------------------------------
+    # WSGI
+    # -------------------------------------------------------------------------
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "").rstrip("/")
+        params = self._params(environ)
+        endpoint = "media" if "/media/" in path else path.rsplit("/", 1)[-1]
+        handler = {
+            "send": self.send,
+            "status": self.status,
+            "get_media": self.get_media,
+            "set_webhook": self.set_webhook,
+            "_stats": self.stats_view,
+        }.get(endpoint)
+        self._count(f"requests:{endpoint or 'root'}")
+
+        if endpoint == "media":
+            start_response(_STATUS_TEXT[200], [("Content-Type", "image/jpeg"),
+                                               ("Content-Length", str(len(MEDIA_BYTES)))])
+            return [MEDIA_BYTES]
+        if handler is None:
+            status, body, headers = 404, {"status": "error", "message": f"unknown endpoint {path}"}, []
+        else:
+            status, body, headers = handler(params, environ)
+        data = json.dumps(body).encode()
+        start_response(_STATUS_TEXT[status], [("Content-Type", "application/json"),
+                                              ("Content-Length", str(len(data)))] + headers)
+        return [data]
+
+    def _params(self, environ):
+        params = dict(parse_qsl(environ.get("QUERY_STRING", "")))
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        raw = environ["wsgi.input"].read(length) if length else b""
+        if raw:
+            if "json" in (environ.get("CONTENT_TYPE") or ""):
+                try:
+                    body = json.loads(raw)
+                except ValueError:
+                    body = None
+                if isinstance(body, dict):
+                    params.update(body)
+            else:
+                params.update(parse_qsl(raw.decode("utf-8", "replace")))
+        return params
+
+    def _count(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.stats[key] += 1
+
+    def _roll(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _sleep(self):
+        with self._lock:
+            delay = self.latency(self._rng)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _check_auth(self, params):
+        if not params.get("instance_id") or not params.get("access_token"):
+            self._count("rejected:auth")
+            return 401, {"status": "error", "message": "instance_id and access_token are required"}, []
+        return None
+
+    # -------------------------------------------------------------------------
+    # ENDPOINTS
+    # -------------------------------------------------------------------------
+
+    def send(self, params, environ):
+        denied = self._check_auth(params)
+        if denied:
+            return denied
+        instance_id = str(params["instance_id"])
+        number = "".join(filter(str.isdigit, str(params.get("number", ""))))
+        if not number:
+            self._count("send:bad_request")
+            return 400, {"status": "error", "message": "number is required"}, []
+
+        if self.rate_per_min > 0:
+            granted, wait = self._buckets.take([Bucket(f"sim:{instance_id}", self.rate_per_min)], 1, time.time())
+            if not granted:
+                self._count("send:rate_limited")
+                return 429, {"status": "error", "message": "rate limit exceeded"}, [("Retry-After", str(math.ceil(wait)))]
+
+        self._sleep()
+        roll = self._roll()
+        if roll < self.throttle_rate:
+            self._count("send:429")
+            return 429, {"status": "error", "message": "too many requests"}, [("Retry-After", "1")]
+        if roll < self.throttle_rate + self.error_rate:
+            self._count("send:500")
+            return 500, {"status": "error", "message": "internal error"}, []
+
+        msg_id = uuid.uuid4().hex[:20].upper()
+        self._count("send:ok", f"send:type:{params.get('type', 'text')}")
+        self._schedule_callbacks(instance_id, number, msg_id)
+        return 200, {
+            "status": "success",
+            "message": "Message sent",
+            "data": {
+                "key": {"remoteJid": f"{number}@s.whatsapp.net", "fromMe": True, "id": msg_id},
+                "status": "PENDING",
+            },
+        }, []
+
+    def status(self, params, environ):
+        denied = self._check_auth(params)
+        if denied:
+            return denied
+        return 200, {"status": "success", "message": "connected",
+                     "data": {"instance_id": params["instance_id"], "state": "connected"}}, []
+
+    def get_media(self, params, environ):
+        denied = self._check_auth(params)
+        if denied:
+            return denied
+        media_id = params.get("media_id")
+        if not media_id:
+            return 400, {"status": "error", "message": "media_id is required"}, []
+        host = environ.get("HTTP_HOST") or f"{environ.get('SERVER_NAME')}:{environ.get('SERVER_PORT')}"
+        return 200, {"status": "success", "url": f"http://{host}/media/{media_id}"}, []
+
+    def set_webhook(self, params, environ):
+        denied = self._check_auth(params)
+        if denied:
+            return denied
+        enable = str(params.get("enable", "true")).lower() != "false"
+        with self._lock:
+            if enable and params.get("webhook_url"):
+                self._webhooks[str(params["instance_id"])] = params["webhook_url"]
+            else:
+                self._webhooks.pop(str(params["instance_id"]), None)
+        return 200, {"status": "success", "message": "webhook updated"}, []
+
+    def stats_view(self, params, environ):
+        with self._lock:
+            return 200, dict(self.stats), []
+
+    # -------------------------------------------------------------------------
+    # CALLBACKS
+    # -------------------------------------------------------------------------
+
+    def webhook_for(self, instance_id):
+        with self._lock:
+            return self._webhooks.get(instance_id) or self.webhook_url
+
+    def _schedule_callbacks(self, instance_id, number, msg_id):
+        url = self.webhook_for(instance_id)
+        if not url:
+            return
+        reply = self._roll() < self.reply_rate
+        self._callbacks.submit(self._run_callbacks, url, instance_id, number, msg_id, reply)
+
+    def _run_callbacks(self, url, instance_id, number, msg_id, reply):
+        jid = f"{number}@s.whatsapp.net"
+        time.sleep(self.callback_delay)
+        self._post_callback(url, {
+            "instance_id": instance_id,
+            "data": {"event": "messages.update", "data": [
+                {"key": {"id": msg_id, "fromMe": True, "remoteJid": jid}, "update": {"status": 3}},
+            ]},
+        }, "status")
+        if reply:
+            time.sleep(self.callback_delay)
+            self._post_callback(url, {
+                "instance_id": instance_id,
+                "data": {"event": "messages.upsert", "data": [{
+                    "key": {"id": uuid.uuid4().hex[:20].upper(), "fromMe": False, "remoteJid": jid},
+                    "message": {"conversation": self.reply_text},
+                    "messageTimestamp": int(time.time()),
+                }]},
+            }, "reply")
+
+    def _post_callback(self, url, payload, kind):
+        try:
+            response = self._session.post(url, json=payload, timeout=10)
+            self._count(f"callback:{kind}:{response.status_code}")
+        except requests.exceptions.RequestException as e:
+            self._count(f"callback:{kind}:error")
+            logger.warning("Simulator callback failed: %s %s", url, e)
+
+    def close(self):
+        self._callbacks.shutdown(wait=False)
+        self._session.close()
+
+
+def start_in_thread(app, addr="127.0.0.1", port=0):
+    """Serve `app` on a daemon thread; returns the server (`server.server_port`, `.shutdown()`)."""
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+    server = ThreadedWSGIServer((addr, port), WSGIRequestHandler, allow_reuse_address=True)
+    server.set_app(app)
+    threading.Thread(target=server.serve_forever, name="wabot-simulator", daemon=True).start()
+    return server
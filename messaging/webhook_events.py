@@ -0,0 +1,217 @@
+"""
+Single-pass normalizer for WABot/Baileys webhook payloads.
+
+`parse_webhook(top)` unwraps the envelope (Format A `{type, data}` or Format B
+`{instance_id, data: {event, data}}`) and walks each message dict exactly once,
+producing compact `InboundEvent` objects (`__slots__`, no per-event dict). Every
+consumer (webhook view, inbox, batch path, replay tooling) reads these fields
+instead of re-walking the nested dicts; the inbox enqueue only needs
+`peek_webhook`.
+
+Shapes handled per message:
+- sender: `from`/`number`/`phone`, else `key.remoteJidAlt` / `key.remoteJid`
+  (groups: `key.participantAlt` / `key.participant`)
+- text: `message.conversation`, `message.extendedTextMessage.text`,
+  `message.body`/`message.text`, a plain-string `message`, or top-level `text`
+- media: `message.imageMessage` / `videoMessage` / `documentMessage`
+- a nested `data` dict fills in a missing sender/text
+"""
+import os
+import re
+
+_DIGITS_ONLY = re.compile(r"\D+")
+
+MESSAGE_EVENTS = frozenset({"message", "incoming_message", "messages", "message_received"})
+MEDIA_KINDS = (("imageMessage", "image"), ("videoMessage", "video"), ("documentMessage", "document"))
+
+
+def norm_number(n):
+    if not n:
+        return None
+    s = _DIGITS_ONLY.sub("", str(n).strip())
+    return s or None
+
+
+class InboundEvent:
+    """One inbound message, normalized."""
+
+    __slots__ = (
+        "instance_id", "sender", "text", "msg_id", "from_me", "status", "remote_jid",
+        "timestamp", "media_kind", "media_url", "media_caption", "media_meta",
+    )
+
+    def __init__(self, instance_id="", sender=None, text="", msg_id="", from_me=None, status=None,
+                 remote_jid="", timestamp=None, media_kind="", media_url="", media_caption="", media_meta=None):
+        self.instance_id = instance_id
+        self.sender = sender
+        self.text = text
+        self.msg_id = msg_id
+        self.from_me = from_me
+        self.status = status
+        self.remote_jid = remote_jid
+        self.timestamp = timestamp
+        self.media_kind = media_kind
+        self.media_url = media_url
+        self.media_caption = media_caption
+        self.media_meta = media_meta
+
+    @property
+    def effective_text(self):
+        """Text, or the media caption for media-only messages."""
+        return self.text or self.media_caption or ""
+
+    @property
+    def is_group(self):
+        return self.remote_jid.lower().endswith("@g.us")
+
+    @property
+    def is_outbound(self):
+        """fromMe, or a Baileys `status` (present primarily on our own outbound messages)."""
+        return self.from_me is True or self.status not in (None, 0, "0")
+
+    @property
+    def dedupe_key(self):
+        """Idempotency key: provider msg_id, else remote+timestamp+text."""
+        if self.msg_id:
+            return f"wabot:seen:msgid:{self.msg_id}"
+        remote = self.remote_jid or self.sender or ""
+        return f"wabot:seen:fallback:{remote}:{self.timestamp or ''}:{self.text[:200]}"
+
+    def __repr__(self):
+        return f"<InboundEvent {self.msg_id or '-'} from={self.sender} media={self.media_kind or '-'}>"
+
+
+class WebhookPayload:
+    """Unwrapped envelope plus its normalized messages."""
+
+    __slots__ = ("event_type", "instance_id", "is_message", "is_batch", "data", "events")
+
+    def __init__(self, event_type, instance_id, data):
+        self.event_type = event_type
+        self.instance_id = instance_id
+        self.data = data
+        event_str = str(event_type).lower() if event_type else ""
+        self.is_message = event_str in MESSAGE_EVENTS or event_str.startswith("messages.")
+        self.is_batch = isinstance(data, list)
+        self.events = []
+
+    @property
+    def first(self):
+        return self.events[0] if self.events else None
+
+
+def unwrap_event(top):
+    """
+    Resolve (event_type, event_data, instance_id) for both payload formats:
+    Format A: {"type":"message","data":{...}}
+    Format B: {"instance_id": "...", "data": {"event": "...", "data": {...}}}
+    """
+    event_type = top.get("type")
+    event_data = top.get("data")
+    instance_id = top.get("instance_id") or os.getenv("WABOT_INSTANCE_ID", "")
+    if not event_type and isinstance(event_data, dict):
+        inner_event = event_data.get("event")
+        if inner_event:
+            event_type = inner_event
+            event_data = event_data.get("data")
+    return event_type, event_data, instance_id
+
+
+def peek_webhook(top):
+    """
+    (event_type, instance_id, msg_id of the first message) without normalizing the
+    messages; enough for the inbox row written on the request thread.
+    """
+    event_type, event_data, instance_id = unwrap_event(top if isinstance(top, dict) else {})
+    if isinstance(event_data, list):
+        event_data = event_data[0] if event_data else None
+    key = event_data.get("key") if isinstance(event_data, dict) else None
+    msg_id = key.get("id") if isinstance(key, dict) else None
+    return event_type, instance_id, msg_id or ""
+
+
+def _sender_and_text(msg, key):
+    """Sender (normalized) and text of one message dict."""
+    sender = msg.get("from") or msg.get("number") or msg.get("phone")
+    if not sender and key is not None:
+        remote = key.get("remoteJid") or ""
+        if remote.endswith("@g.us"):
+            jid = key.get("participantAlt") or key.get("participant") or ""
+        else:
+            jid = key.get("remoteJidAlt") or remote
+        if jid:
+            sender = jid.split("@", 1)[0]
+
+    body = msg.get("message")
+    if isinstance(body, dict):
+        text = body.get("conversation")
+        if not text:
+            ext = body.get("extendedTextMessage")
+            text = ext.get("text") if isinstance(ext, dict) else None
+            if not text:
+                text = body.get("body") or body.get("text") or ""
+    elif isinstance(body, str):
+        text = body
+    else:
+        text = msg.get("text") or ""
+    return norm_number(sender), ("" if text is None else str(text))
+
+
+def normalize_message(msg, instance_id=""):
+    """Normalize one message dict in a single walk (None for non-dicts)."""
+    if not isinstance(msg, dict):
+        return None
+    key = msg.get("key")
+    if not isinstance(key, dict):
+        key = None
+    sender, text = _sender_and_text(msg, key)
+
+    # A nested `data` dict fills in a missing sender/text.
+    nested = msg.get("data")
+    while (not sender or not text) and isinstance(nested, dict):
+        nested_key = nested.get("key")
+        sender2, text2 = _sender_and_text(nested, nested_key if isinstance(nested_key, dict) else None)
+        sender = sender or sender2
+        text = text or text2
+        nested = nested.get("data")
+
+    media_kind = media_url = media_caption = ""
+    media_meta = None
+    body = msg.get("message")
+    if isinstance(body, dict):
+        for field, kind in MEDIA_KINDS:
+            if field in body:
+                media = body[field]
+                media_meta = media if isinstance(media, dict) else {}
+                media_kind = kind
+                media_url = media_meta.get("url") or ""
+                media_caption = media_meta.get("caption") or ""
+                break
+
+    if key is not None:
+        remote = key.get("remoteJid")
+        return InboundEvent(
+            instance_id, sender, text, key.get("id") or "", key.get("fromMe"), msg.get("status"),
+            remote if isinstance(remote, str) else "", msg.get("messageTimestamp"),
+            media_kind, media_url, media_caption, media_meta,
+        )
+    return InboundEvent(
+        instance_id, sender, text, "", None, msg.get("status"), "", msg.get("messageTimestamp"),
+        media_kind, media_url, media_caption, media_meta,
+    )
+
+
+def parse_webhook(top):
+    """Unwrap and normalize a decoded webhook body. Never raises on odd shapes."""
+    if not isinstance(top, dict):
+        top = {}
+    event_type, event_data, instance_id = unwrap_event(top)
+    payload = WebhookPayload(event_type, instance_id, event_data)
+    if isinstance(event_data, list):
+        for msg in event_data:
+            ev = normalize_message(msg, instance_id)
+            if ev is not None:
+                payload.events.append(ev)
+    elif isinstance(event_data, dict):
+        payload.events.append(normalize_message(event_data, instance_id))
+    return payload
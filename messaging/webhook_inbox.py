@@ -0,0 +1,231 @@
+"""
+Durable inbound-event inbox for the WABot webhook (ack-then-process).
+
+The webhook view only inserts a `WebhookInboxEvent` row with the raw payload and
+returns 200. Workers claim pending rows and run them through
+`whatsapp_webhook.process_webhook_payload`, i.e. the same code path that used to
+run inline inside the request.
+
+Workers run either:
+- in-process (a few daemon threads started lazily by the web process), sized by
+  env var WABOT_INBOX_INPROCESS_WORKERS (default 2, set 0 to disable), or
+- as dedicated processes via `python manage.py run_inbox_workers`.
+
+Claiming is a conditional UPDATE (status=pending -> processing), so any number of
+threads/processes can drain the same table without double-processing an event.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections, connection
+from django.db.models import F, Min
+from django.utils import timezone as dj_timezone
+
+from .models import WebhookInboxEvent
+
+logger = logging.getLogger(__name__)
+
+# A row stuck in `processing` longer than this is assumed to belong to a dead worker.
+STALE_LOCK_SECONDS = int(os.getenv("WABOT_INBOX_STALE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("WABOT_INBOX_MAX_ATTEMPTS", "5"))
+
+# Wakes idle in-process workers as soon as the webhook enqueues something.
+_wakeup = threading.Event()
+_inprocess_lock = threading.Lock()
+_inprocess_pool = None
+
+
+def enqueue_webhook_event(raw, top, deferred=False):
+    """
+    Persist a raw webhook payload. Must stay cheap: one INSERT, no provider/OCR calls.
+    `deferred` rows (admission control under overload) are claimed only when no
+    pending work is left, and don't wake the in-process workers.
+    """
+    from .webhook_events import peek_webhook
+
+    event_type, instance_id, msg_id = peek_webhook(top)
+    event = WebhookInboxEvent.objects.create(
+        instance_id=instance_id or "",
+        event_type=str(event_type or "")[:100],
+        msg_id=msg_id,
+        raw_body=raw,
+        status="deferred" if deferred else "pending",
+    )
+    if not deferred:
+        _wakeup.set()
+        ensure_inprocess_workers()
+    return event
+
+
+def claim_events(limit=10):
+    """
+    Claim up to `limit` events for this worker. Stale `processing` rows are reclaimed;
+    `deferred` rows are taken only after both.
+    """
+    now = dj_timezone.now()
+    stale_before = now - timedelta(seconds=STALE_LOCK_SECONDS)
+
+    candidate_ids = list(
+        WebhookInboxEvent.objects.filter(status="pending")
+        .order_by("received_at")
+        .values_list("event_id", flat=True)[:limit]
+    )
+    if len(candidate_ids) < limit:
+        candidate_ids += list(
+            WebhookInboxEvent.objects.filter(status="processing", locked_at__lt=stale_before)
+            .order_by("received_at")
+            .values_list("event_id", flat=True)[: limit - len(candidate_ids)]
+        )
+    if len(candidate_ids) < limit:
+        candidate_ids += list(
+            WebhookInboxEvent.objects.filter(status="deferred")
+            .order_by("received_at")
+            .values_list("event_id", flat=True)[: limit - len(candidate_ids)]
+        )
+
+    claimed = []
+    for event_id in candidate_ids:
+        updated = WebhookInboxEvent.objects.filter(event_id=event_id).filter(
+            status__in=["pending", "processing", "deferred"]
+        ).exclude(
+            status="processing", locked_at__gte=stale_before
+        ).update(status="processing", locked_at=now, attempts=F("attempts") + 1)
+        if updated:
+            claimed.append(event_id)
+
+    if not claimed:
+        return []
+    return list(WebhookInboxEvent.objects.filter(event_id__in=claimed).order_by("received_at"))
+
+
+def process_event(event):
+    """
+    Run one inbox event through the webhook pipeline and record the outcome.
+    """
+    from .admission import track
+    from .whatsapp_webhook import process_webhook_payload
+
+    try:
+        top = json.loads(event.raw_body) if (event.raw_body or "").strip() else {}
+        with track():
+            outcome = process_webhook_payload(top)
+        WebhookInboxEvent.objects.filter(event_id=event.event_id).update(
+            status="done",
+            processed_at=dj_timezone.now(),
+            last_error=None,
+        )
+        return outcome
+    except Exception as e:
+        logger.error("Inbox event %s failed (attempt %s): %s", event.event_id, event.attempts, e, exc_info=True)
+        # Retry until MAX_ATTEMPTS, then park as failed for manual inspection.
+        next_status = "failed" if event.attempts >= MAX_ATTEMPTS else "pending"
+        WebhookInboxEvent.objects.filter(event_id=event.event_id).update(
+            status=next_status,
+            last_error=str(e)[:1000],
+            locked_at=None,
+        )
+        return "error"
+
+
+def drain_once(batch_size=10):
+    """Claim and process one batch. Returns the number of events handled."""
+    events = claim_events(limit=batch_size)
+    for event in events:
+        process_event(event)
+    return len(events)
+
+
+def inbox_lag_stats():
+    """
+    Summary used by the inbox status view and the worker command.
+    """
+    now = dj_timezone.now()
+    pending = WebhookInboxEvent.objects.filter(status="pending")
+    oldest = pending.aggregate(oldest=Min("received_at"))["oldest"]
+    recent_window = now - timedelta(minutes=5)
+    return {
+        "pending": pending.count(),
+        "processing": WebhookInboxEvent.objects.filter(status="processing").count(),
+        "deferred": WebhookInboxEvent.objects.filter(status="deferred").count(),
+        "failed": WebhookInboxEvent.objects.filter(status="failed").count(),
+        "done_last_5m": WebhookInboxEvent.objects.filter(status="done", processed_at__gte=recent_window).count(),
+        "oldest_pending_at": oldest.isoformat() if oldest else None,
+        "lag_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+
+def purge_processed(older_than_hours=72):
+    """Delete finished events older than the retention window."""
+    cutoff = dj_timezone.now() - timedelta(hours=older_than_hours)
+    deleted, _ = WebhookInboxEvent.objects.filter(status="done", processed_at__lt=cutoff).delete()
+    return deleted
+
+
+class InboxWorkerPool:
+    """
+    Pool of threads draining the inbox. Used by both the in-process workers and
+    the `run_inbox_workers` management command.
+    """
+
+    def __init__(self, size=2, batch_size=10, poll_interval=1.0, name="inbox"):
+        self.size = max(1, int(size))
+        self.batch_size = max(1, int(batch_size))
+        self.poll_interval = float(poll_interval)
+        self.name = name
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("Inbox worker pool started: %s threads (%s)", self.size, self.worker_id)
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        _wakeup.set()
+        for t in self._threads:
+            t.join(timeout=timeout)
+
+    def is_alive(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                handled = 0
+                try:
+                    close_old_connections()
+                    handled = drain_once(batch_size=self.batch_size)
+                except Exception as e:
+                    logger.error("Inbox worker loop error: %s", e, exc_info=True)
+                    time.sleep(self.poll_interval)
+                if not handled:
+                    _wakeup.wait(self.poll_interval)
+                    _wakeup.clear()
+        finally:
+            connection.close()
+
+
+def ensure_inprocess_workers():
+    """
+    Lazily start the in-process worker pool (once per process).
+    """
+    global _inprocess_pool
+    size = int(os.getenv("WABOT_INBOX_INPROCESS_WORKERS", "2") or 0)
+    if size <= 0:
+        return None
+    if _inprocess_pool is not None and _inprocess_pool.is_alive():
+        return _inprocess_pool
+    with _inprocess_lock:
+        if _inprocess_pool is None or not _inprocess_pool.is_alive():
+            _inprocess_pool = InboxWorkerPool(size=size, name="inbox-inprocess").start()
+    return _inprocess_pool
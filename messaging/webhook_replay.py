@@ -0,0 +1,306 @@
+"""
+Webhook payload recording + replay/load-test harness.
+
+Recording (`record_webhook_payloads`) exports inbox payloads to JSONL after
+sanitizing them: phone numbers are remapped consistently, push names replaced,
+media URLs/keys/thumbnails stubbed and long digit runs (NRIC, order numbers) in
+message text masked. Each line is {"offset_ms", "instance_id", "payload"}.
+
+Replay (`replay_webhook_payloads`) fires those payloads at the webhook, either at a
+running server over HTTP or in-process through the Django test client. In-process
+runs stub WABot sends and receipt OCR ("Vision") with fixed latencies and count
+DB queries across every thread, so the report covers latency percentiles, error
+rate and queries per message.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+# Phone JIDs are remapped; any other run of 6+ digits (NRIC, order numbers) is masked.
+_JID_OR_DIGITS_RE = re.compile(r"(\d{5,15})(@s\.whatsapp\.net|@c\.us)|\d{6,}")
+_EMAIL_RE = re.compile(r"[\w.+-]+@(?!s\.whatsapp\.net|c\.us|g\.us)[\w-]+\.[\w.]+")
+
+_MEDIA_STUB_FIELDS = {
+    "url": "https://stub.invalid/media",
+    "directPath": "/stub/media",
+    "mediaKey": "c3R1Yg==",
+    "fileEncSha256": "c3R1Yg==",
+    "jpegThumbnail": "",
+}
+
+
+# =============================================================================
+# SANITIZING
+# =============================================================================
+
+class PayloadSanitizer:
+    """Replaces PII in webhook payloads; the same input phone always maps to the same fake."""
+
+    def __init__(self, salt=None):
+        self.salt = salt or uuid.uuid4().hex
+        self._phones = {}
+        self._names = {}
+
+    def phone(self, number):
+        fake = self._phones.get(number)
+        if fake is None:
+            h = int(hashlib.blake2b(f"{self.salt}:{number}".encode(), digest_size=6).hexdigest(), 16)
+            fake = "6000" + str(h % 10 ** 8).zfill(8)
+            self._phones[number] = fake
+        return fake
+
+    def _replace_digits(self, match):
+        if match.group(2):
+            return self.phone(match.group(1)) + match.group(2)
+        digits = match.group(0)
+        digest = hashlib.blake2b(f"{self.salt}:{digits}".encode(), digest_size=8).hexdigest()
+        return str(int(digest, 16))[: len(digits)].rjust(len(digits), "0")
+
+    def text(self, value):
+        value = _EMAIL_RE.sub("user@example.com", value)
+        return _JID_OR_DIGITS_RE.sub(self._replace_digits, value)
+
+    def sanitize(self, obj, key=None):
+        if isinstance(obj, dict):
+            out = {}
+            for k, v in obj.items():
+                if k in _MEDIA_STUB_FIELDS and isinstance(v, str):
+                    out[k] = _MEDIA_STUB_FIELDS[k] if v else v
+                elif k == "pushName" and isinstance(v, str):
+                    out[k] = self._names.setdefault(v, f"Participant {len(self._names) + 1}")
+                else:
+                    out[k] = self.sanitize(v, k)
+            return out
+        if isinstance(obj, list):
+            return [self.sanitize(v, key) for v in obj]
+        if isinstance(obj, str):
+            return self.text(obj)
+        return obj
+
+
+def message_count(payload):
+    """Number of inbound messages carried by one webhook payload."""
+    from .webhook_events import unwrap_event
+
+    _, event_data, _ = unwrap_event(payload if isinstance(payload, dict) else {})
+    return len(event_data) if isinstance(event_data, list) else 1
+
+
+def with_unique_msg_ids(payload, suffix):
+    """Copy of `payload` whose message ids are suffixed, so replays are not deduped."""
+    payload = copy.deepcopy(payload)
+
+    def walk(obj):
+        if isinstance(obj, dict):
+            key = obj.get("key")
+            if isinstance(key, dict) and key.get("id"):
+                key["id"] = f"{key['id']}-{suffix}"
+            for v in obj.values():
+                walk(v)
+        elif isinstance(obj, list):
+            for v in obj:
+                walk(v)
+
+    walk(payload)
+    return payload
+
+
+def load_records(path):
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+# =============================================================================
+# STUB BACKENDS + QUERY COUNTING
+# =============================================================================
+
+@contextmanager
+def stub_backends(wabot_latency_ms=50, vision_latency_ms=800):
+    """
+    Swap WABot sends, media prefetch downloads and receipt OCR for fixed-latency
+    stubs for the duration.
+    """
+    from . import media_cache
+    from .async_whatsapp_service import AsyncWhatsAppAPIService
+    from .whatsapp_service import WhatsAppAPIService
+    from .receipt_ocr_service import ReceiptOCRService
+
+    def _send(self, number, message, *args, **kwargs):
+        time.sleep(wabot_latency_ms / 1000.0)
+        return {"success": True, "message_id": f"stub-{uuid.uuid4().hex[:12]}", "stub": True}
+
+    async def _async_post(self, job):
+        # Outbox dispatchers send through the async client
+        await asyncio.sleep(wabot_latency_ms / 1000.0)
+        return {"success": True, "message_id": f"stub-{uuid.uuid4().hex[:12]}", "stub": True}
+
+    def _fetch_media(url, media_meta, media_kind="image"):
+        # Recorded media URLs are stubbed; pretend the CDN answered.
+        time.sleep(wabot_latency_ms / 1000.0)
+        return Path(os.devnull)
+
+    def _ocr_init(self):
+        # No Vision client in stub mode
+        self.ocr_service = None
+        self.ocr_available = True
+
+    def _ocr(self, image_url, media_meta=None, fallback_city=None, fallback_state=None):
+        time.sleep(vision_latency_ms / 1000.0)
+        result = {
+            "success": True,
+            "amount_spent": "RM149.00",
+            "store_name": "Stub Electrical",
+            "store_location": "Kuala Lumpur",
+            "products": [("KHIND Stub Fan", 1)],
+            "validity": "VALID",
+            "reason": "",
+        }
+        result["formatted_message"] = self._format_receipt_message(result)
+        return result
+
+    patched = [
+        (WhatsAppAPIService, "send_text_message", _send),
+        (WhatsAppAPIService, "send_media_message", _send),
+        (WhatsAppAPIService, "send_template_message", _send),
+        (AsyncWhatsAppAPIService, "_post", _async_post),
+        (media_cache, "fetch_to_cache", _fetch_media),
+        (ReceiptOCRService, "__init__", _ocr_init),
+        (ReceiptOCRService, "process_receipt_image", _ocr),
+    ]
+    originals = [(cls, name, cls.__dict__[name]) for cls, name, _ in patched]
+    try:
+        for cls, name, fn in patched:
+            setattr(cls, name, fn)
+        yield
+    finally:
+        for cls, name, fn in originals:
+            setattr(cls, name, fn)
+
+
+class QueryCounter:
+    """Counts SQL statements on every DB connection (all threads) while installed."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._ignored = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        if threading.get_ident() not in self._ignored:
+            with self._lock:
+                self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def ignoring_current_thread(self):
+        """Don't count the harness's own bookkeeping queries."""
+        self._ignored.add(threading.get_ident())
+        try:
+            yield
+        finally:
+            self._ignored.discard(threading.get_ident())
+
+    def _attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @contextmanager
+    def installed(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        connection_created.connect(self._attach, weak=False)
+        # Connections that already exist on other threads are not reachable from here;
+        # close_old_connections() in worker loops makes them reconnect through the signal.
+        for conn in connections.all():
+            self._attach(connection=conn)
+        try:
+            yield self
+        finally:
+            connection_created.disconnect(self._attach)
+            for conn in connections.all():
+                if self in conn.execute_wrappers:
+                    conn.execute_wrappers.remove(self)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+class ReplayRunner:
+    """
+    Paces `count` requests at `rps` (0 = unpaced) with at most `concurrency` in flight.
+    `send(payload)` must return (ok, latency_seconds).
+    """
+
+    def __init__(self, records, send, rps=10.0, concurrency=4, count=None):
+        self.records = records
+        self.send = send
+        self.rps = float(rps)
+        self.concurrency = max(1, int(concurrency))
+        self.count = int(count or len(records))
+        self.latencies = []
+        self.errors = 0
+        self.messages = 0
+        self.run_id = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+
+    def _one(self, n, slots):
+        record = self.records[n % len(self.records)]
+        payload = with_unique_msg_ids(record["payload"], f"{self.run_id}-{n}")
+        try:
+            ok, latency = self.send(payload)
+        except Exception:
+            ok, latency = False, 0.0
+        with self._lock:
+            self.latencies.append(latency)
+            self.messages += message_count(payload)
+            if not ok:
+                self.errors += 1
+        slots.release()
+
+    def run(self):
+        from django.db import close_old_connections
+
+        slots = threading.BoundedSemaphore(self.concurrency)
+        threads = []
+        interval = 1.0 / self.rps if self.rps > 0 else 0.0
+        started = time.perf_counter()
+
+        def worker(n):
+            try:
+                self._one(n, slots)
+            finally:
+                close_old_connections()
+
+        for n in range(self.count):
+            if interval:
+                delay = started + n * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            t = threading.Thread(target=worker, args=(n,), daemon=True)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        self.elapsed = time.perf_counter() - started
+        return self
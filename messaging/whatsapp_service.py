@@ -3,6 +3,10 @@ import json
 import os
 from django.conf import settings
 
+# All WABot HTTP goes through the pooled keep-alive session (default connect/read timeouts).
+from . import wabot_http
+from .circuit_breaker import count_rejected, get_breaker, is_provider_failure
+
 class WhatsAppAPIService:
     """Service class to handle WhatsApp API communications"""
     
@@ -12,6 +16,17 @@ class WhatsAppAPIService:
         self.instance_id = os.getenv('WABOT_INSTANCE_ID', '68A0A11A89A8D')
         self.base_url = os.getenv('WABOT_API_URL', 'https://app.wabot.my/api')
 
+    @classmethod
+    def for_connection(cls, connection):
+        """Service using a WhatsAppConnection's instance and token (env defaults when None)."""
+        service = cls()
+        if connection is not None:
+            service.instance_id = connection.instance_id or service.instance_id
+            # The ref names an env var holding the token; setup scripts store the token itself
+            ref = (connection.access_token_ref or '').strip()
+            service.access_token = os.getenv(ref, ref) if ref else service.access_token
+        return service
+
     def _send_disabled(self):
         """
         Emergency stop switch to prevent spamming users during debugging.
@@ -41,6 +56,42 @@ class WhatsAppAPIService:
     #     except requests.exceptions.RequestException as e:
     #         return {'success': False, 'error': str(e)}
     
+    def build_send_payload(self, number, message_type, **fields):
+        """JSON body for WABot /send (shared with AsyncWhatsAppAPIService)."""
+        # Clean the phone number (remove + and any non-digits)
+        clean_number = ''.join(filter(str.isdigit, number))
+        payload = {"number": clean_number, "type": message_type}
+        payload.update(fields)
+        payload["instance_id"] = self.instance_id
+        payload["access_token"] = self.access_token
+        return payload
+    
+    @property
+    def breaker(self):
+        """Circuit breaker shared by every sender on this WABot instance."""
+        return get_breaker(self.instance_id)
+    
+    def _post_send(self, payload):
+        """POST /send through the instance's circuit breaker."""
+        breaker = self.breaker
+        if not breaker.allow():
+            count_rejected()
+            return {'success': False, 'error': 'WABot circuit open', 'circuit_open': True,
+                    'retry_after': breaker.retry_after()}
+        try:
+            response = wabot_http.post(
+                f"{self.base_url}/send",
+                data=json.dumps(payload),
+                headers={'Content-Type': 'application/json'}
+            )
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            breaker.record(not is_provider_failure(getattr(e.response, 'status_code', None)))
+            return {'success': False, 'error': str(e)}
+        breaker.record(True)
+        return {'success': True, 'data': data}
+    
     def set_webhook(self, webhook_url, enable=True):
         """Set webhook for receiving WhatsApp events"""
         url = f"{self.base_url}/set_webhook"
@@ -52,7 +103,7 @@ class WhatsAppAPIService:
         }
         
         try:
-            response = requests.post(url, params=params)
+            response = wabot_http.post(url, params=params)
             response.raise_for_status()
             return {'success': True, 'data': response.json()}
         except requests.exceptions.RequestException as e:
@@ -63,62 +114,20 @@ class WhatsAppAPIService:
         if self._send_disabled():
             return {'success': False, 'error': 'WABOT_DISABLE_SEND is true (outbound sending disabled)'}
 
-        url = f"{self.base_url}/send"
-        
-        # Clean the phone number (remove + and any non-digits)
-        clean_number = ''.join(filter(str.isdigit, number))
+        payload = self.build_send_payload(number, "text", message=message)
         
-        payload = {
-            "number": clean_number,
-            "type": "text",
-            "message": message,
-            "instance_id": self.instance_id,
-            "access_token": self.access_token
-        }
-        
-        try:
-            response = requests.post(
-                url, 
-                data=json.dumps(payload),
-                headers={'Content-Type': 'application/json'}
-            )
-            response.raise_for_status()
-            return {'success': True, 'data': response.json()}
-        except requests.exceptions.RequestException as e:
-            return {'success': False, 'error': str(e)}
+        return self._post_send(payload)
     
     def send_media_message(self, number, message, media_url, filename=None):
         """Send a media message to a phone number"""
         if self._send_disabled():
             return {'success': False, 'error': 'WABOT_DISABLE_SEND is true (outbound sending disabled)'}
 
-        url = f"{self.base_url}/send"
-        
-        # Clean the phone number (remove + and any non-digits)
-        clean_number = ''.join(filter(str.isdigit, number))
-        
-        payload = {
-            "number": clean_number,
-            "type": "media",
-            "message": message,
-            "media_url": media_url,
-            "instance_id": self.instance_id,
-            "access_token": self.access_token
-        }
-        
+        payload = self.build_send_payload(number, "media", message=message, media_url=media_url)
         if filename:
             payload["filename"] = filename
         
-        try:
-            response = requests.post(
-                url, 
-                data=json.dumps(payload),
-                headers={'Content-Type': 'application/json'}
-            )
-            response.raise_for_status()
-            return {'success': True, 'data': response.json()}
-        except requests.exceptions.RequestException as e:
-            return {'success': False, 'error': str(e)}
+        return self._post_send(payload)
     
     def set_instance_id(self, instance_id):
         """Manually set instance ID if you already have one"""
@@ -134,7 +143,7 @@ class WhatsAppAPIService:
         }
         
         try:
-            response = requests.get(url, params=params)
+            response = wabot_http.get(url, params=params)
             response.raise_for_status()
             data = response.json()
             
@@ -149,7 +158,7 @@ class WhatsAppAPIService:
     def download_media(self, media_url):
         """Download media content from URL"""
         try:
-            response = requests.get(media_url)
+            response = wabot_http.get(media_url)
             response.raise_for_status()
             return response.content
         except requests.exceptions.RequestException as e:
@@ -160,32 +169,11 @@ class WhatsAppAPIService:
         if self._send_disabled():
             return {'success': False, 'error': 'WABOT_DISABLE_SEND is true (outbound sending disabled)'}
 
-        url = f"{self.base_url}/send"
-        
-        # Clean the phone number
-        clean_number = ''.join(filter(str.isdigit, number))
-        
-        payload = {
-            "number": clean_number,
-            "type": "template",
-            "template_name": template_name,
-            "instance_id": self.instance_id,
-            "access_token": self.access_token
-        }
-        
+        payload = self.build_send_payload(number, "template", template_name=template_name)
         if parameters:
             payload["parameters"] = parameters
         
-        try:
-            response = requests.post(
-                url, 
-                data=json.dumps(payload),
-                headers={'Content-Type': 'application/json'}
-            )
-            response.raise_for_status()
-            return {'success': True, 'data': response.json()}
-        except requests.exceptions.RequestException as e:
-            return {'success': False, 'error': str(e)}
+        return self._post_send(payload)
     
     def get_instance_status(self):
         """Get instance status and QR code"""
@@ -196,7 +184,7 @@ class WhatsAppAPIService:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=20)
+            response = wabot_http.get(url, params=params, timeout=20)
             response.raise_for_status()
             try:
                 data = response.json()
@@ -223,7 +211,7 @@ class WhatsAppAPIService:
         }
         
         try:
-            response = requests.get(url, params=params)
+            response = wabot_http.get(url, params=params)
             response.raise_for_status()
             return {'success': True, 'data': response.json()}
         except requests.exceptions.RequestException as e:
@@ -175,6 +175,9 @@ CSRF_COOKIE_HTTPONLY = False  # Allow JavaScript access for AJAX
 CSRF_COOKIE_SAMESITE = 'Lax'  # More permissive for App Engine
 
 # Logging configuration for App Engine
+# WABOT_WEBHOOK_LOG_LEVEL=DEBUG enables the per-request webhook diagnostics (sampled).
+WABOT_WEBHOOK_LOG_LEVEL = os.environ.get('WABOT_WEBHOOK_LOG_LEVEL', 'INFO').upper()
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -193,6 +196,9 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
+        'json_async': {
+            'class': 'messaging.structured_logging.AsyncJsonHandler',
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -209,52 +215,15 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        # Webhook + contest hot paths: one JSON line per event, written off-thread.
         'messaging.whatsapp_webhook': {
-            'handlers': ['console'],
-            'level': 'INFO',
+            'handlers': ['json_async'],
+            'level': WABOT_WEBHOOK_LOG_LEVEL,
             'propagate': False,
         },
-    },
-}
-
-# Logging configuration for App Engine
-LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '[{levelname}] {asctime} {name} {message}',
-            'style': '{',
-        },
-        'simple': {
-            'format': '{levelname} {message}',
-            'style': '{',
-        },
-    },
-    'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
-        },
-    },
-    'root': {
-        'handlers': ['console'],
-        'level': 'INFO',
-    },
-    'loggers': {
-        'django': {
-            'handlers': ['console'],
-            'level': 'INFO',
-            'propagate': False,
-        },
-        'messaging': {
-            'handlers': ['console'],
-            'level': 'INFO',
-            'propagate': False,
-        },
-        'messaging.whatsapp_webhook': {
-            'handlers': ['console'],
-            'level': 'INFO',
+        'messaging.step_by_step_contest_service': {
+            'handlers': ['json_async'],
+            'level': WABOT_WEBHOOK_LOG_LEVEL,
             'propagate': False,
         },
     },